@@ -0,0 +1,89 @@
+import logging
+from typing import Optional
+
+from sqlalchemy import delete, func, insert as plain_insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import async_session, read_session, is_postgres
+from models import Bid, BidArchive, Lot, LotResult
+
+logger = logging.getLogger(__name__)
+
+insert = postgresql.insert if is_postgres else sqlite.insert
+
+# сколько лотов дозакрывать за проход при старте
+BACKFILL_BATCH = 100
+
+
+async def archive_lot(session, lot_id: int) -> Optional[tuple[int, int]]:
+    """
+    Перенести ставки закрытого лота из bids в bids_archive и записать его итог в lot_results.
+    Работает в транзакции вызывающего: вместе с auction_ended = True ставки либо успели
+    попасть в bids и уедут в архив, либо не пройдут проверку цены в UPDATE.
+    Возвращает (победитель, сумма) или None, если ставок не было.
+    """
+    stats = (await session.execute(
+        select(func.count(), func.min(Bid.created_at), func.max(Bid.created_at))
+        .where(Bid.lot_id == lot_id)
+    )).one()
+    winner = (await session.execute(
+        select(Bid.user_id, Bid.amount)
+        .where(Bid.lot_id == lot_id)
+        .order_by(Bid.amount.desc(), Bid.id)
+        .limit(1)
+    )).first()
+
+    if stats[0]:
+        columns = ["bid_id", "lot_id", "user_id", "amount", "created_at"]
+        await session.execute(
+            plain_insert(BidArchive).from_select(
+                columns,
+                select(Bid.id, Bid.lot_id, Bid.user_id, Bid.amount, Bid.created_at).where(Bid.lot_id == lot_id)
+                .order_by(Bid.id)
+            )
+        )
+        await session.execute(delete(Bid).where(Bid.lot_id == lot_id))
+
+    # повторное закрытие (например, дозакрытие после падения) итог не затирает
+    await session.execute(
+        insert(LotResult)
+        .values(
+            lot_id=lot_id,
+            winner_id=winner.user_id if winner else None,
+            final_amount=winner.amount if winner else None,
+            bid_count=stats[0],
+            first_bid_at=stats[1],
+            last_bid_at=stats[2],
+        )
+        .on_conflict_do_nothing(index_elements=["lot_id"])
+    )
+    return (winner.user_id, winner.amount) if winner else None
+
+
+async def archive_ended_lots() -> int:
+    """Перенести в архив ставки лотов, закрытых до появления архива. Возвращает число лотов."""
+    archived = 0
+    while True:
+        async with async_session() as session:
+            lot_ids = (await session.scalars(
+                select(Bid.lot_id)
+                .join(Lot, Lot.id == Bid.lot_id)
+                .where(Lot.auction_ended == True)
+                .distinct()
+                .limit(BACKFILL_BATCH)
+            )).all()
+            if not lot_ids:
+                break
+            for lot_id in lot_ids:
+                await archive_lot(session, lot_id)
+            await session.commit()
+        archived += len(lot_ids)
+
+    if archived:
+        logger.info("Archived bids of %s ended lots", archived)
+    return archived
+
+
+async def get_lot_result(lot_id: int) -> Optional[LotResult]:
+    async with read_session() as session:
+        return await session.get(LotResult, lot_id)
@@ -0,0 +1,168 @@
+from collections import OrderedDict
+from html import escape
+from typing import Callable, Optional
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.formatting import as_marked_section, Bold
+from sqlalchemy import select
+
+from config import settings
+from database import read_session
+from models import Lot
+from auctions.order_book import order_books
+
+# вместо цены в шаблон подставляется метка, по ней текст режется на две неизменные части
+PRICE_MARK = "\x00price\x00"
+
+# поля лота, из которых собираются карточки
+CARD_FIELDS = (
+    Lot.id, Lot.title, Lot.condition, Lot.repairs, Lot.battery,
+    Lot.memory, Lot.year, Lot.locks, Lot.current_price, Lot.start_price,
+)
+
+
+# Красивая карточка лота (HTML: текст продавца экранируется, иначе «<» в названии ломает сообщение)
+def _lot_card(lot, price):
+    return (
+        f"📦 <b>{escape(str(lot.title))}</b>\n"
+        f"📝 {escape(str(lot.condition))}\n"
+        f"🛠 Ремонт:{escape(str(lot.repairs))}\n"
+        f"🔋 Аккумулятор: {escape(str(lot.battery))}\n"
+        f"💾 Память: {escape(str(lot.memory))}\n"
+        f"📅 Год покупки: {escape(str(lot.year))}\n"
+        f"🔒 Блокировки: {escape(str(lot.locks))}\n"
+        f"💰 <b>Стартовая цена:</b> {price}тг\n"
+        f"🆔 ID: <code>{lot.id}</code>"
+    )
+
+
+def _full_description(lot):
+    return (
+        f"💾 Память: {lot.memory}\n"
+        f"📅 Год покупки: {lot.year}\n"
+        f"📦 Состояние: {lot.condition}\n"
+        f"🔋 Аккумулятор: {lot.battery}\n"
+        f"🛠 Ремонт: {lot.repairs}\n"
+        f"🔒 Блокировки: {lot.locks}\n"
+        f"ID: {lot.id}"
+    )
+
+
+# Пост о лоте в канале аукциона
+def _channel_post(lot, price):
+    return as_marked_section(
+        Bold("🔥 Новый лот!"),
+        f"📱 {lot.title}",
+        _full_description(lot),
+        f"💰 Старт: {price}тг",
+        f"⏳ Торги начнутся через {settings.auction_duration_minutes/2} минут."
+    ).as_html()
+
+
+# Тот же пост, когда торги идут: цена меняется после каждой ставки
+def _live_post(lot, price):
+    return as_marked_section(
+        Bold("🔥 Идут торги!"),
+        f"📱 {lot.title}",
+        _full_description(lot),
+        f"💰 Текущая цена: {price}тг",
+    ).as_html()
+
+
+TEMPLATES: dict[str, Callable] = {
+    "card": _lot_card,
+    "channel": _channel_post,
+    "live": _live_post,
+}
+
+
+def get_bid_button_to_pm(lot_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="🔨 Поставить",
+                    url=f"https://t.me/{settings.bot_username}?start=lot_{lot_id}"
+                )
+            ]
+        ]
+    )
+
+
+class CardCache:
+    """
+    Отрисованные карточки лотов по (шаблон, lot_id, версия): статичная часть
+    хранится готовой, при выводе подставляется только текущая цена.
+    Версия растёт при invalidate — так старая отрисовка не вернётся в кэш.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._parts: OrderedDict[tuple, tuple[str, str]] = OrderedDict()
+        self._versions: dict[int, int] = {}
+
+    def _key(self, kind: str, lot_id: int) -> tuple:
+        return kind, lot_id, self._versions.get(lot_id, 0)
+
+    def get(self, kind: str, lot_id: int, price: int) -> Optional[str]:
+        key = self._key(kind, lot_id)
+        parts = self._parts.get(key)
+        if parts is None:
+            return None
+        self._parts.move_to_end(key)
+        return f"{parts[0]}{price}{parts[1]}"
+
+    def render(self, kind: str, lot, price: Optional[int] = None) -> str:
+        if price is None:
+            price = lot.current_price or lot.start_price
+        cached = self.get(kind, lot.id, price)
+        if cached is not None:
+            return cached
+
+        head, _, tail = TEMPLATES[kind](lot, PRICE_MARK).partition(PRICE_MARK)
+        self._parts[self._key(kind, lot.id)] = (head, tail)
+        while len(self._parts) > self.max_size:
+            self._parts.popitem(last=False)
+        return f"{head}{price}{tail}"
+
+    def invalidate(self, lot_id: int):
+        self._versions[lot_id] = self._versions.get(lot_id, 0) + 1
+        for key in [key for key in self._parts if key[1] == lot_id]:
+            del self._parts[key]
+
+    def forget(self, lot_id: int):
+        """Лот больше не показывается (аукцион закрыт) — освобождаем память."""
+        self.invalidate(lot_id)
+        self._versions.pop(lot_id, None)
+
+
+card_cache = CardCache(settings.card_cache_size)
+
+
+def format_lot_card(lot, price: Optional[int] = None) -> str:
+    return card_cache.render("card", lot, price)
+
+
+def format_channel_post(lot, price: Optional[int] = None) -> str:
+    return card_cache.render("channel", lot, price)
+
+
+async def get_lot_card(lot_id: int, kind: str = "card") -> Optional[tuple[str, int]]:
+    """
+    Карточка лота и его текущая цена или None, если лота нет.
+    Цена берётся из книги заявок, если она есть, — тогда повторный показ обходится без БД.
+    """
+    book = order_books.get(lot_id)
+    if book:
+        card = card_cache.get(kind, lot_id, book.current_price)
+        if card is not None:
+            return card, book.current_price
+
+    async with read_session() as session:
+        row = (await session.execute(select(*CARD_FIELDS).where(Lot.id == lot_id))).first()
+    if row is None:
+        return None
+    # книга могла обновиться, пока читали
+    book = order_books.get(lot_id)
+    price = book.current_price if book else (row.current_price or row.start_price)
+    return card_cache.render(kind, row, price), price
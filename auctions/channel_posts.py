@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
+from sqlalchemy import select, update
+
+from config import settings
+from database import async_session, read_session
+from models import Lot
+from auctions.cards import format_channel_post, get_lot_card, get_bid_button_to_pm
+from auctions.order_book import order_books
+from auctions.scheduler import scheduler, END
+from services.fanout import fanout, TokenBucket
+from services import tracing
+
+logger = logging.getLogger(__name__)
+
+
+def format_remaining(ends_at: datetime) -> str:
+    seconds = int((ends_at - datetime.now(timezone.utc)).total_seconds())
+    if seconds < 60:
+        return "меньше минуты"
+    return f"{seconds // 60} мин"
+
+
+class ChannelPosts:
+    """
+    Один пост на лот в канале аукциона, который правится по ходу торгов:
+    цена, лидер и сколько осталось. Правки одного лота идут не чаще раза в interval
+    секунд — сколько бы ставок ни пришло, в канал уходит только последнее состояние.
+    Раз в tick_interval посты идущих торгов обновляются и без ставок — ради «осталось».
+    Все правки канала идут через свой bucket (per_minute в минуту) поверх общего лимита бота.
+    """
+
+    def __init__(self, chat_id: int, interval: float, tick_interval: float, per_minute: float):
+        self.chat_id = chat_id
+        self.interval = interval
+        self.tick_interval = tick_interval
+        self.bucket = TokenBucket(per_minute / 60, capacity=1)
+        self._message_ids: dict[int, Optional[int]] = {}
+        # lot_id -> (текст, кнопки) последней правки: такую же повторно не отправляем
+        self._shown: dict[int, tuple[str, Any]] = {}
+        self._last_edit: dict[int, float] = {}
+        # lot_id -> отложенная или идущая правка; задача остаётся здесь до конца правки
+        self._pending: dict[int, asyncio.Task] = {}
+        # лоты, состояние которых изменилось во время идущей правки
+        self._stale: set[int] = set()
+        # lot_id -> bot для постов идущих торгов, которые обновляет таймер
+        self._live: dict[int, Any] = {}
+        # лоты с итоговой правкой: их посты больше не трогаем
+        self._finished: dict[int, None] = {}
+        self._tick_task: Optional[asyncio.Task] = None
+
+    async def publish(self, bot, lot):
+        """Первый пост о лоте (после одобрения модератором)."""
+        await self.bucket.acquire()
+        await fanout.bucket.acquire()
+        post = await bot.send_message(self.chat_id, format_channel_post(lot, lot.start_price))
+        await self._save(lot.id, post.message_id)
+
+    def touch(self, bot, lot_id: int):
+        """Состояние лота изменилось — пост обновится, как только позволит интервал."""
+        if lot_id in self._finished:
+            return
+        self._live[lot_id] = bot
+        if self._tick_task is None or self._tick_task.done():
+            self._tick_task = tracing.background(self._tick())
+        if lot_id in self._pending:
+            self._stale.add(lot_id)
+            return
+        delay = max(0.0, self._last_edit.get(lot_id, 0.0) + self.interval - time.monotonic())
+        self._pending[lot_id] = tracing.background(self._update_later(bot, lot_id, delay))
+
+    def finish(self, bot, lot_id: int, result: str):
+        """Итог торгов: последняя правка без кнопки ставки, дальше лот не отслеживается."""
+        previous = self.drop(lot_id)
+        self._pending[lot_id] = tracing.background(self._finish(bot, lot_id, result, previous))
+
+    def drop(self, lot_id: int) -> Optional[asyncio.Task]:
+        """Перестать править пост лота: итог пишет процесс, закрывший торги. Возвращает отменённую правку."""
+        self._finished[lot_id] = None
+        if len(self._finished) > 10000:
+            for old in list(self._finished)[:1000]:
+                del self._finished[old]
+        self._live.pop(lot_id, None)
+        self._stale.discard(lot_id)
+        previous = self._pending.get(lot_id)
+        if previous:
+            previous.cancel()
+        return previous
+
+    async def close(self):
+        if self._tick_task:
+            self._tick_task.cancel()
+            await asyncio.gather(self._tick_task, return_exceptions=True)
+            self._tick_task = None
+        await asyncio.gather(*self._pending.values(), return_exceptions=True)
+
+    async def _tick(self):
+        while self._live:
+            await asyncio.sleep(self.tick_interval)
+            for lot_id, bot in list(self._live.items()):
+                self.touch(bot, lot_id)
+
+    async def _update_later(self, bot, lot_id: int, delay: float):
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                self._stale.discard(lot_id)
+                try:
+                    await self._update(bot, lot_id)
+                except Exception:
+                    logger.exception("ChannelPosts: failed to update post for lot %s", lot_id)
+                # ставки, пришедшие во время правки, — ещё одна правка через интервал
+                if lot_id not in self._stale:
+                    return
+                delay = self.interval
+        finally:
+            if self._pending.get(lot_id) is asyncio.current_task():
+                del self._pending[lot_id]
+
+    async def _update(self, bot, lot_id: int):
+        if lot_id in self._finished:
+            return
+        lot_card = await get_lot_card(lot_id, "live")
+        if not lot_card:
+            return
+        lines = [lot_card[0]]
+        book = order_books.get(lot_id)
+        if book and book.top_bidder:
+            lines.append(f"👤 Лидер: участник …{str(book.top_bidder)[-4:]}")
+        ends_at = scheduler.due_at(END, lot_id)
+        if ends_at:
+            lines.append(f"⏳ Осталось: {format_remaining(ends_at)}")
+        if lot_id in self._finished:
+            return
+        await self._edit(bot, lot_id, "\n".join(lines), get_bid_button_to_pm(lot_id))
+
+    async def _finish(self, bot, lot_id: int, result: str, previous: Optional[asyncio.Task]):
+        if previous:
+            # отменённая правка могла быть посреди запроса — итог должен лечь после неё
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            lot_card = await get_lot_card(lot_id, "live")
+            if lot_card:
+                await self._edit(bot, lot_id, f"{lot_card[0]}\n{result}", None)
+        except Exception:
+            logger.exception("ChannelPosts: failed to finish post for lot %s", lot_id)
+        finally:
+            if self._pending.get(lot_id) is asyncio.current_task():
+                del self._pending[lot_id]
+            self._message_ids.pop(lot_id, None)
+            self._last_edit.pop(lot_id, None)
+            self._shown.pop(lot_id, None)
+
+    async def _edit(self, bot, lot_id: int, text: str, markup):
+        if lot_id not in self._message_ids:
+            async with read_session() as session:
+                self._message_ids[lot_id] = await session.scalar(
+                    select(Lot.channel_message_id).where(Lot.id == lot_id)
+                )
+        message_id = self._message_ids[lot_id]
+        if message_id and self._shown.get(lot_id) == (text, markup):
+            return
+
+        for _ in range(fanout.max_retries + 1):
+            await self.bucket.acquire()
+            await fanout.bucket.acquire()
+            self._last_edit[lot_id] = time.monotonic()
+            try:
+                if message_id:
+                    try:
+                        await bot.edit_message_text(
+                            text, chat_id=self.chat_id, message_id=message_id, reply_markup=markup
+                        )
+                        self._shown[lot_id] = (text, markup)
+                        return
+                    except TelegramBadRequest as e:
+                        if "not modified" in str(e):
+                            self._shown[lot_id] = (text, markup)
+                            return
+                        # пост удалён или у старого лота его не было — публикуем заново
+                        logger.debug("ChannelPosts: edit failed for lot %s: %s", lot_id, e)
+                post = await bot.send_message(self.chat_id, text, reply_markup=markup)
+                self._shown[lot_id] = (text, markup)
+                await self._save(lot_id, post.message_id)
+                return
+            except TelegramRetryAfter as e:
+                # лимит канала, а не бота: личные сообщения продолжают уходить
+                self.bucket.pause(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+        logger.warning("ChannelPosts: giving up on post for lot %s", lot_id)
+
+    async def _save(self, lot_id: int, message_id: int):
+        self._message_ids[lot_id] = message_id
+        async with async_session() as session:
+            await session.execute(
+                update(Lot).where(Lot.id == lot_id).values(channel_message_id=message_id)
+            )
+            await session.commit()
+
+
+channel_posts = ChannelPosts(
+    settings.auction_channel_id,
+    settings.channel_edit_interval,
+    settings.channel_tick_interval,
+    settings.channel_messages_per_minute,
+)
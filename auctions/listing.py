@@ -0,0 +1,156 @@
+import time
+from typing import Optional
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy import select
+
+from config import settings
+from database import read_session
+from models import Lot, LotStatus
+from auctions.cards import CARD_FIELDS, TEMPLATES, card_cache
+
+# длинные ответы продавца режем, чтобы страница влезла в лимит сообщения Telegram
+MESSAGE_LIMIT = 4096
+# подписи и разметка карточки без пользовательских полей, с запасом
+CARD_OVERHEAD = 250
+# короче поля не режем, даже если страница из-за этого не влезет в одно сообщение
+MIN_FIELD_LIMIT = 20
+
+
+class PageCache:
+    """
+    Отрисованные страницы списка на несколько секунд; страница сбрасывается при смене цены её лота.
+    Курсор приходит из callback_data, поэтому страниц не больше max_pages: при переполнении
+    сначала уходят истёкшие, затем самые старые.
+    """
+
+    def __init__(self, ttl: float, max_pages: int):
+        self.ttl = ttl
+        self.max_pages = max(1, max_pages)
+        # (направление, курсор) -> (когда истекает, текст, клавиатура, id лотов)
+        self._pages: dict[tuple, tuple[float, str, Optional[InlineKeyboardMarkup], list[int]]] = {}
+        self._lot_pages: dict[int, set[tuple]] = {}
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, key: tuple):
+        page = self._pages.get(key)
+        if not page:
+            return None
+        if page[0] < time.monotonic():
+            self._drop(key)
+            return None
+        return page[1], page[2]
+
+    def put(self, key: tuple, text: str, markup, lot_ids: list[int]):
+        self._drop(key)
+        if len(self._pages) >= self.max_pages:
+            now = time.monotonic()
+            for old in [k for k, page in self._pages.items() if page[0] < now]:
+                self._drop(old)
+            # страницы добавляются по времени, первые в словаре — самые старые
+            while len(self._pages) >= self.max_pages:
+                self._drop(next(iter(self._pages)))
+        self._pages[key] = (time.monotonic() + self.ttl, text, markup, lot_ids)
+        for lot_id in lot_ids:
+            self._lot_pages.setdefault(lot_id, set()).add(key)
+
+    def invalidate_lot(self, lot_id: int):
+        for key in self._lot_pages.pop(lot_id, ()):
+            self._drop(key)
+
+    def clear(self):
+        self._pages.clear()
+        self._lot_pages.clear()
+
+    def _drop(self, key: tuple):
+        page = self._pages.pop(key, None)
+        if not page:
+            return
+        for lot_id in page[3]:
+            keys = self._lot_pages.get(lot_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._lot_pages[lot_id]
+
+
+page_cache = PageCache(settings.listing_cache_ttl, settings.listing_cache_pages)
+
+
+def _active_lots():
+    # карточки берутся из кэша, здесь нужны только id и цена
+    return select(Lot.id, Lot.current_price, Lot.start_price).where(
+        Lot.auction_ended == False,
+        Lot.status == LotStatus.approved,
+    )
+
+
+def _clip(row, limit: int):
+    values = row._asdict()
+    for name, value in values.items():
+        if isinstance(value, str) and len(value) > limit:
+            values[name] = value[:limit] + "…"
+    return type("LotCard", (), values)
+
+
+def _field_limit() -> int:
+    text_fields = sum(1 for column in CARD_FIELDS if column.type.python_type is str)
+    return max(MIN_FIELD_LIMIT, (MESSAGE_LIMIT // settings.listing_page_size - CARD_OVERHEAD) // text_fields)
+
+
+# карточка в списке — та же, но с обрезанными длинными полями
+TEMPLATES["list"] = lambda lot, price: TEMPLATES["card"](_clip(lot, _field_limit()), price)
+
+
+async def get_page(after_id: Optional[int] = None, before_id: Optional[int] = None):
+    """
+    Страница активных лотов по ключу (id), без OFFSET.
+    Возвращает (текст, клавиатура) или (None, None), если лотов нет.
+    """
+    key = ("prev", before_id) if before_id is not None else ("next", after_id)
+    cached = page_cache.get(key)
+    if cached:
+        return cached
+
+    size = settings.listing_page_size
+    query = _active_lots()
+    if before_id is not None:
+        query = query.where(Lot.id < before_id).order_by(Lot.id.desc())
+    else:
+        if after_id is not None:
+            query = query.where(Lot.id > after_id)
+        query = query.order_by(Lot.id)
+
+    async with read_session() as session:
+        rows = (await session.execute(query.limit(size + 1))).all()
+        prices = {row.id: row.current_price or row.start_price for row in rows[:size]}
+        cards = {lot_id: card_cache.get("list", lot_id, price) for lot_id, price in prices.items()}
+        missing = [lot_id for lot_id, card in cards.items() if card is None]
+        if missing:
+            for row in await session.execute(select(*CARD_FIELDS).where(Lot.id.in_(missing))):
+                cards[row.id] = card_cache.render("list", row, prices[row.id])
+
+    more = len(rows) > size
+    rows = rows[:size]
+    if before_id is not None:
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = after_id is not None, more
+
+    if not rows:
+        return None, None
+
+    text = "\n\n".join(cards[row.id] for row in rows if cards.get(row.id))
+
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"lots_prev_{rows[0].id}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Вперёд ➡️", callback_data=f"lots_next_{rows[-1].id}"))
+    markup = InlineKeyboardMarkup(inline_keyboard=[nav]) if nav else None
+
+    page_cache.put(key, text, markup, [row.id for row in rows])
+    return text, markup
@@ -1,101 +1,284 @@
 import asyncio
-from datetime import datetime, timedelta
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from sqlalchemy import text
+from sqlalchemy import update
+from sqlalchemy.future import select
 
-from database import async_session
-from models import Lot, Bid, Watcher
+from database import async_session, is_postgres
+from models import Lot, AuctionSchedule, LotStatus
 from config import settings
+from auctions.order_book import order_books, drop_book, publish_event
+from auctions.archive import archive_lot, archive_ended_lots
+from auctions.watchers import watcher_registry
+from auctions.scheduler import scheduler, START, END, as_utc
+from auctions.listing import page_cache
+from auctions.cards import card_cache
+from auctions.channel_posts import channel_posts
+from services.fanout import fanout
+from services.metrics import registry
+from services import tracing
+
+logger = logging.getLogger(__name__)
 
 active_auctions = {}  # lot_id -> bool (флаг, активен ли аукцион)
+# lot_id -> новое время окончания, ещё не записанное в БД
+pending_extensions: dict[int, datetime] = {}
+_extensions_task: Optional[asyncio.Task] = None
 
-def get_bid_button_to_pm(lot_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="🔨 Поставить",
-                    url=f"https://t.me/{settings.bot_username}?start=lot_{lot_id}"
-                )
-            ]
-        ]
-    )
+auctions_opened = registry.counter("auctions_opened_total", "Начатые торги")
+auctions_closed = registry.counter("auctions_closed_total", "Завершённые торги", ("result",))
+auction_extensions = registry.counter("auction_extensions_total", "Продления торгов из-за поздних ставок")
+registry.gauge("auction_events_scheduled", "События старта и конца торгов в расписании", fn=lambda: len(scheduler))
+
+async def start_auction(lot_id: int):
+    """Поставить одобренный лот в расписание: старт через половину длительности, затем торги."""
+    starts_at = datetime.now(timezone.utc) + timedelta(seconds=settings.auction_duration_minutes * 30)
+    ends_at = starts_at + timedelta(minutes=settings.auction_duration_minutes)
 
-async def start_auction(lot_id: int, bot):
     async with async_session() as session:
         lot = await session.get(Lot, lot_id)
         if not lot or lot.auction_started:
             return
+        if await session.get(AuctionSchedule, lot_id):
+            return
+        session.add(AuctionSchedule(lot_id=lot_id, starts_at=starts_at, ends_at=ends_at))
+        await session.commit()
+
+    scheduler.add(START, lot_id, starts_at)
+    scheduler.add(END, lot_id, ends_at)
+    # новый лот появляется в списке
+    page_cache.clear()
 
-        await asyncio.sleep(settings.auction_duration_minutes * 30)
-        lot.auction_started = True
-        lot.current_price = lot.start_price
+
+async def _traced(name: str, handler, lot_id: int, bot):
+    with tracing.trace(name, lot_id=lot_id):
+        await handler(lot_id, bot)
+
+
+async def restore_auctions(bot):
+    """Поднять расписание из БД после рестарта и запустить таймер."""
+    scheduler.on(START, lambda lot_id: _traced("auction.open", open_auction, lot_id, bot))
+    scheduler.on(END, lambda lot_id: _traced("auction.close", close_auction, lot_id, bot))
+
+    # ставки лотов, закрытых до появления архива (разово после обновления)
+    await archive_ended_lots()
+    await watcher_registry.prune_ended()
+
+    now = datetime.now(timezone.utc)
+    async with async_session() as session:
+        # лоты, одобренные до появления расписания
+        orphans = await session.execute(
+            select(Lot)
+            .outerjoin(AuctionSchedule, AuctionSchedule.lot_id == Lot.id)
+            .where(
+                Lot.status == LotStatus.approved,
+                Lot.auction_ended == False,
+                AuctionSchedule.lot_id.is_(None)
+            )
+        )
+        for lot in orphans.scalars().all():
+            session.add(AuctionSchedule(
+                lot_id=lot.id,
+                starts_at=now,
+                ends_at=now + timedelta(minutes=settings.auction_duration_minutes),
+                started=bool(lot.auction_started)
+            ))
         await session.commit()
 
+        pending = await session.execute(
+            select(AuctionSchedule).where(AuctionSchedule.finished == False)
+        )
+        schedules = pending.scalars().all()
 
+    for item in schedules:
+        if not item.started:
+            scheduler.add(START, item.lot_id, item.starts_at)
+        scheduler.add(END, item.lot_id, item.ends_at)
+    # подписчики идущих торгов — одним запросом, а не по первой ставке на каждый лот
+    await watcher_registry.load_many(item.lot_id for item in schedules if item.started)
+    # посты идущих торгов снова живые: «осталось» обновляется по таймеру
+    for item in schedules:
+        if item.started:
+            channel_posts.touch(bot, item.lot_id)
 
-    await bot.send_message(
-        settings.auction_channel_id,
-        f"Аукцион по лоту '{lot.title}' начался! Принимаются ставки.",
-        reply_markup=get_bid_button_to_pm(lot.id)
-    )
+    logger.info("Restored %s auctions", len(schedules))
+    scheduler.start()
 
 
-    #active_auctions[lot_id] = False
+def extend_on_bid(lot_id: int) -> Optional[datetime]:
+    """
+    Антиснайпинг: ставка в последние soft_close_seconds сдвигает конец торгов.
+    Переносится только запись в таймере, в БД новое время уходит пачкой в фоне.
+    """
+    if settings.soft_close_seconds <= 0:
+        return None
+    ends_at = scheduler.due_at(END, lot_id)
+    if not ends_at:
+        return None
+    now = datetime.now(timezone.utc)
+    if ends_at - now > timedelta(seconds=settings.soft_close_seconds):
+        return None
+    new_end = now + timedelta(seconds=settings.soft_close_extension_seconds)
+    if new_end <= ends_at:
+        return None
 
-    # Ждём время аукциона (например, 10 минут)
-    await asyncio.sleep(settings.auction_duration_minutes * 60)
+    scheduler.add(END, lot_id, new_end)
+    auction_extensions.inc()
+    pending_extensions[lot_id] = new_end
+    global _extensions_task
+    if _extensions_task is None or _extensions_task.done():
+        _extensions_task = asyncio.create_task(persist_extensions())
+    return new_end
 
-    #active_auctions[lot_id] = False
 
-    # Завершаем аукцион и объявляем победителя
+async def persist_extensions():
+    # даём накопиться продлениям, чтобы записать их одной транзакцией
+    await asyncio.sleep(1)
+    while pending_extensions:
+        batch = dict(pending_extensions)
+        pending_extensions.clear()
+        try:
+            async with async_session() as session:
+                await session.execute(
+                    update(AuctionSchedule),
+                    [{"lot_id": lot_id, "ends_at": ends_at} for lot_id, ends_at in batch.items()]
+                )
+                await session.commit()
+        except Exception:
+            logger.exception("persist_extensions: failed to save %s extensions", len(batch))
+
+
+async def open_auction(lot_id: int, bot):
     async with async_session() as session:
-        lot = await session.get(Lot, lot_id)
-        lot.auction_ended = True
+        # старт забирает один процесс: у остальных UPDATE после его commit не найдёт строку
+        result = await session.execute(
+            update(Lot)
+            .where(Lot.id == lot_id, Lot.auction_started.is_not(True))
+            .values(auction_started=True, current_price=Lot.start_price)
+            .returning(Lot.title, Lot.start_price)
+        )
+        lot = result.first()
+        if not lot:
+            return
+        await session.execute(
+            update(AuctionSchedule).where(AuctionSchedule.lot_id == lot_id).values(started=True)
+        )
+        if is_postgres:
+            await publish_event(session, "start", lot_id, lot.start_price)
         await session.commit()
+    auctions_opened.inc()
+
+    book = order_books.get(lot_id)
+    if book:
+        book.started = True
+        book.current_price = lot.start_price
+    page_cache.invalidate_lot(lot_id)
 
-        highest_bid = await session.execute(
-            # получить самую высокую ставку
-            text("SELECT * FROM bids WHERE lot_id = :lot_id ORDER BY amount DESC LIMIT 1"),
-            {"lot_id": lot_id}
+    # пост лота в канале становится живым: цена, лидер, время до конца и кнопка ставки
+    channel_posts.touch(bot, lot_id)
+
+    # подписчики лота загружаются в память здесь, дальше рассылки по ставкам идут без БД
+    watcher_ids = list(await watcher_registry.get(lot_id))
+    fanout.broadcast(
+        bot,
+        watcher_ids,
+        f"🔔 Аукцион по лоту #{lot_id} '{lot.title}' начался! Текущая цена {lot.start_price}тг"
+    )
+
+
+async def close_auction(lot_id: int, bot):
+    # Завершаем аукцион и объявляем победителя
+    async with async_session() as session:
+        # таймер мог стоять на старом времени: торги продлила ставка, принятая другим процессом
+        ends_at = await session.scalar(
+            select(AuctionSchedule.ends_at).where(AuctionSchedule.lot_id == lot_id)
         )
-        winner = highest_bid.first()
-
-        if winner:
-            winner_user_id = winner.user_id
-            amount = winner.amount
-
-            # кнопки для продавца
-            kb = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="✅ Согласиться", callback_data=f"accept_deal_{lot.id}_{winner_user_id}")],
-                [InlineKeyboardButton(text="❌ Отказаться", callback_data=f"reject_deal_{lot.id}_{winner_user_id}")]
-            ])
-
-            await bot.send_message(
-                lot.seller_id,
-                f"⚡ Аукцион завершён!\nПобедитель предложил {amount} тг за '{lot.title}'.\n"
-                f"Согласитесь на сделку и мы отправим Ваши контакты покупателю.",
-                reply_markup=kb
-            )
-            await bot.send_message(
-                settings.auction_channel_id,
-                f"Аукцион по лоту '{lot.title}' завершён! Победная ставка {amount} тг. "
-            )
+        if ends_at and as_utc(ends_at) > datetime.now(timezone.utc):
+            scheduler.add(END, lot_id, ends_at)
+            return
+
+        # закрытие забирает один процесс, архив и уведомления — только у него
+        result = await session.execute(
+            update(Lot)
+            .where(Lot.id == lot_id, Lot.auction_ended.is_not(True))
+            .values(auction_ended=True)
+            .returning(Lot.id, Lot.title, Lot.seller_id, Lot.current_price)
+        )
+        lot = result.first()
+        if not lot:
+            return
+        await session.execute(
+            update(AuctionSchedule).where(AuctionSchedule.lot_id == lot_id).values(finished=True)
+        )
+        pending_extensions.pop(lot_id, None)
+        # победитель считается по ставкам, которые в той же транзакции уходят в архив
+        winner = await archive_lot(session, lot_id)
+        await watcher_registry.prune(session, lot_id)
+        if is_postgres:
+            await publish_event(session, "end", lot_id, winner[1] if winner else lot.current_price or 0)
+        await session.commit()
+
+        # ставки после этого commit не пройдут проверку в UPDATE, книгу закрываем
+        drop_book(lot_id)
+        fanout.forget(lot_id)
+        page_cache.invalidate_lot(lot_id)
+        card_cache.forget(lot_id)
+
+        auctions_closed.inc(result="sold" if winner else "unsold")
+        with tracing.span("auction.notify", sold=bool(winner)):
+            if winner:
+                winner_user_id, amount = winner
+
+                # кнопки для продавца
+                kb = InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="✅ Согласиться", callback_data=f"accept_deal_{lot.id}_{winner_user_id}")],
+                    [InlineKeyboardButton(text="❌ Отказаться", callback_data=f"reject_deal_{lot.id}_{winner_user_id}")]
+                ])
+
+                fanout.send(
+                    bot,
+                    lot.seller_id,
+                    f"⚡ Аукцион завершён!\nПобедитель предложил {amount} тг за '{lot.title}'.\n"
+                    f"Согласитесь на сделку и мы отправим Ваши контакты покупателю.",
+                    reply_markup=kb
+                )
+                channel_posts.finish(bot, lot_id, f"🏁 Аукцион завершён! Победная ставка {amount} тг.")
+
+                fanout.send(
+                    bot,
+                    winner_user_id,
+                    f"🎉 Поздравляем!!!\nВы выйграли лот '{lot.title}' за {amount} тг\nЕсли продавец согласится на Вашу ставку, мы пришлем Вам его контактный номер."
+                )
+            else:
+                channel_posts.finish(bot, lot_id, "🏁 Аукцион завершён без ставок.")
+                fanout.send(
+                    bot,
+                    lot.seller_id,
+                    f"Аукцион по Вашему лоту '{lot.title}' завершён без ставок."
+                )
+
 
-            await bot.send_message(
-                winner_user_id,
-                f"🎉 Поздравляем!!!\nВы выйграли лот '{lot.title}' за {amount} тг\nЕсли продавец согласится на Вашу ставку, мы пришлем Вам его контактный номер."
-            )
-        else:
-            await bot.send_message(
-                settings.auction_channel_id,
-                f"Аукцион по лоту '{lot.title}' завершён без ставок."
-            )
-            await bot.send_message(
-                lot.seller_id,
-                f"Аукцион по Вашему лоту '{lot.title}' завершён без ставок."
-            )
 
 
 
+def apply_remote_event(kind: str, lot_id: int, price: int):
+    """Торги лота открыл (start) или закрыл (end) другой процесс бота — приходит через LISTEN/NOTIFY."""
+    book = order_books.get(lot_id)
+    if kind == "start":
+        scheduler.cancel(START, lot_id)
+        if book:
+            book.started = True
+            book.current_price = max(book.current_price, price)
+    elif kind == "end":
+        scheduler.cancel(END, lot_id)
+        pending_extensions.pop(lot_id, None)
+        drop_book(lot_id)
+        fanout.forget(lot_id)
+        watcher_registry.mark_ended(lot_id)
+        # итоговую правку поста делает закрывший процесс, здесь только перестаём его трогать
+        channel_posts.drop(lot_id)
+    page_cache.invalidate_lot(lot_id)
+    card_cache.forget(lot_id)
@@ -0,0 +1,185 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import update, insert, func, text
+
+from database import async_session, read_session, is_postgres
+from models import Lot, Bid
+
+logger = logging.getLogger(__name__)
+
+PRICE_CHANNEL = "lot_prices"
+# сколько раз перечитываем лот, если цену успел поменять другой процесс
+CAS_RETRIES = 3
+
+
+@dataclass
+class LotBook:
+    """
+    Кэш состояния торгов по лоту: отсекает заведомо неподходящие ставки без БД
+    и даёт ожидаемую цену для compare-and-set в базе.
+    """
+    lot_id: int
+    seller_id: int
+    title: str
+    current_price: int
+    top_bidder: Optional[int] = None
+    started: bool = False
+    ended: bool = False
+
+    def check(self, user_id: int, inc: int) -> Optional[str]:
+        """Причина отказа или None, если ставку можно пробовать принять."""
+        if self.seller_id == user_id:
+            return "own_lot"
+        if self.ended:
+            return "ended"
+        if not self.started:
+            return "not_started"
+        if inc <= 0:
+            return "too_low"
+        return None
+
+    def resolve(self, bids: list[tuple[int, int]]) -> list[tuple[str, int]]:
+        """
+        Решает пачку ставок (user_id, inc) в порядке поступления, не меняя книгу.
+        Возвращает (статус, цена) для каждой ставки.
+        """
+        price = self.current_price
+        results = []
+        for user_id, inc in bids:
+            reason = self.check(user_id, inc)
+            if reason:
+                results.append((reason, price))
+                continue
+            price += inc
+            results.append(("accepted", price))
+        return results
+
+
+# lot_id -> LotBook (только лоты, по которым были ставки с момента запуска)
+order_books: dict[int, LotBook] = {}
+
+
+async def get_book(lot_id: int) -> Optional[LotBook]:
+    book = order_books.get(lot_id)
+    if book:
+        return book
+
+    async with read_session() as session:
+        lot = await session.get(Lot, lot_id)
+        if not lot:
+            return None
+
+    # пока грузили, книгу мог создать кто-то другой
+    book = order_books.get(lot_id)
+    if book:
+        return book
+
+    book = LotBook(
+        lot_id=lot.id,
+        seller_id=lot.seller_id,
+        title=lot.title,
+        current_price=lot.current_price or lot.start_price,
+        started=bool(lot.auction_started),
+        ended=bool(lot.auction_ended),
+    )
+    order_books[lot_id] = book
+    return book
+
+
+async def place_bids(lot_id: int, bids: list[tuple[int, int]]) -> Optional[list[tuple[str, int]]]:
+    """
+    Принять пачку ставок (user_id, inc). Цена в БД меняется одним условным UPDATE
+    (compare-and-set по ожидаемой цене), так что ставки не теряются и не дублируются
+    даже при нескольких процессах бота. Возвращает (статус, цена) для каждой ставки
+    или None, если лота нет.
+    """
+    for _ in range(CAS_RETRIES):
+        book = await get_book(lot_id)
+        if not book:
+            return None
+
+        results = book.resolve(bids)
+        accepted = [
+            (user_id, price)
+            for (user_id, _), (status, price) in zip(bids, results)
+            if status == "accepted"
+        ]
+        if not accepted:
+            return results
+
+        if await _commit_bids(book, accepted):
+            book.current_price, book.top_bidder = accepted[-1][1], accepted[-1][0]
+            return results
+
+        # цену успел поменять другой процесс или аукцион закрылся — перечитываем лот
+        order_books.pop(lot_id, None)
+
+    # отклонённые сами по себе ставки сохраняют свою причину, конфликт — только у принятых
+    return [("conflict", price) if status == "accepted" else (status, price) for status, price in results]
+
+
+async def _commit_bids(book: LotBook, accepted: list[tuple[int, int]]) -> bool:
+    final_price = accepted[-1][1]
+    async with async_session() as session:
+        result = await session.execute(
+            update(Lot)
+            .where(
+                Lot.id == book.lot_id,
+                func.coalesce(func.nullif(Lot.current_price, 0), Lot.start_price) == book.current_price,
+                Lot.auction_started == True,
+                Lot.auction_ended == False,
+            )
+            .values(current_price=final_price)
+            .returning(Lot.current_price)
+            .execution_options(synchronize_session=False)
+        )
+        if result.first() is None:
+            await session.rollback()
+            return False
+
+        await session.execute(
+            insert(Bid),
+            [{"lot_id": book.lot_id, "user_id": user_id, "amount": amount} for user_id, amount in accepted]
+        )
+        if is_postgres:
+            await publish_event(session, "price", book.lot_id, final_price, accepted[-1][0])
+        await session.commit()
+    return True
+
+
+def apply_remote_price(lot_id: int, price: int, user_id: Optional[int]):
+    """Цена, принятая другим процессом бота (приходит через LISTEN/NOTIFY)."""
+    book = order_books.get(lot_id)
+    if book and price > book.current_price:
+        book.current_price = price
+        book.top_bidder = user_id
+
+
+async def publish_event(session, kind: str, lot_id: int, price: int, user_id: Optional[int] = None):
+    """kind: price — принята ставка, start/end — торги открыл или закрыл этот процесс."""
+    # NOTIFY доставляется слушателям только после commit транзакции
+    await session.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": PRICE_CHANNEL, "payload": f"{kind}:{lot_id}:{price}:{user_id or ''}"}
+    )
+
+
+def parse_event(payload: str) -> tuple[str, int, int, Optional[int]]:
+    """Разбор payload из publish_event; ValueError на чужом формате."""
+    parts = payload.split(":")
+    if len(parts) == 3:
+        # формат процессов до появления start/end: только цена
+        parts.insert(0, "price")
+    kind, lot_id, price, user_id = parts
+    if kind not in ("price", "start", "end"):
+        raise ValueError(f"unknown event {kind!r}")
+    return kind, int(lot_id), int(price), int(user_id) if user_id else None
+
+
+def drop_book(lot_id: int):
+    book = order_books.pop(lot_id, None)
+    if book:
+        # воркер мог уже взять ссылку на книгу — пусть дальше отклоняет ставки
+        book.ended = True
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+from typing import Optional
+
+from database import engine, is_postgres
+from auctions.order_book import PRICE_CHANNEL, apply_remote_price, parse_event
+from auctions.logic import apply_remote_event
+
+logger = logging.getLogger(__name__)
+
+
+class PriceListener:
+    """
+    LISTEN на канал цен в Postgres: если ботов запущено несколько,
+    каждый узнаёт о ставках, принятых другими, и об открытии и закрытии торгов
+    и обновляет свою книгу лота.
+    """
+
+    def __init__(self, reconnect_delay: float = 5):
+        self.reconnect_delay = reconnect_delay
+        self._conn = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def start(self):
+        if not is_postgres:
+            return
+        await self._connect()
+
+    async def stop(self):
+        self._closing = True
+        if self._task:
+            self._task.cancel()
+        if self._conn and not self._conn.is_closed():
+            await self._conn.close()
+
+    async def _connect(self):
+        import asyncpg
+
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        self._conn = await asyncpg.connect(dsn)
+        self._conn.add_termination_listener(self._on_terminate)
+        await self._conn.add_listener(PRICE_CHANNEL, self._on_notify)
+        logger.info("PriceListener: listening on %s", PRICE_CHANNEL)
+
+    def _on_notify(self, conn, pid, channel, payload: str):
+        try:
+            kind, lot_id, price, user_id = parse_event(payload)
+        except ValueError:
+            logger.warning("PriceListener: bad payload %r", payload)
+            return
+        if kind == "price":
+            apply_remote_price(lot_id, price, user_id)
+        else:
+            apply_remote_event(kind, lot_id, price)
+
+    def _on_terminate(self, conn):
+        if not self._closing:
+            self._task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while not self._closing:
+            await asyncio.sleep(self.reconnect_delay)
+            try:
+                await self._connect()
+                return
+            except Exception:
+                logger.exception("PriceListener: reconnect failed")
+
+
+price_listener = PriceListener()
@@ -0,0 +1,111 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+START = "start"
+END = "end"
+
+
+def as_utc(dt: datetime) -> datetime:
+    # SQLite возвращает время без таймзоны, храним всегда в UTC
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+class AuctionScheduler:
+    """
+    Один таймер на все аукционы: куча (время, событие, lot_id) и одна корутина,
+    которая спит до ближайшего события. На лот — пара записей в куче, без задач и сессий БД.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, str, int]] = []
+        # (событие, lot_id) -> актуальное время; записи в куче с другим временем устарели
+        self._due: dict[tuple[str, int], float] = {}
+        self._seq = itertools.count()
+        self._handlers: dict[str, Callable[[int], Awaitable[None]]] = {}
+        # lot_id -> выполняющийся обработчик, чтобы события одного лота шли по порядку
+        self._running: dict[int, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def on(self, kind: str, handler: Callable[[int], Awaitable[None]]):
+        self._handlers[kind] = handler
+
+    def add(self, kind: str, lot_id: int, when: datetime):
+        ts = as_utc(when).timestamp()
+        self._due[(kind, lot_id)] = ts
+        heapq.heappush(self._heap, (ts, next(self._seq), kind, lot_id))
+        self._wakeup.set()
+
+    def cancel(self, kind: str, lot_id: int):
+        self._due.pop((kind, lot_id), None)
+
+    def due_at(self, kind: str, lot_id: int) -> Optional[datetime]:
+        ts = self._due.get((kind, lot_id))
+        return datetime.fromtimestamp(ts, timezone.utc) if ts is not None else None
+
+    def __len__(self):
+        return len(self._due)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.gather(*self._running.values(), return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            delay = None
+            while self._heap:
+                ts, _, kind, lot_id = self._heap[0]
+                if self._due.get((kind, lot_id)) != ts:
+                    heapq.heappop(self._heap)  # отменено или перенесено
+                    continue
+                delay = ts - time.time()
+                if delay > 0:
+                    break
+                heapq.heappop(self._heap)
+                del self._due[(kind, lot_id)]
+                self._fire(kind, lot_id)
+                delay = None
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _fire(self, kind: str, lot_id: int):
+        handler = self._handlers.get(kind)
+        if not handler:
+            logger.warning("AuctionScheduler: no handler for %s", kind)
+            return
+        prev = self._running.get(lot_id)
+        task = asyncio.create_task(self._call(prev, handler, kind, lot_id))
+        self._running[lot_id] = task
+        task.add_done_callback(lambda t: self._running.pop(lot_id, None) if self._running.get(lot_id) is t else None)
+
+    @staticmethod
+    async def _call(prev, handler, kind: str, lot_id: int):
+        if prev:
+            await asyncio.gather(prev, return_exceptions=True)
+        try:
+            await handler(lot_id)
+        except Exception:
+            logger.exception("AuctionScheduler: %s handler failed for lot %s", kind, lot_id)
+
+
+scheduler = AuctionScheduler()
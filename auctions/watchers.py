@@ -0,0 +1,220 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from config import settings
+from database import async_session, read_session, is_postgres
+from models import Lot, LotStatus, Watcher
+from services import tracing
+
+logger = logging.getLogger(__name__)
+
+insert = postgresql.insert if is_postgres else sqlite.insert
+
+
+class WatcherRegistry:
+    """
+    Подписчики лотов в памяти: множество user_id на лот, загружается из БД один раз
+    (при старте торгов или при первом обращении). Подписки и отписки сразу меняют
+    множество, а в БД уходят пачкой раз в flush_interval секунд — рассылке по ставке
+    запросы к БД не нужны. В памяти только одобренные лоты с незакончившимися торгами;
+    при закрытии торгов лот уходит из памяти, а его подписки — из БД.
+    """
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._lots: Dict[int, set] = {}
+        self._loading: Dict[int, asyncio.Future] = {}
+        # (lot_id, user_id) -> подписан ли; ещё не записано в БД
+        self._dirty: Dict[tuple, bool] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        # пачки пишутся по очереди: отписка не должна обогнать ещё не записанную подписку
+        self._flush_lock = asyncio.Lock()
+        # лоты, закрытые с момента запуска: загрузка, начатая до закрытия, не вернёт их в память
+        self._ended: Dict[int, None] = {}
+
+    async def get(self, lot_id: int) -> set:
+        """Подписчики лота (пусто, если лота нет или торги закончились). Множество живое — не держите его через await."""
+        users = await self._users(lot_id)
+        return users if users is not None else set()
+
+    async def load_many(self, lot_ids: Iterable[int]):
+        """Загрузить подписчиков нескольких лотов одним запросом (после рестарта)."""
+        lot_ids = [lot_id for lot_id in lot_ids if lot_id not in self._lots]
+        if not lot_ids:
+            return
+        async with read_session() as session:
+            rows = await session.execute(
+                select(Watcher.lot_id, Watcher.user_id).where(Watcher.lot_id.in_(lot_ids))
+            )
+        loaded = {lot_id: set() for lot_id in lot_ids}
+        for lot_id, user_id in rows:
+            loaded[lot_id].add(user_id)
+        for lot_id, users in loaded.items():
+            self._lots.setdefault(lot_id, users)
+
+    async def subscribe(self, lot_id: int, user_id: int) -> str:
+        """
+        Подписать пользователя на лот. Возвращает subscribed, already (подписка уже была)
+        или closed (лота нет, он не одобрен или торги закончились).
+        """
+        users = await self._users(lot_id)
+        if users is None:
+            return "closed"
+        if user_id in users:
+            return "already"
+        users.add(user_id)
+        self._mark(lot_id, user_id, True)
+        return "subscribed"
+
+    async def unsubscribe(self, lot_id: int, user_id: int) -> bool:
+        """Отписать пользователя от лота. Возвращает False, если подписки не было."""
+        users = await self._users(lot_id)
+        if users is None:
+            # лота нет в памяти — подписка могла остаться только в БД
+            async with async_session() as session:
+                result = await session.execute(
+                    delete(Watcher).where(Watcher.lot_id == lot_id, Watcher.user_id == user_id)
+                )
+                await session.commit()
+            return bool(result.rowcount)
+        if user_id not in users:
+            return False
+        users.discard(user_id)
+        self._mark(lot_id, user_id, False)
+        return True
+
+    async def user_lots(self, user_id: int) -> list[tuple[int, str, bool]]:
+        """Подписки пользователя: (lot_id, название, торги закончились)."""
+        await self.flush()
+        async with read_session() as session:
+            rows = await session.execute(
+                select(Lot.id, Lot.title, Lot.auction_ended)
+                .join(Watcher, Watcher.lot_id == Lot.id)
+                .where(Watcher.user_id == user_id)
+                .order_by(Lot.id)
+            )
+        return [(lot_id, title, bool(ended)) for lot_id, title, ended in rows]
+
+    async def unsubscribe_ended(self, user_id: int) -> int:
+        """Отписать пользователя от всех лотов с закончившимися торгами. Возвращает число подписок."""
+        await self.flush()
+        async with async_session() as session:
+            result = await session.execute(
+                delete(Watcher)
+                .where(
+                    Watcher.user_id == user_id,
+                    Watcher.lot_id.in_(select(Lot.id).where(Lot.auction_ended == True)),
+                )
+                .returning(Watcher.lot_id)
+            )
+            lot_ids = result.scalars().all()
+            await session.commit()
+        for lot_id in lot_ids:
+            users = self._lots.get(lot_id)
+            if users is not None:
+                users.discard(user_id)
+        return len(lot_ids)
+
+    async def prune(self, session, lot_id: int):
+        """Торги закрыты: подписки лота больше не нужны. Удаление — в транзакции вызывающего."""
+        self.mark_ended(lot_id)
+        await session.execute(delete(Watcher).where(Watcher.lot_id == lot_id))
+
+    async def prune_ended(self) -> int:
+        """Удалить подписки на все закрытые лоты (оставшиеся от старых версий или гонки с закрытием)."""
+        async with async_session() as session:
+            result = await session.execute(
+                delete(Watcher).where(Watcher.lot_id.in_(select(Lot.id).where(Lot.auction_ended == True)))
+            )
+            await session.commit()
+        if result.rowcount:
+            logger.info("Pruned %s watchers of ended lots", result.rowcount)
+        return result.rowcount
+
+    def mark_ended(self, lot_id: int):
+        """Торги закрыты (здесь или в другом процессе): новые подписки на лот не принимаются."""
+        self._ended[lot_id] = None
+        if len(self._ended) > 10000:
+            for old in list(self._ended)[:1000]:
+                del self._ended[old]
+        self.forget(lot_id)
+
+    def forget(self, lot_id: int):
+        self._lots.pop(lot_id, None)
+        for key in [key for key in self._dirty if key[0] == lot_id]:
+            del self._dirty[key]
+
+    async def flush(self):
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        added = [{"lot_id": lot_id, "user_id": user_id} for (lot_id, user_id), on in batch.items() if on]
+        removed = [key for key, on in batch.items() if not on]
+        try:
+            async with async_session() as session:
+                if added:
+                    await session.execute(
+                        insert(Watcher).on_conflict_do_nothing(index_elements=["lot_id", "user_id"]),
+                        added
+                    )
+                if removed:
+                    await session.execute(
+                        delete(Watcher).where(tuple_(Watcher.lot_id, Watcher.user_id).in_(removed))
+                    )
+                await session.commit()
+        except Exception:
+            logger.exception("WatcherRegistry: failed to flush %s changes", len(batch))
+            # не теряем изменения — попробуем в следующий раз; более новые важнее
+            for key, on in batch.items():
+                self._dirty.setdefault(key, on)
+
+    async def close(self):
+        if self._flush_task:
+            # не отменяем: задача может быть посреди записи
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+
+    def _mark(self, lot_id: int, user_id: int, subscribed: bool):
+        self._dirty[(lot_id, user_id)] = subscribed
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = tracing.background(self._flush_later())
+
+    async def _flush_later(self):
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def _users(self, lot_id: int) -> Optional[set]:
+        users = self._lots.get(lot_id)
+        if users is not None:
+            return users
+        loading = self._loading.get(lot_id)
+        if loading is None:
+            loading = self._loading[lot_id] = asyncio.ensure_future(self._load(lot_id))
+            loading.add_done_callback(lambda _: self._loading.pop(lot_id, None))
+        return await asyncio.shield(loading)
+
+    async def _load(self, lot_id: int) -> Optional[set]:
+        """Подписчики лота из БД или None, если на лот нельзя подписаться — тогда в памяти его нет."""
+        async with read_session() as session:
+            lot = (await session.execute(
+                select(Lot.status, Lot.auction_ended).where(Lot.id == lot_id)
+            )).first()
+            if not lot or lot.status != LotStatus.approved or lot.auction_ended:
+                return None
+            users = set(await session.scalars(select(Watcher.user_id).where(Watcher.lot_id == lot_id)))
+        if lot_id in self._ended:
+            return None
+        return self._lots.setdefault(lot_id, users)
+
+
+watcher_registry = WatcherRegistry(settings.watchers_flush_interval)
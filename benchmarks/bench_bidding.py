@@ -0,0 +1,274 @@
+"""
+Нагрузочный прогон торгов: роутеры из handlers/ против локального фейкового Bot API (aiohttp)
+и временной SQLite. N лотов × M участников × K подписчиков, каждый участник делает B ставок.
+
+    python benchmarks/bench_bidding.py --lots 20 --bidders 50 --watchers 200 --taps 5
+
+Выводит p50/p99 задержки ответа на ставку (от подачи обновления до answerCallbackQuery),
+принятые ставки в секунду, исходящие сообщения в секунду и запросы к БД на ставку,
+затем то же для закрытия всех лотов. Лимиты рассылки по умолчанию сняты (--rate),
+чтобы мерить сам бот, а не искусственный потолок Telegram. Фейковый API работает
+в том же цикле событий, поэтому абсолютные цифры занижены — сравнивайте прогоны между собой.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TOKEN = "123456:bench"
+CHANNEL = -1002896763134
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lots", type=int, default=20)
+    parser.add_argument("--bidders", type=int, default=50)
+    parser.add_argument("--watchers", type=int, default=200)
+    parser.add_argument("--taps", type=int, default=5, help="ставок на участника")
+    parser.add_argument("--feed-rate", type=float, default=0, help="обновлений в секунду, 0 — сразу все")
+    parser.add_argument("--rate", type=float, default=1_000_000, help="лимит рассылки и правок канала, сообщений в секунду")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--metrics", action="store_true", help="в конце вывести метрики бота")
+    parser.add_argument("--trace", default="", help="записать трассы всех обновлений в этот JSONL")
+    return parser.parse_args()
+
+
+def configure(args, tmp: str):
+    # до импорта модулей бота: Settings читается один раз при импорте config
+    os.environ.update({
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}",
+        "BOT_TOKEN": TOKEN,
+        "AUCTION_CHANNEL_ID": str(CHANNEL),
+        "MODERATOR_CHAT_ID": "-100",
+        "FSM_STORAGE": "memory",
+        "FANOUT_RATE_PER_SECOND": str(args.rate),
+        "FANOUT_CHAT_INTERVAL": "0",
+        "CHANNEL_MESSAGES_PER_MINUTE": str(args.rate * 60),
+        "SOFT_CLOSE_SECONDS": "0",
+        "TRACE_PATH": args.trace,
+        "TRACE_SAMPLE_RATE": "1",
+    })
+
+
+class FakeTelegram:
+    """Bot API, который на всё отвечает успехом и запоминает, что и когда у него просили."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.acks: dict[str, tuple[float, str]] = {}
+        self.outbound = 0
+        self._message_ids = itertools.count(1)
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        method = request.match_info["method"].lower()
+        form = await request.post()
+        self.calls[method] += 1
+
+        if method == "answercallbackquery":
+            self.acks[form["callback_query_id"]] = (time.perf_counter(), form.get("text", ""))
+            result = True
+        elif method in ("sendmessage", "editmessagetext"):
+            self.outbound += 1
+            result = {
+                "message_id": int(form.get("message_id") or next(self._message_ids)),
+                "date": 0,
+                "chat": {"id": int(form["chat_id"]), "type": "private"},
+                "text": form.get("text", ""),
+            }
+        elif method == "getchatmember":
+            result = {"status": "member", "user": {"id": int(form["user_id"]), "is_bot": False, "first_name": "u"}}
+        elif method == "getme":
+            result = {"id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+class QueryCounter:
+    def __init__(self, *engines):
+        from sqlalchemy import event
+
+        self.count = 0
+        for engine in engines:
+            event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def seed(args):
+    from sqlalchemy import insert
+
+    import database
+    from db_init import upgrade_schema
+    from models import Lot, LotStatus, Watcher
+
+    async with database.engine.begin() as conn:
+        await conn.run_sync(upgrade_schema)
+        await conn.execute(insert(Lot), [
+            {
+                "id": lot_id, "title": f"Lot {lot_id}", "description": "bench", "start_price": 10000,
+                "seller_id": 1, "auction_started": True, "auction_ended": False,
+                "current_price": 10000, "status": LotStatus.approved, "memory": "128",
+                "year": "2022", "condition": "ok", "battery": "90", "repairs": "нет", "locks": "нет",
+            }
+            for lot_id in range(1, args.lots + 1)
+        ])
+        watchers = [
+            {"lot_id": lot_id, "user_id": 1_000_000 + i}
+            for lot_id in range(1, args.lots + 1) for i in range(args.watchers)
+        ]
+        for chunk in range(0, len(watchers), 10000):
+            await conn.execute(insert(Watcher), watchers[chunk:chunk + 10000])
+
+
+def bid_updates(args):
+    from aiogram.types import Update
+
+    taps = [
+        (lot_id, 10_000 + bidder)
+        for lot_id in range(1, args.lots + 1)
+        for bidder in range(args.bidders)
+        for _ in range(args.taps)
+    ]
+    random.Random(1).shuffle(taps)
+    for update_id, (lot_id, user_id) in enumerate(taps, 1):
+        user = {"id": user_id, "is_bot": False, "first_name": "u"}
+        yield Update.model_validate({
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": user,
+                "chat_instance": "bench",
+                "message": {"message_id": 1, "date": 0, "chat": {"id": user_id, "type": "private"}, "text": "lot"},
+                "data": f"bid_{lot_id}_1000",
+            },
+        })
+
+
+async def run(args):
+    from aiohttp import web
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.enums import ParseMode
+
+    import database
+    from handlers import seller, dealer, auctions, bids, admin
+    from auctions.logic import close_auction
+    from auctions.channel_posts import channel_posts
+    from services.dispatch import ordered_dispatch
+    from services.fanout import fanout
+    from services.metrics import registry, UpdateMetrics, RequestMetrics
+    from services import tracing
+
+    telegram = FakeTelegram()
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", telegram.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    bot = Bot(
+        TOKEN,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}")),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+    bot.session.middleware(RequestMetrics())
+    bot.session.middleware(tracing.TraceRequests())
+    dp = Dispatcher(disable_fsm=True)
+    dp.update.outer_middleware(tracing.TraceUpdates())
+    dp.update.outer_middleware(ordered_dispatch)
+    dp.update.outer_middleware(dp.fsm)
+    dp.update.outer_middleware(UpdateMetrics())
+    for module in (seller, dealer, auctions, bids, admin):
+        dp.include_router(module.router)
+
+    try:
+        await seed(args)
+        queries = QueryCounter(database.engine, database.read_engine)
+
+        updates = list(bid_updates(args))
+        fed: dict[str, float] = {}
+        tasks = []
+        start = time.perf_counter()
+        for update in updates:
+            fed[update.callback_query.id] = time.perf_counter()
+            tasks.append(asyncio.create_task(dp.feed_update(bot, update)))
+            if args.feed_rate:
+                await asyncio.sleep(1 / args.feed_rate)
+            elif len(tasks) % 500 == 0:
+                await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+        deadline = time.perf_counter() + args.timeout
+        while len(telegram.acks) < len(updates) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        acked = time.perf_counter()
+        # отложенные правки поста в канале тоже относятся к ставкам
+        await channel_posts.close()
+        await fanout.join()
+        drained = time.perf_counter()
+
+        latencies = [(at - fed[cid]) * 1000 for cid, (at, _) in telegram.acks.items()]
+        accepted = sum(1 for _, text in telegram.acks.values() if text.startswith("✅"))
+        bid_queries = queries.count
+        print(f"bids sent            {len(updates)}")
+        print(f"bids acked           {len(telegram.acks)}")
+        print(f"bids accepted        {accepted}")
+        if latencies:
+            print(f"ack latency p50, ms  {statistics.median(latencies):.1f}")
+            print(f"ack latency p99, ms  {percentile(latencies, 0.99):.1f}")
+        print(f"accepted bids/s      {accepted / (acked - start):.0f}")
+        print(f"outbound msgs/s      {telegram.outbound / (drained - start):.0f} ({telegram.outbound} total)")
+        print(f"DB queries per bid   {bid_queries / max(len(updates), 1):.2f}")
+
+        outbound = telegram.outbound
+        queries.count = 0
+        start = time.perf_counter()
+        await asyncio.gather(*(close_auction(lot_id, bot) for lot_id in range(1, args.lots + 1)))
+        await channel_posts.close()
+        await fanout.join()
+        elapsed = time.perf_counter() - start
+        print(f"close {args.lots} lots, s     {elapsed:.2f}")
+        print(f"close queries/lot    {queries.count / max(args.lots, 1):.1f}")
+        print(f"close msgs/lot       {(telegram.outbound - outbound) / max(args.lots, 1):.1f}")
+        print(f"API calls            {dict(telegram.calls)}")
+        if args.metrics:
+            print(registry.render())
+    finally:
+        await fanout.close()
+        tracing.sink.close()
+        await database.engine.dispose()
+        await database.read_engine.dispose()
+        await bot.session.close()
+        await runner.cleanup()
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(args, tmp)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
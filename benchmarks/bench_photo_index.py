@@ -0,0 +1,92 @@
+"""
+Поиск похожих фото в индексе хэшей (services/photo_hash.py) на N случайных хэшах.
+
+    python benchmarks/bench_photo_index.py --size 1000000
+
+Выводит время построения индекса, p50/p99 поиска: по хэшу, которого в индексе нет,
+и по искажённому хэшу из индекса (несколько бит изменены, как после пересжатия),
+плюс время dHash одной картинки 1280×960 в текущем процессе.
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=10_000)
+    parser.add_argument("--distance", type=int, default=5, help="photo_hash_max_distance")
+    return parser.parse_args()
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def measure(index, queries) -> list[float]:
+    timings = []
+    for phash in queries:
+        started = time.perf_counter()
+        index.find(phash, exclude_seller=0)
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return timings
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    os.environ.setdefault("AUCTION_CHANNEL_ID", "-100")
+    os.environ.setdefault("MODERATOR_CHAT_ID", "-100")
+    os.environ["PHOTO_HASH_MAX_DISTANCE"] = str(args.distance)
+
+    from PIL import Image
+    from services.photo_hash import PhotoIndex, dhash
+
+    rng = random.Random(1)
+    index = PhotoIndex(args.distance)
+    hashes = [rng.getrandbits(64) for _ in range(args.size)]
+    started = time.perf_counter()
+    index.extend(hashes, [row // 10 for row in range(args.size)], [row // 100 + 1 for row in range(args.size)])
+    index.rebuild()
+    print(f"index {args.size} hashes, s  {time.perf_counter() - started:.1f}")
+    # новые фото по одному, как при работе бота: часть уходит в хвост без перестройки
+    started = time.perf_counter()
+    for _ in range(index.rebuild_every - 1):
+        index.add(rng.getrandbits(64), 0, 0)
+    print(f"add to tail, us          {(time.perf_counter() - started) / (index.rebuild_every - 1) * 1_000_000:.1f}")
+    started = time.perf_counter()
+    index.rebuild()
+    print(f"rebuild, ms              {(time.perf_counter() - started) * 1000:.0f}")
+    for _ in range(index.rebuild_every - 1):
+        index.add(rng.getrandbits(64), 0, 0)
+
+    misses = measure(index, [rng.getrandbits(64) for _ in range(args.queries)])
+    near = []
+    for _ in range(args.queries):
+        phash = rng.choice(hashes)
+        for bit in rng.sample(range(64), args.distance):
+            phash ^= 1 << bit
+        near.append(phash)
+    hits = measure(index, near)
+    print(f"miss p50/p99, us         {statistics.median(misses):.0f} / {percentile(misses, 0.99):.0f}")
+    print(f"near p50/p99, us         {statistics.median(hits):.0f} / {percentile(hits, 0.99):.0f}")
+
+    buffer = io.BytesIO()
+    Image.effect_noise((1280, 960), 64).convert("RGB").save(buffer, "JPEG", quality=85)
+    data = buffer.getvalue()
+    started = time.perf_counter()
+    for _ in range(20):
+        dhash(data)
+    print(f"dHash 1280x960 JPEG, ms  {(time.perf_counter() - started) / 20 * 1000:.1f}")
+
+
+if __name__ == "__main__":
+    main()
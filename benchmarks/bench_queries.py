@@ -0,0 +1,118 @@
+"""
+Задержка горячих запросов к bids/watchers/lots на большой базе — с индексами из models.py и без них.
+
+    python benchmarks/bench_queries.py --bids 1000000 --lots 10000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+from models import Base
+
+QUERIES = {
+    "highest bid": (
+        "SELECT user_id, amount FROM bids WHERE lot_id = ? ORDER BY amount DESC LIMIT 1",
+        lambda a: (random.randint(1, a.lots),),
+    ),
+    "is subscribed": (
+        "SELECT 1 FROM watchers WHERE lot_id = ? AND user_id = ?",
+        lambda a: (random.randint(1, a.lots), random.randint(1, a.users)),
+    ),
+    "watchers of lot": (
+        "SELECT user_id FROM watchers WHERE lot_id = ?",
+        lambda a: (random.randint(1, a.lots),),
+    ),
+    "active lots": (
+        "SELECT id FROM lots WHERE auction_ended = 0 AND status = 'approved' LIMIT 20",
+        lambda a: (),
+    ),
+}
+
+
+def fill(path: str, args):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    rnd = random.Random(1)
+    conn.executemany(
+        "INSERT INTO lots (id, title, description, start_price, seller_id, auction_started, "
+        "auction_ended, current_price, status) VALUES (?, 'lot', '', 1000, ?, 1, ?, 0, ?)",
+        (
+            (i, rnd.randint(1, args.users), int(i > args.lots // 10),
+             "approved" if i % 7 else "rejected")
+            for i in range(1, args.lots + 1)
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO bids (lot_id, user_id, amount) VALUES (?, ?, ?)",
+        ((rnd.randint(1, args.lots), rnd.randint(1, args.users), rnd.randint(1000, 10 ** 7))
+         for _ in range(args.bids)),
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO watchers (lot_id, user_id) VALUES (?, ?)",
+        ((rnd.randint(1, args.lots), rnd.randint(1, args.users)) for _ in range(args.watchers)),
+    )
+    conn.commit()
+    return conn
+
+
+def measure(conn, args, iterations: int):
+    rows = []
+    for name, (sql, params) in QUERIES.items():
+        timings = []
+        for _ in range(iterations):
+            p = params(args)
+            start = time.perf_counter()
+            conn.execute(sql, p).fetchall()
+            timings.append((time.perf_counter() - start) * 1e6)
+        timings.sort()
+        rows.append((name, statistics.median(timings), timings[int(len(timings) * 0.99) - 1]))
+    return rows
+
+
+def report(title: str, rows):
+    print(f"\n{title}")
+    print(f"{'query':<18}{'p50, us':>12}{'p99, us':>12}")
+    for name, p50, p99 in rows:
+        print(f"{name:<18}{p50:>12.1f}{p99:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bids", type=int, default=1_000_000)
+    parser.add_argument("--lots", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--watchers", type=int, default=200_000)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        start = time.perf_counter()
+        conn = fill(path, args)
+        print(f"filled {args.bids} bids, {args.lots} lots in {time.perf_counter() - start:.1f}s")
+
+        report("with indexes", measure(conn, args, args.iterations))
+
+        for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+            "AND tbl_name IN ('bids', 'watchers', 'lots')"
+        ).fetchall():
+            conn.execute(f"DROP INDEX {name}")
+        report("without indexes", measure(conn, args, max(args.iterations // 40, 20)))
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,21 @@ from aiogram.fsm.context import FSMContext
 #from aiogram.fsm.state import StatesGroup, State
 
 from config import settings
-from database import async_session, engine, Base
-from handlers import seller, dealer, auctions, bids
+from database import async_session, engine, read_engine, Base
+from db_init import upgrade_schema
+from handlers import seller, dealer, auctions, bids, admin
+from services.fanout import fanout
+from services.fsm_storage import create_storage
+from services.webhook import run_webhook
+from services.dispatch import ordered_dispatch
+from services.metrics import UpdateMetrics, RequestMetrics, metrics_server
+from services import tracing
+from services import photo_hash
+from auctions.logic import restore_auctions
+from auctions.scheduler import scheduler
+from auctions.price_events import price_listener
+from auctions.channel_posts import channel_posts
+from auctions.watchers import watcher_registry
 
 
 logging.basicConfig(level=logging.INFO)
@@ -18,12 +31,23 @@ logging.basicConfig(level=logging.INFO)
 
 
 bot = Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher(storage=MemoryStorage())
+# FSM подключается вручную после очереди: состояние читается, когда предыдущее
+# обновление пользователя уже обработано
+dp = Dispatcher(storage=create_storage(), disable_fsm=True)
+# трасса начинается до очереди: ожидание своей очереди тоже видно
+dp.update.outer_middleware(tracing.TraceUpdates())
+dp.update.outer_middleware(ordered_dispatch)
+dp.update.outer_middleware(dp.fsm)
+# после очереди: время самих обработчиков, без ожидания
+dp.update.outer_middleware(UpdateMetrics())
+bot.session.middleware(RequestMetrics())
+bot.session.middleware(tracing.TraceRequests())
 
 dp.include_router(seller.router)
 dp.include_router(dealer.router)
 dp.include_router(auctions.router)
 dp.include_router(bids.router)
+dp.include_router(admin.router)
 # class SellerStates(StatesGroup):
 #     title = State()
 #     description = State()
@@ -31,13 +55,44 @@ dp.include_router(bids.router)
 
 async def on_startup():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    # восстановление активных аукционов, если нужно
+        await conn.run_sync(upgrade_schema)
+    # восстановление активных аукционов
+    await restore_auctions(bot)
+    # хэши фото всех лотов для проверки повторных фото; старые фото досчитываются фоном
+    await photo_hash.load_index()
+    photo_hash.start_backfill(bot)
+    # цены от других процессов бота (только Postgres)
+    await price_listener.start()
+    await metrics_server.start()
+
+async def on_shutdown():
+    await scheduler.stop()
+    await price_listener.stop()
+    photo_hash.close()
+    # последние правки постов в канале
+    await channel_posts.close()
+    # дослать уведомления, которые уже стоят в очереди (не дольше fanout_shutdown_timeout)
+    await fanout.close(settings.fanout_shutdown_timeout)
+    # дописать состояние мастеров продавца
+    await dp.storage.close()
+    # дописать подписки на лоты
+    await watcher_registry.close()
+    await metrics_server.stop()
+    tracing.sink.close()
+    await engine.dispose()
+    await read_engine.dispose()
+    await bot.session.close()
 
 async def main():
     await on_startup()
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    try:
+        if settings.bot_mode == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook(drop_pending_updates=settings.drop_pending_updates)
+            await dp.start_polling(bot, tasks_concurrency_limit=settings.dispatch_max_pending)
+    finally:
+        await on_shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -3,18 +3,78 @@ import os
 
 
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 import aiosqlite
 
+from config import settings
+from services.metrics import instrument_engine
+from services.tracing import trace_engine
 
 
-DATABASE_URL = "sqlite+aiosqlite:///./auction.db"
+
+DATABASE_URL = settings.database_url
 DB_LITE="sqlite+aiosqlite:///my_base2.db"
 
-engine = create_async_engine(DB_LITE, echo=True)
+is_sqlite = DATABASE_URL.startswith("sqlite")
+is_postgres = DATABASE_URL.startswith("postgresql")
+
+
+def _apply_pragmas(dbapi_connection, read_only: bool):
+    cursor = dbapi_connection.cursor()
+    # WAL: читатели не ждут писателя, писатель не ждёт читателей
+    cursor.execute(f"PRAGMA journal_mode={settings.db_journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={settings.db_synchronous}")
+    cursor.execute(f"PRAGMA busy_timeout={settings.db_busy_timeout_ms}")
+    cursor.execute(f"PRAGMA cache_size={settings.db_cache_size}")
+    cursor.execute(f"PRAGMA mmap_size={settings.db_mmap_size}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+if is_sqlite:
+    # Все записи идут через одно соединение: SQLite всё равно допускает одного писателя,
+    # а очередь за соединением в пуле дешевле, чем SQLITE_BUSY и повторы.
+    engine = create_async_engine(
+        DATABASE_URL,
+        echo=settings.db_echo,
+        pool_size=settings.db_writer_pool_size,
+        max_overflow=0,
+    )
+
+    # Чтения (списки лотов, карточки, подписчики) идут через отдельный пул и не стоят за commit ставок.
+    read_engine = create_async_engine(
+        DATABASE_URL,
+        echo=settings.db_echo,
+        pool_size=settings.db_read_pool_size,
+        max_overflow=0,
+    )
+
+    event.listen(engine.sync_engine, "connect", lambda conn, _: _apply_pragmas(conn, read_only=False))
+    event.listen(read_engine.sync_engine, "connect", lambda conn, _: _apply_pragmas(conn, read_only=True))
+else:
+    # Postgres держит конкурентных писателей сам — хватает одного общего пула
+    engine = create_async_engine(
+        DATABASE_URL,
+        echo=settings.db_echo,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_pre_ping=True,
+    )
+    read_engine = engine
+
+instrument_engine(engine, "write")
+trace_engine(engine, "write")
+if read_engine is not engine:
+    instrument_engine(read_engine, "read")
+    trace_engine(read_engine, "read")
 
 async_session = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+read_session = async_sessionmaker(bind=read_engine, class_=AsyncSession, expire_on_commit=False)
 
 class Base(DeclarativeBase):
-    pass
\ No newline at end of file
+    pass
@@ -1,18 +1,92 @@
 import asyncio
+from typing import Optional
+
+from sqlalchemy import BigInteger, Integer, text, inspect, literal
 from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import DeclarativeBase
 
 from config import settings  # твои настройки с DATABASE_URL
 from models import Base  # где у тебя объявлены модели (Lot, LotImage, ...)
+from database import engine
 
 
-async def init_db():
-    engine: AsyncEngine = create_async_engine("sqlite+aiosqlite:///my_base2.db", echo=True)
+def add_column_sql(conn, table, column) -> str:
+    """
+    ALTER TABLE ... ADD COLUMN с DEFAULT и NOT NULL из модели. Колонку, которую так
+    не добавить (первичный ключ, NOT NULL без значения по умолчанию), не пропускаем
+    молча, а останавливаем запуск: её нужно перенести вручную.
+    """
+    if column.primary_key:
+        raise RuntimeError(f"Cannot add primary key column {table.name}.{column.name} to an existing table")
+    sql = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}"
+
+    default = None
+    if column.server_default is not None:
+        default = column.server_default.arg
+        if isinstance(default, str):
+            default = literal(default)
+    elif column.default is not None and column.default.is_scalar:
+        default = literal(column.default.arg, column.type)
+    if default is not None:
+        compiled = default.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+        sql += f" DEFAULT {compiled}"
+
+    if not column.nullable:
+        if default is None:
+            raise RuntimeError(
+                f"Cannot add NOT NULL column {table.name}.{column.name} without a default to an existing table"
+            )
+        sql += " NOT NULL"
+    return sql
+
+
+def widen_column_sql(dialect, table, column, existing_type) -> Optional[str]:
+    """
+    ALTER для колонки, которую модель расширила до BIGINT (id пользователей Telegram).
+    В SQLite INTEGER и так 64-битный — менять нечего.
+    """
+    if dialect.name != "postgresql" or not isinstance(column.type, BigInteger):
+        return None
+    if isinstance(existing_type, BigInteger) or not isinstance(existing_type, Integer):
+        return None
+    return f"ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE BIGINT"
+
 
+def upgrade_schema(conn):
+    """
+    Доводит существующую базу (например, my_base2.db) до текущих моделей.
+    create_all создаёт только отсутствующие таблицы, индексы к старым таблицам добавляем сами.
+    """
+    Base.metadata.create_all(conn)
+
+    # новые колонки в старых таблицах и колонки, расширенные до BIGINT
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                conn.execute(text(add_column_sql(conn, table, column)))
+                continue
+            sql = widen_column_sql(conn.dialect, table, column, existing[column.name])
+            if sql:
+                conn.execute(text(sql))
+
+    # перед уникальным индексом убираем дубли подписок, оставшиеся от гонки read-then-insert
+    conn.execute(text(
+        "DELETE FROM watchers WHERE id NOT IN "
+        "(SELECT MIN(id) FROM watchers GROUP BY lot_id, user_id)"
+    ))
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+async def init_db():
     async with engine.begin() as conn:
-        # Создаёт все таблицы по моделям
-        await conn.run_sync(Base.metadata.create_all)
+        # Создаёт все таблицы и индексы по моделям
+        await conn.run_sync(upgrade_schema)
 
     await engine.dispose()
 
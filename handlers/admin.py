@@ -0,0 +1,17 @@
+from aiogram import Router
+from aiogram.filters import Command
+from aiogram.types import Message
+
+from config import settings
+from services.dispatch import ordered_dispatch
+
+# служебные команды для администраторов бота
+router = Router()
+
+
+@router.message(Command("dispatch_stats"))
+async def dispatch_stats(message: Message):
+    if message.from_user.id not in settings.admin_ids:
+        return
+    stats = ordered_dispatch.stats()
+    await message.answer("\n".join(f"{name}: {value}" for name, value in stats.items()))
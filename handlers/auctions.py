@@ -1,4 +1,7 @@
+import logging
+
 from aiogram import Router, F
+from aiogram.exceptions import TelegramAPIError
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from aiogram.filters.callback_data import CallbackData
@@ -6,8 +9,10 @@ from aiogram.filters.callback_data import CallbackData
 from database import async_session
 from models import Lot, Watcher, Bid
 from auctions.logic import active_auctions
+from auctions.watchers import watcher_registry
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+logger = logging.getLogger(__name__)
 router = Router()
 
 @router.message(Command("follow"))
@@ -15,7 +20,7 @@ async def follow_lot(message: Message):
     # ожидание айди лота после команды
     args = message.text.split()
     if len(args) < 2:
-        return await message.answer("Используйте: /follow <id лота>")
+        return await message.answer("Используйте: /follow &lt;id лота&gt;")
 
     lot_id = int(args[1])
 
@@ -24,10 +29,9 @@ async def follow_lot(message: Message):
         if not lot:
             return await message.answer("Лот не найден")
 
-        # добавляем подписчика
-        watcher = Watcher(lot_id=lot_id, user_id=message.from_user.id)
-        session.add(watcher)
-        await session.commit()
+    # добавляем подписчика (повторная подписка ничего не меняет)
+    if await watcher_registry.subscribe(lot_id, message.from_user.id) == "closed":
+        return await message.answer("Торги по этому лоту уже завершены")
 
     await message.answer(f"Вы подписались на лот {lot.title}")
 
@@ -65,18 +69,73 @@ async def process_bid(callback: CallbackQuery):
         session.add(bid)
         await session.commit()
 
-        # Отправляем обновления всем подписчикам
-        watchers = await session.execute(
-            f"SELECT user_id FROM watchers WHERE lot_id = :lot_id",
-            {"lot_id": lot_id}
-        )
-        watchers_ids = [w[0] for w in watchers.fetchall()]
+    # Отправляем обновления всем подписчикам
+    watchers_ids = list(await watcher_registry.get(lot_id))
 
     for watcher_id in watchers_ids:
         try:
             await callback.bot.send_message(watcher_id, f"Новая ставка по лоту {lot.title}: {new_price} ₽")
-        except:
-            pass
+        except TelegramAPIError as e:
+            logger.warning("process_bid: failed to notify watcher %s: %s", watcher_id, e)
 
     # Отправляем ответ дилеру, что ставка принята
     await callback.answer(f"Ставка повышена до {new_price} ₽")
+
+
+# сколько подписок показывать кнопками в /unfollow
+UNFOLLOW_PAGE = 20
+
+
+def unfollow_keyboard(lots: list[tuple[int, str, bool]]) -> InlineKeyboardMarkup:
+    rows = [
+        [InlineKeyboardButton(text=f"{'🏁' if ended else '❌'} #{lot_id} {title[:40]}", callback_data=f"unfollow_{lot_id}")]
+        for lot_id, title, ended in lots[:UNFOLLOW_PAGE]
+    ]
+    if any(ended for _, _, ended in lots):
+        rows.append([InlineKeyboardButton(text="🧹 Отписаться от завершённых", callback_data="unfollow_ended")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+@router.message(Command("unfollow"))
+async def unfollow_lot(message: Message):
+    args = message.text.split()
+    if len(args) >= 2:
+        if not args[1].isdigit():
+            return await message.answer("Используйте: /unfollow &lt;id лота&gt;")
+        if await watcher_registry.unsubscribe(int(args[1]), message.from_user.id):
+            return await message.answer(f"Вы отписались от лота #{args[1]}")
+        return await message.answer("Вы не подписаны на этот лот")
+
+    lots = await watcher_registry.user_lots(message.from_user.id)
+    if not lots:
+        return await message.answer("У вас нет подписок на лоты")
+    await message.answer(
+        "Нажмите на лот, чтобы отписаться (🏁 — торги закончились):",
+        reply_markup=unfollow_keyboard(lots)
+    )
+
+
+@router.callback_query(F.data == "unfollow_ended")
+async def unfollow_ended(callback: CallbackQuery):
+    removed = await watcher_registry.unsubscribe_ended(callback.from_user.id)
+    await callback.answer(f"Отписались от завершённых лотов: {removed}")
+    await _refresh_unfollow(callback)
+
+
+@router.callback_query(F.data.regexp(r"^unfollow_\d+$"))
+async def unfollow_button(callback: CallbackQuery):
+    lot_id = int(callback.data.split("_")[1])
+    await watcher_registry.unsubscribe(lot_id, callback.from_user.id)
+    await callback.answer(f"Вы отписались от лота #{lot_id}")
+    await _refresh_unfollow(callback)
+
+
+async def _refresh_unfollow(callback: CallbackQuery):
+    lots = await watcher_registry.user_lots(callback.from_user.id)
+    try:
+        if lots:
+            await callback.message.edit_reply_markup(reply_markup=unfollow_keyboard(lots))
+        else:
+            await callback.message.edit_text("У вас нет подписок на лоты")
+    except TelegramAPIError as e:
+        logger.debug("unfollow: failed to refresh list for user %s: %s", callback.from_user.id, e)
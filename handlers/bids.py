@@ -2,26 +2,56 @@ from aiogram import Router, Bot, F
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import CommandStart, CommandObject
 from aiogram.types import (
-    Message, CallbackQuery,
+    Message, CallbackQuery, ChatMemberUpdated,
     InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton
 )
-from sqlalchemy.future import select
-from sqlalchemy import desc
 from collections import defaultdict
 import asyncio
+import logging
+import time
 
-from database import async_session
-from models import Lot, Bid, Watcher
 from states import BidStates
+from auctions.order_book import get_book, place_bids
+from auctions.logic import extend_on_bid
+from auctions.watchers import watcher_registry
+from auctions.cards import get_lot_card
+from auctions.listing import get_page, page_cache
+from auctions.channel_posts import channel_posts
+from services.fanout import fanout
+from services.membership import membership_cache, is_channel_member, NOT_MEMBER_STATUSES
+from services.metrics import registry
+from services import tracing
 
 CHANNEL_ID = -1002896763134
 
 # Очереди ставок по lot_id
 lot_bid_queues = defaultdict(asyncio.Queue)
-
+# lot_id, по которым сейчас работает воркер
+lot_bid_workers = set()
+
+BID_REJECT_MESSAGES = {
+    "own_lot": "❌ Нельзя ставить на свой лот.",
+    "ended": "⏳ Аукцион завершен.",
+    "not_started": "⌛ Аукцион еще не начался.",
+    "too_low": "❌ Некорректные данные.",
+    "conflict": "⚠️ Цена только что изменилась, попробуйте ещё раз.",
+}
+
+SUBSCRIBE_MESSAGES = {
+    "already": "⚠️ Вы уже подписаны на этот лот.",
+    "closed": "⏳ Торги по этому лоту уже завершены.",
+}
+
+logger = logging.getLogger(__name__)
 router = Router()
 
+bids_total = registry.counter("bids_total", "Ставки по результату", ("status",))
+bid_batch_seconds = registry.histogram("bid_batch_seconds", "Решение пачки ставок вместе с ответами")
+bid_batch_size = registry.histogram("bid_batch_size", "Ставок в пачке", buckets=(1, 2, 5, 10, 20, 50, 100, 500))
+registry.gauge("bid_queue_depth", "Ставки, ждущие воркера лота", fn=lambda: sum(q.qsize() for q in lot_bid_queues.values()))
+registry.gauge("bid_workers", "Воркеры ставок по лотам", fn=lambda: len(lot_bid_workers))
+
 # Главное меню (теперь будет всегда доступно)
 # Главное меню
 main_menu = ReplyKeyboardMarkup(
@@ -47,21 +77,6 @@ async def support_handler(message: Message):
         reply_markup=support_keyboard
     )
 
-# Красивая карточка лота
-def format_lot_card(lot):
-    price = lot.current_price or lot.start_price
-    return (
-        f"📦 <b>{lot.title}</b>\n"
-        f"📝 {lot.condition}\n"
-        f"🛠 Ремонт:{lot.repairs}\n"
-        f"🔋 Аккумулятор: {lot.battery}\n"
-        f"💾 Память: {lot.memory}\n"
-        f"📅 Год покупки: {lot.year}\n"
-        f"🔒 Блокировки: {lot.locks}\n"
-        f"💰 <b>Стартовая цена:</b> {price}тг\n"
-        f"🆔 ID: <code>{lot.id}</code>"
-    )
-
 # Кнопки для ставок
 def get_bid_buttons(current_price: int, lot_id: int):
     increments = [1000, 5000, 10000]
@@ -83,39 +98,34 @@ async def handle_start_with_lot(message: Message, command: CommandObject):
     if command.args and command.args.startswith("lot_"):
         lot_id = int(command.args.split("_")[1])
 
-        async with async_session() as session:
-            lot = await session.get(Lot, lot_id)
-            if not lot:
-                await message.answer("❌ Лот с таким ID не найден.", reply_markup=main_menu)
-                return
-
-            existing = await session.execute(
-                select(Watcher).filter_by(lot_id=lot_id, user_id=message.from_user.id)
-            )
-            if existing.scalars().first():
-                await message.answer("⚠️ Вы уже подписаны на этот лот.", reply_markup=main_menu)
-                return
-
-            session.add(Watcher(lot_id=lot_id, user_id=message.from_user.id))
-            await session.commit()
-
-            await message.answer(
-                "ℹ️ Аукцион — это быстрый способ продать телефон.\n\n"
-                "1.Участвуя в торгах, вы обязуетесь оплатить лотв случае Вашей победы.\n"
-                "2.В случае отказа от победной ставки взимается штраф 1% от стоимости.\n"
-                "3.Комиссия за успешную сделку 1%\n"
-                "4.Сделка и расчёты происходят напрямую с продавцом. В случае победы мы предоставим контакты продавца\n"
-                "5.При нарушении правил возможна блокировка.\n\n"
-                "Продолжая Вы соглашаетесь с правилами аукциона(побдробнее можно посмотреть в разделе Правила"
-            )
-
-            await message.answer(
-                f"✅ Вы подписались на лот:\n\n{format_lot_card(lot)}",
-                reply_markup=get_bid_buttons(lot.current_price or lot.start_price, lot_id),
-                parse_mode="HTML"
-            )
-
-            await message.answer("Выберите действие:", reply_markup=main_menu)
+        lot_card = await get_lot_card(lot_id)
+        if not lot_card:
+            await message.answer("❌ Лот с таким ID не найден.", reply_markup=main_menu)
+            return
+        card, price = lot_card
+
+        subscribed = await watcher_registry.subscribe(lot_id, message.from_user.id)
+        if subscribed != "subscribed":
+            await message.answer(SUBSCRIBE_MESSAGES[subscribed], reply_markup=main_menu)
+            return
+
+        await message.answer(
+            "ℹ️ Аукцион — это быстрый способ продать телефон.\n\n"
+            "1.Участвуя в торгах, вы обязуетесь оплатить лотв случае Вашей победы.\n"
+            "2.В случае отказа от победной ставки взимается штраф 1% от стоимости.\n"
+            "3.Комиссия за успешную сделку 1%\n"
+            "4.Сделка и расчёты происходят напрямую с продавцом. В случае победы мы предоставим контакты продавца\n"
+            "5.При нарушении правил возможна блокировка.\n\n"
+            "Продолжая Вы соглашаетесь с правилами аукциона(побдробнее можно посмотреть в разделе Правила"
+        )
+
+        await message.answer(
+            f"✅ Вы подписались на лот:\n\n{card}",
+            reply_markup=get_bid_buttons(price, lot_id),
+            parse_mode="HTML"
+        )
+
+        await message.answer("Выберите действие:", reply_markup=main_menu)
 
 @router.message(CommandStart())
 async def cmd_start(message: Message):
@@ -123,71 +133,89 @@ async def cmd_start(message: Message):
 
 @router.message(F.text == "📋 Список аукционов")
 async def handle_list_auctions(message: Message):
-    async with async_session() as session:
-        result = await session.execute(
-            select(Lot).where(Lot.auction_ended == False)
-        )
-        lots = result.scalars().all()
-
-    if not lots:
+    text, markup = await get_page()
+    if not text:
         await message.answer("📭 Нет активных аукционов.", reply_markup=main_menu)
         return
 
-    for lot in lots:
-        await message.answer(format_lot_card(lot), parse_mode="HTML")
-
+    await message.answer(text, reply_markup=markup, parse_mode="HTML")
     await message.answer("✍️ Отправьте ID лота, чтобы подписаться.", reply_markup=main_menu)
 
+@router.callback_query(F.data.startswith("lots_"))
+async def handle_lots_page(callback: CallbackQuery):
+    try:
+        _, direction, cursor_str = callback.data.split("_")
+        cursor = int(cursor_str)
+        if direction not in ("prev", "next") or cursor < 0:
+            raise ValueError(direction)
+    except ValueError:
+        await callback.answer("❌ Некорректные данные.")
+        return
+
+    if direction == "prev":
+        text, markup = await get_page(before_id=cursor)
+    else:
+        text, markup = await get_page(after_id=cursor)
+
+    if not text:
+        await callback.answer("📭 Больше нет активных аукционов.")
+        return
+    try:
+        await callback.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+    except TelegramBadRequest:
+        # страница не изменилась
+        pass
+    await callback.answer()
+
 @router.message(F.text.regexp(r"^\d+$"))
 async def watch_lot(message: Message):
     lot_id = int(message.text)
 
-    async with async_session() as session:
-        lot = await session.get(Lot, lot_id)
-        if not lot:
-            await message.answer("❌ Лот с таким ID не найден.", reply_markup=main_menu)
-            return
+    lot_card = await get_lot_card(lot_id)
+    if not lot_card:
+        await message.answer("❌ Лот с таким ID не найден.", reply_markup=main_menu)
+        return
+    card, price = lot_card
 
-        existing = await session.execute(
-            select(Watcher).filter_by(lot_id=lot_id, user_id=message.from_user.id)
-        )
-        if existing.scalars().first():
-            await message.answer("⚠️ Вы уже подписаны на этот лот.", reply_markup=main_menu)
-            return
+    subscribed = await watcher_registry.subscribe(lot_id, message.from_user.id)
+    if subscribed != "subscribed":
+        await message.answer(SUBSCRIBE_MESSAGES[subscribed], reply_markup=main_menu)
+        return
 
-        session.add(Watcher(lot_id=lot_id, user_id=message.from_user.id))
-        await session.commit()
+    await message.answer(
+        "ℹ️ Аукцион — это быстрый способ продать телефон.\n\n"
+        "1. Выберите модель 📱\n"
+        "2. Загрузите фото 📸\n"
+        "3. Опишите товар 📝\n\n"
+        "❗ После публикации изменить лот будет нельзя!"
+    )
 
-        await message.answer(
-            "ℹ️ Аукцион — это быстрый способ продать телефон.\n\n"
-            "1. Выберите модель 📱\n"
-            "2. Загрузите фото 📸\n"
-            "3. Опишите товар 📝\n\n"
-            "❗ После публикации изменить лот будет нельзя!"
-        )
+    await message.answer(
+        f"✅ Вы подписались на лот:\n\n{card}",
+        reply_markup=get_bid_buttons(price, lot_id),
+        parse_mode="HTML"
+    )
 
-        await message.answer(
-            f"✅ Вы подписались на лот:\n\n{format_lot_card(lot)}",
-            reply_markup=get_bid_buttons(lot.current_price or lot.start_price, lot_id),
-            parse_mode="HTML"
-        )
+    await message.answer("Выберите действие:", reply_markup=main_menu)
 
-        await message.answer("Выберите действие:", reply_markup=main_menu)
+@router.chat_member(F.chat.id == CHANNEL_ID)
+async def channel_member_changed(event: ChatMemberUpdated):
+    # бот — админ канала, Telegram сам сообщает о подписках и отписках
+    membership_cache.set(
+        event.new_chat_member.user.id,
+        event.new_chat_member.status not in NOT_MEMBER_STATUSES
+    )
 
 @router.callback_query(F.data.startswith("bid_"))
 async def process_bid(callback: CallbackQuery):
-    try:
-        bot = callback.bot
-        user_id = callback.from_user.id
-        member = await bot.get_chat_member(CHANNEL_ID, user_id)
-        if member.status in ("left", "kicked"):
-            await callback.answer("📢 Подпишитесь на канал, чтобы участвовать в торгах.", show_alert=True)
-            return
-
-
-    except TelegramBadRequest:
+    with tracing.span("bid.membership"):
+        is_member = await is_channel_member(callback.bot, CHANNEL_ID, callback.from_user.id)
+    if is_member is None:
         await callback.answer("⚠️ Ошибка проверки подписки.", show_alert=True)
         return
+    if not is_member:
+        await callback.answer("📢 Подпишитесь на канал, чтобы участвовать в торгах.", show_alert=True)
+        return
 
     try:
         _, lot_id_str, inc_str = callback.data.split("_")
@@ -197,75 +225,106 @@ async def process_bid(callback: CallbackQuery):
         await callback.answer("❌ Некорректные данные.")
         return
 
-    await lot_bid_queues[lot_id].put((callback, inc))
+    # трассу ставки закроет воркер лота, когда отправит ответ
+    await lot_bid_queues[lot_id].put((callback, inc, tracing.detach(), time.perf_counter()))
+    start_lot_worker(lot_id)
 
-    if lot_bid_queues[lot_id].qsize() == 1:
-        asyncio.create_task(process_lot_bids(lot_id))
 
-async def process_lot_bids(lot_id: int):
-    while not lot_bid_queues[lot_id].empty():
-        callback, inc = await lot_bid_queues[lot_id].get()
-        user_id = callback.from_user.id
-
-        async with async_session() as session:
-            lot = await session.get(Lot, lot_id)
-            if not lot:
-                await callback.answer("❌ Лот не найден.", show_alert=True)
-                lot_bid_queues[lot_id].task_done()
-                continue
-
-            if lot.seller_id == user_id:
-                await callback.answer("❌ Нельзя ставить на свой лот.", show_alert=True)
-                lot_bid_queues[lot_id].task_done()
-                continue
-
-            if lot.auction_ended:
-                await callback.answer("⏳ Аукцион завершен.", show_alert=True)
-                lot_bid_queues[lot_id].task_done()
-                continue
-
-            if not lot.auction_started:
-                await callback.answer("⌛ Аукцион еще не начался.", show_alert=True)
-                lot_bid_queues[lot_id].task_done()
-                continue
-
-            current_price = lot.current_price or lot.start_price
-            new_price = current_price + inc
-
-            highest_bid_res = await session.execute(
-                select(Bid).filter_by(lot_id=lot_id).order_by(desc(Bid.amount)).limit(1)
-            )
-            highest_bid = highest_bid_res.scalars().first()
-            if highest_bid and new_price <= highest_bid.amount:
-                await callback.answer(f"⚠️ Ставка должна быть больше {highest_bid.amount}тг.", show_alert=True)
-                lot_bid_queues[lot_id].task_done()
-                continue
-
-            session.add(Bid(lot_id=lot_id, user_id=user_id, amount=new_price))
-            lot.current_price = new_price
-            await session.commit()
-
-        await callback.answer(f"✅ Ставка {new_price}тг принята.", show_alert=True)
-        await callback.message.answer(f"✅ Ваша ставка {new_price} принята.")
-        bot = callback.bot
-        async with async_session() as session:
-            watchers_res = await session.execute(
-                select(Watcher).filter_by(lot_id=lot_id)
-            )
-            watchers_list = watchers_res.scalars().all()
-
-            for w in watchers_list:
-                if w.user_id != user_id:
-                    try:
-                        await bot.send_message(w.user_id, f"📢 Новая ставка по лоту #{lot_id} {lot.title}: {new_price}тг")
-                    except:
-
-                        pass
+def start_lot_worker(lot_id: int):
+    # по одному воркеру на лот, иначе ставки одного лота обрабатываются вперемешку
+    if lot_id in lot_bid_workers:
+        return
+    lot_bid_workers.add(lot_id)
+    tracing.background(process_lot_bids(lot_id))
 
+
+async def process_lot_bids(lot_id: int):
+    try:
+        while not lot_bid_queues[lot_id].empty():
+            # забираем всё, что накопилось в очереди, и решаем пачку целиком
+            items = []
+            while not lot_bid_queues[lot_id].empty():
+                items.append(lot_bid_queues[lot_id].get_nowait())
+            batch = [(callback, inc) for callback, inc, _, _ in items]
+            traces = [trace for _, _, trace, _ in items]
+            taken = time.perf_counter()
+            for _, _, trace, queued in items:
+                if trace:
+                    trace.add("bid.queue_wait", queued, taken)
             try:
-                await bot.send_message(lot.seller_id, f"📢 Новая ставка по вашему лоту #{lot_id}: {new_price}тг")
-            except:
-                pass
+                bid_batch_size.observe(len(batch))
+                with bid_batch_seconds.time(), tracing.use(traces):
+                    await resolve_bid_batch(lot_id, batch, traces)
+            finally:
+                for trace in traces:
+                    if trace:
+                        trace.finish(lot_id=lot_id, batch=len(batch))
+                for _ in items:
+                    lot_bid_queues[lot_id].task_done()
+    finally:
+        lot_bid_workers.discard(lot_id)
+        # ставка могла прийти, пока воркер завершался
+        if not lot_bid_queues[lot_id].empty():
+            start_lot_worker(lot_id)
+
+
+async def _ack(trace, method):
+    # ответ пишется только в трассу своей ставки, а не всей пачки
+    with tracing.use([trace]):
+        return await method
+
+
+async def resolve_bid_batch(lot_id: int, batch, traces=None):
+    # порядок поступления сохраняется: каждая ставка поднимает цену после предыдущей;
+    # вся пачка принимается одной транзакцией с проверкой цены в самом UPDATE
+    traces = traces or [None] * len(batch)
+    with tracing.span("bid.place", lot_id=lot_id, batch=len(batch)):
+        results = await place_bids(lot_id, [(callback.from_user.id, inc) for callback, inc in batch])
+    if results is None:
+        bids_total.inc(len(batch), status="not_found")
+        await asyncio.gather(
+            *(_ack(trace, callback.answer("❌ Лот не найден.", show_alert=True))
+              for (callback, _), trace in zip(batch, traces)),
+            return_exceptions=True
+        )
+        return
 
-        await asyncio.sleep(1)
-        lot_bid_queues[lot_id].task_done()
+    accepted = []
+    acks = []
+    for (callback, inc), (status, new_price), trace in zip(batch, results, traces):
+        bids_total.inc(status=status)
+        if status != "accepted":
+            acks.append(_ack(trace, callback.answer(BID_REJECT_MESSAGES[status], show_alert=True)))
+            continue
+        accepted.append((callback, new_price))
+        acks.append(_ack(trace, callback.answer(f"✅ Ставка {new_price}тг принята.", show_alert=True)))
+        acks.append(_ack(trace, callback.message.answer(f"✅ Ваша ставка {new_price} принята.")))
+
+    if accepted:
+        extend_on_bid(lot_id)
+        page_cache.invalidate_lot(lot_id)
+        channel_posts.touch(batch[0][0].bot, lot_id)
+
+    results = await asyncio.gather(*acks, return_exceptions=True)
+    for res in results:
+        if isinstance(res, Exception):
+            logger.warning("resolve_bid_batch: failed to ack bid on lot %s: %s", lot_id, res)
+
+    if accepted:
+        # подписчикам достаточно итоговой цены пачки
+        callback, new_price = accepted[-1]
+        book = await get_book(lot_id)
+        if book:
+            await notify_watchers(callback.bot, book, callback.from_user.id, new_price)
+
+
+async def notify_watchers(bot, book, user_id: int, new_price: int):
+    lot_id = book.lot_id
+    # подписчики в памяти: после первой загрузки лота к БД не обращаемся
+    watcher_ids = [uid for uid in await watcher_registry.get(lot_id) if uid != user_id]
+
+    # рассылка идёт в фоне, воркер ставок не ждёт отправки;
+    # у каждого подписчика одно место под последнюю цену — устаревшие цены не отправляются
+    with tracing.span("fanout.enqueue", recipients=len(watcher_ids) + 1):
+        fanout.broadcast_latest(bot, lot_id, watcher_ids, f"📢 Новая ставка по лоту #{lot_id} {book.title}: {new_price}тг")
+        fanout.send_latest(bot, lot_id, book.seller_id, f"📢 Новая ставка по вашему лоту #{lot_id}: {new_price}тг")
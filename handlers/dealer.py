@@ -1,29 +1,34 @@
 from aiogram import Router
 from aiogram.types import Message
-from aiogram.filters import Command
-from sqlalchemy import select
-from database import async_session
-from models import Lot
+from aiogram.filters import Command, CommandObject
+from auctions.archive import get_lot_result
+from auctions.listing import get_page
+from config import settings
 
 router = Router()
 
 @router.message(Command("lots"))
 async def list_active_lots(message: Message):
-    async with async_session() as session:
-        result = await session.execute(
-            select(Lot).where(Lot.auction_ended == False)
-        )
-        lots = result.scalars().all()
-
-    if not lots:
+    text, markup = await get_page()
+    if not text:
         return await message.answer("Сейчас нет активных лотов.")
 
-    response = "📦 Активные лоты:\n"
-    for lot in lots:
-        response += (
-            f"\n🆔 {lot.id} — {lot.title}\n"
-            f"💬 {lot.description}\n"
-            f"💰 Текущая цена: {lot.current_price or lot.start_price} ₽\n"
-        )
-    await message.answer(response)
+    await message.answer(text, reply_markup=markup, parse_mode="HTML")
 
+@router.message(Command("lot_result"))
+async def lot_result(message: Message, command: CommandObject):
+    if message.from_user.id not in settings.admin_ids:
+        return
+    if not command.args or not command.args.strip().isdigit():
+        return await message.answer("Использование: /lot_result 42 (id лота)")
+    result = await get_lot_result(int(command.args))
+    if not result:
+        return await message.answer("Торги по лоту ещё не закрыты.")
+    await message.answer(
+        f"Лот #{result.lot_id}\n"
+        f"Победитель: {result.winner_id or '—'}\n"
+        f"Сумма: {result.final_amount or '—'}\n"
+        f"Ставок: {result.bid_count}\n"
+        f"Первая ставка: {result.first_bid_at or '—'}\n"
+        f"Последняя ставка: {result.last_bid_at or '—'}"
+    )
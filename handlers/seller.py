@@ -1,18 +1,28 @@
 from aiogram import Router, F, types
 from aiogram.types import Message, InputMediaPhoto, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, \
     KeyboardButton, FSInputFile
+from aiogram.exceptions import TelegramAPIError
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
 from aiogram.filters import Command
 from aiogram.utils.formatting import as_marked_section, Bold
 import asyncio
 import logging
+import time
+from dataclasses import dataclass
 
 
-from database import async_session
+from database import async_session, read_session
 from models import Lot, LotImage, LotStatus
 from states import SellerStates
 from config import settings
 from auctions.logic import start_auction
+from auctions.channel_posts import channel_posts
+from services.fanout import fanout
+from services.media import media
+from services.metrics import registry
+from services.photo_hash import hash_photo, photo_index, photo_duplicates, to_signed
+from services import tracing
 
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
@@ -20,17 +30,6 @@ from sqlalchemy.orm import selectinload
 logger = logging.getLogger(__name__)
 router = Router()
 
-def is_unique_photo(file_bytes: bytes, existing_hashes: set) -> bool:
-    import hashlib
-    photo_hash = hashlib.md5(file_bytes).hexdigest()
-    if photo_hash in existing_hashes:
-        return False
-    existing_hashes.add(photo_hash)
-    return True
-
-async def return_to_preview(message: Message, state: FSMContext):
-    await show_confirmation(message, state)
-
 DEVICE_MODELS = {
     # iPhone (X и дальше)
     "iPhone X": 51000,            # медиана ~85 000 ₸ → 60%
@@ -177,8 +176,8 @@ async def model_selected(callback: types.CallbackQuery, state: FSMContext):
     # delete previous bot message with options if exist
     try:
         await callback.message.delete()
-    except Exception:
-        pass
+    except TelegramAPIError as e:
+        logger.debug("model_selected: failed to delete options message: %s", e)
 
     await callback.message.answer(
         f"✅ Вы выбрали: <b>{model_name}</b>\n💰 Стартовая цена: {start_price} тг",
@@ -203,9 +202,35 @@ async def model_selected(callback: types.CallbackQuery, state: FSMContext):
 async def add_photo(message: Message, state: FSMContext):
     file_id = message.photo[-1].file_id
     data = await state.get_data()
-    images = data.get("images", [])
+    images = data.setdefault("images", [])
+    # хэши фото в том же порядке, None — посчитать не удалось
+    hashes = data.setdefault("image_hashes", [])
+
+    with tracing.span("photo.hash"):
+        try:
+            phash = await hash_photo(message.bot, file_id)
+        except Exception as e:
+            # проверка не должна мешать продавцу: фото принимаем без хэша
+            logger.warning("add_photo: failed to hash photo of user %s: %s", message.from_user.id, e)
+            phash = None
+
+    if phash is not None:
+        if any(h is not None and photo_index.similar(phash, h) for h in hashes):
+            photo_duplicates.inc(source="same_lot")
+            await message.answer("⚠️ Это фото уже добавлено. Отправьте другое.")
+            return
+        # свои старые лоты продавец может выставлять снова, чужие фото — нет
+        match = photo_index.find(phash, exclude_seller=message.from_user.id)
+        if match:
+            photo_duplicates.inc(source="other_lot")
+            logger.info("add_photo: user %s sent a photo of lot %s (distance %s)",
+                        message.from_user.id, match[0], match[1])
+            await message.answer("❌ Это фото уже использовалось в другом объявлении. Пришлите собственные фото телефона.")
+            return
+
     images.append(file_id)
-    await state.update_data(images=images)
+    hashes.append(phash)
+    await state.set_data(data)
 
     photos_kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Готово ✅", callback_data="photos_done")]
@@ -230,81 +255,93 @@ async def photos_done(callback: types.CallbackQuery, state: FSMContext):
         )
         return
 
-    await callback.message.answer("✍️ Укажите количество памяти:")
-    await state.set_state(SellerStates.memory)
+    first = WIZARD_STEPS[WIZARD_ORDER[0]]
+    await callback.message.answer(first.prompt)
+    await state.set_state(first.state)
+
+# ---------- Wizard steps ----------
+@dataclass
+class WizardStep:
+    state: State
+    prompt: str       # вопрос при заполнении
+    edit_prompt: str  # вопрос при редактировании из предпросмотра
+
+
+# поле лота -> шаг мастера; порядок словаря = порядок вопросов
+WIZARD_STEPS = {
+    "memory": WizardStep(SellerStates.memory, "✍️ Укажите количество памяти:", "✍️ Укажите количество памяти:"),
+    "year": WizardStep(SellerStates.year, "📅 Укажите год покупки телефона:", "📅 Укажите год покупки телефона:"),
+    "condition": WizardStep(
+        SellerStates.condition,
+        "📦 Опишите общее состояние телефона.\n\n1.Обязательно укажите работают ли микрофоны и динамики.\n\n2.Нет ли проблем с Wi-fi, Bluetooth, звонками или другими модулями?:",
+        "📦 Опишите общее состояние телефона:"
+    ),
+    "battery": WizardStep(SellerStates.battery, "🔋 Укажите состояние аккумулятора (в %):", "🔋 Укажите состояние аккумулятора:"),
+    "repairs": WizardStep(
+        SellerStates.repairs,
+        "🛠 Был ли телефон в ремонте? Если был то перечислите работы:",
+        "🛠 Был ли телефон в ремонте? (Да/Нет):"
+    ),
+    "water": WizardStep(SellerStates.water, "Укажите номер по которому с Вами свяжется победитель:", "Введите номер телефона:"),
+    "locks": WizardStep(
+        SellerStates.locks,
+        "🔒 Нет ли блокировок Apple ID/Google или чего-то еще?:",
+        "🔒 Нет ли блокировок Apple ID/Google? (Да/Нет):"
+    ),
+}
+WIZARD_ORDER = list(WIZARD_STEPS)
 
-@router.message(SellerStates.memory)
-async def set_memory(message: Message, state: FSMContext):
-    data = await state.get_data()
-    await state.update_data(memory=message.text)
-    if data.get("edit_mode"):
-        await return_to_preview(message, state)
-    else:
-        await message.answer("📅 Укажите год покупки телефона:")
-        await state.set_state(SellerStates.year)
-
-@router.message(SellerStates.year)
-async def set_year(message: Message, state: FSMContext):
-    data = await state.get_data()
-    await state.update_data(year=message.text)
-    if data.get("edit_mode"):
-        await return_to_preview(message, state)
-    else:
-        await message.answer("📦 Опишите общее состояние телефона.\n\n1.Обязательно укажите работают ли микрофоны и динамики.\n\n2.Нет ли проблем с Wi-fi, Bluetooth, звонками или другими модулями?:")
-        await state.set_state(SellerStates.condition)
-
-@router.message(SellerStates.condition)
-async def set_condition(message: Message, state: FSMContext):
-    data = await state.get_data()
-    await state.update_data(condition=message.text)
-    if data.get("edit_mode"):
-        await return_to_preview(message, state)
-    else:
-        await message.answer("🔋 Укажите состояние аккумулятора (в %):")
-        await state.set_state(SellerStates.battery)
-
-@router.message(SellerStates.battery)
-async def set_battery(message: Message, state: FSMContext):
-    data = await state.get_data()
-    await state.update_data(battery=message.text)
-    if data.get("edit_mode"):
-        await return_to_preview(message, state)
-    else:
-        await message.answer("🛠 Был ли телефон в ремонте? Если был то перечислите работы:")
-        await state.set_state(SellerStates.repairs)
-
-@router.message(SellerStates.repairs)
-async def set_repairs(message: Message, state: FSMContext):
-    data = await state.get_data()
-    await state.update_data(repairs=message.text)
-    if data.get("edit_mode"):
-        await return_to_preview(message, state)
-    else:
-        await message.answer("Укажите номер по которому с Вами свяжется победитель:")
-        await state.set_state(SellerStates.water)
-
-@router.message(SellerStates.water)
-async def set_water(message: Message, state: FSMContext):
-    data = await state.get_data()
-    await state.update_data(water=message.text)
-    if data.get("edit_mode"):
-        await return_to_preview(message, state)
-    else:
-        await message.answer("🔒 Нет ли блокировок Apple ID/Google или чего-то еще?:")
-        await state.set_state(SellerStates.locks)
+wizard_step_seconds = registry.histogram("wizard_step_seconds", "Время ответа на шаг мастера продавца", ("step",))
+
+
+def record_step_time(step: str, started: float):
+    wizard_step_seconds.observe(time.perf_counter() - started, step=step)
 
 
-# ---------- Get description ----------
-@router.message(SellerStates.locks)
-async def get_description(message: Message, state: FSMContext):
-    await state.update_data(locks=message.text)
-    # Показать предпросмотр и опции подтверждения/редактирования
-    await show_confirmation(message, state)
+def make_step_handler(field: str):
+    next_field = WIZARD_ORDER[WIZARD_ORDER.index(field) + 1] if field != WIZARD_ORDER[-1] else None
+
+    async def handle_step(message: Message, state: FSMContext):
+        # одно чтение и одна запись данных на шаг
+        started = time.perf_counter()
+        data = await state.get_data()
+        data[field] = message.text
+        if data.get("edit_mode") or next_field is None:
+            # show_confirmation сам сохранит data
+            await show_confirmation(message, state, data)
+        else:
+            await state.set_data(data)
+            await message.answer(WIZARD_STEPS[next_field].prompt)
+            await state.set_state(WIZARD_STEPS[next_field].state)
+        record_step_time(field, started)
+
+    handle_step.__name__ = f"set_{field}"
+    return handle_step
+
+
+for _field, _step in WIZARD_STEPS.items():
+    router.message(_step.state)(make_step_handler(_field))
+
+
+@router.message(Command("wizard_stats"))
+async def wizard_stats(message: Message):
+    if message.from_user.id not in settings.admin_ids:
+        return
+    stats = wizard_step_seconds.snapshot()
+    if not stats:
+        await message.answer("Нет данных по шагам мастера.")
+        return
+    lines = [
+        f"{field}: {count} отв., ср. {total / count * 1000:.1f} мс, 95% не дольше {p95 * 1000:.0f} мс"
+        for (field,), (count, total, p95) in stats.items()
+    ]
+    await message.answer("\n".join(lines))
 
 # ---------- Show confirmation (preview) ----------
-async def show_confirmation(message_or_callback, state: FSMContext):
+async def show_confirmation(message_or_callback, state: FSMContext, data: dict = None):
 
-    data = await state.get_data()
+    if data is None:
+        data = await state.get_data()
 
     title = data.get("title")
     start_price = data.get("start_price")
@@ -362,8 +399,8 @@ async def show_confirmation(message_or_callback, state: FSMContext):
             # удаляем старое сообщение-меню, если оно есть
             try:
                 await message_or_callback.message.delete()
-            except Exception:
-                pass
+            except TelegramAPIError as e:
+                logger.debug("show_confirmation: failed to delete menu message: %s", e)
             # отправляем медиа, если есть
             if images:
                 try:
@@ -387,11 +424,12 @@ async def show_confirmation(message_or_callback, state: FSMContext):
             await (message_or_callback.answer if not isinstance(message_or_callback, types.CallbackQuery) else message_or_callback.message.answer)(
                 "Предпросмотр недоступен. Попробуйте снова.", reply_markup=main_menu
             )
-        except Exception:
-            pass
+        except TelegramAPIError as e:
+            logger.warning("show_confirmation: failed to send fallback message: %s", e)
 
     # сохраняем, что мы в стадии подтверждения (сохраняем в start_price как legacy state)
-    await state.update_data(edit_mode=False)
+    data["edit_mode"] = False
+    await state.set_data(data)
     await state.set_state(SellerStates.start_price)
 
 # ---------- Edit handlers ----------
@@ -411,7 +449,7 @@ async def edit_photos(callback: types.CallbackQuery, state: FSMContext):
                                       reply_markup=main_menu)
         await state.clear()
         return
-    await state.update_data(edit_mode=True, images=[])
+    await state.update_data(edit_mode=True, images=[], image_hashes=[])
     await callback.message.answer(
         "📸 Отправьте новые фото (минимум 5). Когда закончите, нажмите 'Готово ✅'.",
         reply_markup=InlineKeyboardMarkup(
@@ -421,116 +459,22 @@ async def edit_photos(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(SellerStates.images)
 
 
-@router.callback_query(F.data == "edit_memory")
-async def edit_memory(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    if not data:
-        # данные утеряны — предупреждаем
-        logger.warning("edit_memory: no state data for user %s", callback.from_user.id)
-        await callback.message.answer("❌ Данные лота утеряны. Пожалуйста, начните создание заново.",
-                                      reply_markup=main_menu)
-        await state.clear()
-        return
-    await state.update_data(edit_mode=True)
-    await callback.message.answer("✍️ Укажите количество памяти:")
-    await state.set_state(SellerStates.memory)
-
-
-@router.callback_query(F.data == "edit_year")
-async def edit_year(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    if not data:
-        # данные утеряны — предупреждаем
-        logger.warning("edit_year: no state data for user %s", callback.from_user.id)
-        await callback.message.answer("❌ Данные лота утеряны. Пожалуйста, начните создание заново.",
-                                      reply_markup=main_menu)
-        await state.clear()
-        return
-    await state.update_data(edit_mode=True)
-    await callback.message.answer("📅 Укажите год покупки телефона:")
-    await state.set_state(SellerStates.year)
-
-
-@router.callback_query(F.data == "edit_condition")
-async def edit_condition(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    if not data:
-        # данные утеряны — предупреждаем
-        logger.warning("edit_condition: no state data for user %s", callback.from_user.id)
-        await callback.message.answer("❌ Данные лота утеряны. Пожалуйста, начните создание заново.",
-                                      reply_markup=main_menu)
-        await state.clear()
-        return
-    await state.update_data(edit_mode=True)
-    await callback.message.answer("📦 Опишите общее состояние телефона:")
-    await state.set_state(SellerStates.condition)
-
-
-@router.callback_query(F.data == "edit_battery")
-async def edit_battery(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    if not data:
-        # данные утеряны — предупреждаем
-        logger.warning("edit_battery: no state data for user %s", callback.from_user.id)
-        await callback.message.answer("❌ Данные лота утеряны. Пожалуйста, начните создание заново.",
-                                      reply_markup=main_menu)
-        await state.clear()
-        return
-    await state.update_data(edit_mode=True)
-    await callback.message.answer("🔋 Укажите состояние аккумулятора:")
-    await state.set_state(SellerStates.battery)
-
-
-@router.callback_query(F.data == "edit_repairs")
-async def edit_repairs(callback: types.CallbackQuery, state: FSMContext):
+@router.callback_query(F.data.in_({f"edit_{field}" for field in WIZARD_STEPS}))
+async def edit_field(callback: types.CallbackQuery, state: FSMContext):
+    field = callback.data.split("edit_", 1)[1]
+    step = WIZARD_STEPS[field]
     data = await state.get_data()
     if not data:
         # данные утеряны — предупреждаем
-        logger.warning("edit_repairs: no state data for user %s", callback.from_user.id)
+        logger.warning("edit_%s: no state data for user %s", field, callback.from_user.id)
         await callback.message.answer("❌ Данные лота утеряны. Пожалуйста, начните создание заново.",
                                       reply_markup=main_menu)
         await state.clear()
         return
-    await state.update_data(edit_mode=True)
-    await callback.message.answer("🛠 Был ли телефон в ремонте? (Да/Нет):")
-    await state.set_state(SellerStates.repairs)
-
-
-@router.callback_query(F.data == "edit_water")
-async def edit_water(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    if not data:
-        # данные утеряны — предупреждаем
-        logger.warning("edit_water: no state data for user %s", callback.from_user.id)
-        await callback.message.answer("❌ Данные лота утеряны. Пожалуйста, начните создание заново.",
-                                      reply_markup=main_menu)
-        await state.clear()
-        return
-    await state.update_data(edit_mode=True)
-    await callback.message.answer("Введите номер телефона:")
-    await state.set_state(SellerStates.water)
-
-
-@router.callback_query(F.data == "edit_locks")
-async def edit_locks(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    if not data:
-        # данные утеряны — предупреждаем
-        logger.warning("edit_locks: no state data for user %s", callback.from_user.id)
-        await callback.message.answer("❌ Данные лота утеряны. Пожалуйста, начните создание заново.",
-                                      reply_markup=main_menu)
-        await state.clear()
-        return
-    await state.update_data(edit_mode=True)
-    await callback.message.answer("🔒 Нет ли блокировок Apple ID/Google? (Да/Нет):")
-    await state.set_state(SellerStates.locks)
-
-
-
-
-
-
-
+    data["edit_mode"] = True
+    await state.set_data(data)
+    await callback.message.answer(step.edit_prompt)
+    await state.set_state(step.state)
 
 
 # ---------- Confirm publish ----------
@@ -557,8 +501,8 @@ async def confirm_publish(callback: types.CallbackQuery, state: FSMContext):
         except Exception:
             try:
                 await callback.answer("❌ Лот устарел или неполный.", show_alert=True)
-            except Exception:
-                pass
+            except TelegramAPIError as e:
+                logger.warning("confirm_publish: failed to notify user %s: %s", callback.from_user.id, e)
         await state.clear()
         return
 
@@ -596,13 +540,19 @@ async def confirm_publish(callback: types.CallbackQuery, state: FSMContext):
             session.add(lot)
             await session.flush()
 
-            for file_id in images:
-                session.add(LotImage(lot_id=lot.id, file_id=file_id))
+            # у черновиков, начатых до появления хэшей, их нет
+            hashes = data.get("image_hashes") or []
+            hashes = hashes + [None] * (len(images) - len(hashes))
+            for file_id, phash in zip(images, hashes):
+                session.add(LotImage(
+                    lot_id=lot.id, file_id=file_id, phash=to_signed(phash) if phash is not None else None
+                ))
 
             await session.commit()
 
-            # уведомляем продавца
-        await callback.message.answer("⌛ Ваш лот отправлен на модерацию. Ожидайте решения.", reply_markup=main_menu)
+        for phash in hashes:
+            if phash is not None:
+                photo_index.add(phash, lot.id, callback.from_user.id)
 
         # Сообщение в канал
         text = as_marked_section(
@@ -618,15 +568,24 @@ async def confirm_publish(callback: types.CallbackQuery, state: FSMContext):
             [InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_{lot.id}")]
         ])
 
-        if images:
+        # альбом раньше карточки: кнопки модерации должны оказаться под фото;
+        # альбом запоминается, чтобы при одобрении скопировать его в канал
+        with tracing.span("moderation.send", images=len(images)):
             try:
-                media = [InputMediaPhoto(media=img) for img in images[:10]]
-                await callback.bot.send_media_group(chat_id=settings.moderator_chat_id, media=media)
-            except Exception:
+                await media.send_album(callback.bot, settings.moderator_chat_id, lot.id, images)
+            except TelegramAPIError:
                 logger.exception("confirm_publish: failed to send media_group to moder channel")
+            await media.call(lambda: callback.bot.send_message(
+                settings.moderator_chat_id, text.as_html(), reply_markup=kb
+            ))
 
-
-        await callback.bot.send_message(settings.moderator_chat_id, text.as_html(), reply_markup=kb)
+        # «отправлен на модерацию» — только когда карточка действительно у модераторов
+        try:
+            await media.call(lambda: callback.message.answer(
+                "⌛ Ваш лот отправлен на модерацию. Ожидайте решения.", reply_markup=main_menu
+            ))
+        except TelegramAPIError as e:
+            logger.warning("confirm_publish: failed to notify seller %s: %s", callback.from_user.id, e)
     except Exception:
         logger.exception("confirm_publish: failed to send message to moder channel")
         await callback.message.answer("❌ Ошибка при сохранении лота. Попробуйте позже.", reply_markup=main_menu)
@@ -650,35 +609,20 @@ async def approve_lot(callback: types.CallbackQuery):
 
         images = [img.file_id for img in lot.images][:10]
 
-    full_description = (
-        f"💾 Память: {lot.memory}\n"
-        f"📅 Год покупки: {lot.year}\n"
-        f"📦 Состояние: {lot.condition}\n"
-        f"🔋 Аккумулятор: {lot.battery}\n"
-        f"🛠 Ремонт: {lot.repairs}\n"
-        f"🔒 Блокировки: {lot.locks}\n"
-        f"ID: {lot.id}"
-    )
-
-    text = as_marked_section(
-        Bold("🔥 Новый лот!"),
-        f"📱 {lot.title}",
-        full_description,
-        f"💰 Старт: {lot.start_price}тг",
-        f"⏳ Торги начнутся через {settings.auction_duration_minutes/2} минут."
-    )
-
-
-    if images:
-        media = [InputMediaPhoto(media=img) for img in images]
-        await callback.bot.send_media_group(chat_id=settings.auction_channel_id, media=media)
-
-    await callback.bot.send_message(settings.auction_channel_id, text.as_html())
-
-    # старт аукциона
-    asyncio.create_task(start_auction(lot.id, callback.bot))
     bot = callback.bot
-    await bot.send_message(lot.seller_id, f"✅ Лот одобрен и опубликован! Торги начнутся через {settings.auction_duration_minutes/2} минут")
+
+    async def publish():
+        # альбом раньше поста: пост с кнопкой ставки должен оказаться под фото
+        try:
+            await media.publish_album(bot, settings.auction_channel_id, lot_id, images)
+        except TelegramAPIError:
+            logger.exception("approve_lot: failed to publish album for lot %s", lot_id)
+        await channel_posts.publish(bot, lot)
+
+    # публикация в канал и расписание торгов друг от друга не зависят
+    with tracing.span("channel.publish", lot_id=lot_id, images=len(images)):
+        await asyncio.gather(publish(), start_auction(lot.id))
+    fanout.send(bot, lot.seller_id, f"✅ Лот одобрен и опубликован! Торги начнутся через {settings.auction_duration_minutes/2} минут")
     await callback.answer(f"✅ Лот одобрен и опубликован! Торги начнутся через {settings.auction_duration_minutes/2} минут", show_alert=True)
 
 
@@ -709,7 +653,7 @@ async def accept_deal(callback: types.CallbackQuery):
     parts = callback.data.split("_")
     lot_id, winner_id = int(parts[-2]), int(parts[-1])
 
-    async with async_session() as session:
+    async with read_session() as session:
         lot = await session.get(Lot, lot_id)
         if not lot:
             await callback.answer("⚠️ Лот не найден.", show_alert=True)
@@ -739,7 +683,7 @@ async def reject_deal(callback: types.CallbackQuery):
     parts = callback.data.split("_")
     lot_id, winner_id = int(parts[-2]), int(parts[-1])
 
-    async with async_session() as session:
+    async with read_session() as session:
         lot = await session.get(Lot, lot_id)
         if not lot:
             await callback.answer("⚠️ Лот не найден.", show_alert=True)
@@ -775,6 +719,7 @@ async def reject_lot(callback: types.CallbackQuery):
 
         lot.status = LotStatus.rejected
         await session.commit()
+    media.forget(lot_id)
 
     bot = callback.bot
     await bot.send_message(lot.seller_id,"❌Ваш лот отклонён.Пожалуйста, уточните причину у службы поддержки")
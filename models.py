@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    Column, Integer, String, ForeignKey, DateTime, Boolean
+    Column, Integer, String, ForeignKey, DateTime, Boolean, Index, BigInteger
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -61,7 +61,8 @@ class Lot(Base):
     title = Column(String, nullable=False)
     description = Column(String, nullable=False)
     start_price = Column(Integer, nullable=False)
-    seller_id = Column(Integer, nullable=False)
+    # id в Telegram бывают больше 2^31 — в Postgres нужен bigint
+    seller_id = Column(BigInteger, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     auction_started = Column(Boolean, default=False)
     auction_ended = Column(Boolean, default=False)
@@ -76,6 +77,8 @@ class Lot(Base):
     locks = Column(String, nullable=True)
 
     status = Column(Enum(LotStatus), default=LotStatus.pending, nullable=False)
+    # пост о лоте в канале аукциона, редактируется по ходу торгов
+    channel_message_id = Column(Integer, nullable=True)
 
 
     bids = relationship("Bid", back_populates="lot", cascade="all, delete-orphan")
@@ -91,6 +94,8 @@ class LotImage(Base):
     id = Column(Integer, primary_key=True, index=True)
     lot_id = Column(Integer, ForeignKey("lots.id", ondelete="CASCADE"), nullable=False)
     file_id = Column(String, nullable=False)
+    # перцептивный хэш (dHash) для поиска повторных фото, см. services/photo_hash.py
+    phash = Column(BigInteger, nullable=True)
 
     lot = relationship("Lot", back_populates="images")
 
@@ -100,17 +105,63 @@ class Bid(Base):
 
     id = Column(Integer, primary_key=True)
     lot_id = Column(Integer, ForeignKey("lots.id"), nullable=False)
-    user_id = Column(Integer, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
     amount = Column(Integer, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     lot = relationship("Lot", back_populates="bids")
 
+
+class BidArchive(Base):
+    """Ставки закрытых лотов: переносятся из bids при закрытии, дальше только читаются."""
+    __tablename__ = "bids_archive"
+
+    id = Column(Integer, primary_key=True)
+    # id исходной ставки из bids; SQLite отдаёт id удалённых ставок новым, так что он не уникален
+    bid_id = Column(Integer, nullable=True)
+    lot_id = Column(Integer, nullable=False, index=True)
+    user_id = Column(BigInteger, nullable=False)
+    amount = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True))
+
+
+class LotResult(Base):
+    """Итог торгов по лоту, записывается при переносе его ставок в архив."""
+    __tablename__ = "lot_results"
+
+    lot_id = Column(Integer, ForeignKey("lots.id", ondelete="CASCADE"), primary_key=True)
+    winner_id = Column(BigInteger, nullable=True)
+    final_amount = Column(Integer, nullable=True)
+    bid_count = Column(Integer, nullable=False, default=0)
+    first_bid_at = Column(DateTime(timezone=True), nullable=True)
+    last_bid_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class Watcher(Base):
     __tablename__ = "watchers"
 
     id = Column(Integer, primary_key=True)
     lot_id = Column(Integer, ForeignKey("lots.id"), nullable=False)
-    user_id = Column(Integer, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+
+    lot = relationship("Lot", back_populates="watchers")
+
+
+# самая высокая ставка по лоту — один проход по индексу; в bids только ставки идущих торгов
+Index("ix_bids_lot_id_amount", Bid.lot_id, Bid.amount.desc())
+# одна подписка на лот у пользователя; заодно индекс для рассылки по lot_id
+Index("uq_watchers_lot_id_user_id", Watcher.lot_id, Watcher.user_id, unique=True)
+# подписки пользователя для /unfollow
+Index("ix_watchers_user_id", Watcher.user_id)
+# списки активных лотов
+Index("ix_lots_auction_ended_status", Lot.auction_ended, Lot.status)
+
+class AuctionSchedule(Base):
+    __tablename__ = "auction_schedule"
 
-    lot = relationship("Lot", back_populates="watchers")
\ No newline at end of file
+    lot_id = Column(Integer, ForeignKey("lots.id", ondelete="CASCADE"), primary_key=True)
+    starts_at = Column(DateTime(timezone=True), nullable=False)
+    ends_at = Column(DateTime(timezone=True), nullable=False)
+    started = Column(Boolean, default=False, nullable=False)
+    finished = Column(Boolean, default=False, nullable=False)
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from config import settings
+from services.metrics import registry
+from services import tracing
+
+
+class OrderedDispatch(BaseMiddleware):
+    """
+    Внешний middleware на dp.update: обновления одного пользователя в одном чате
+    обрабатываются строго по очереди, а всего одновременно выполняется не больше
+    concurrency обработчиков. Сколько обновлений может ждать, ограничивает уже
+    источник: tasks_concurrency_limit при polling или лимит webhook-сервера.
+    Регистрируется до FSMContextMiddleware, иначе состояние читается до очереди
+    и обработчик видит то, что было до предыдущего обновления.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._slots = asyncio.Semaphore(concurrency)
+        # (chat_id, user_id) -> [замок, сколько обновлений этого ключа в работе]
+        self._queues: Dict[tuple, list] = {}
+        self.running = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.handled = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get("event_chat")
+        user = data.get("event_from_user")
+        key = (chat.id if chat else None, user.id if user else None)
+        if key == (None, None):
+            # не к кому привязать порядок (например, опросы) — только общий лимит слотов
+            key = ("update", id(event))
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = [asyncio.Lock(), 0]
+        queue[1] += 1
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        started = False
+        queued = time.perf_counter()
+        try:
+            # сначала очередь ключа, потом общий слот: ждущие своей очереди слоты не занимают
+            async with queue[0]:
+                async with self._slots:
+                    started = True
+                    tracing.record("dispatch.wait", queued)
+                    self.waiting -= 1
+                    self.running += 1
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        self.running -= 1
+                        self.handled += 1
+        finally:
+            if not started:
+                self.waiting -= 1
+            queue[1] -= 1
+            if not queue[1]:
+                del self._queues[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "peak_waiting": self.peak_waiting,
+            "active_keys": len(self._queues),
+            "deepest_queue": max((queue[1] for queue in self._queues.values()), default=0),
+            "handled": self.handled,
+        }
+
+
+ordered_dispatch = OrderedDispatch(settings.dispatch_concurrency)
+
+registry.gauge("dispatch_running", "Обработчики, выполняющиеся сейчас", fn=lambda: ordered_dispatch.running)
+registry.gauge("dispatch_waiting", "Обновления, ждущие своей очереди или слота", fn=lambda: ordered_dispatch.waiting)
+registry.gauge("dispatch_active_keys", "Пользователи с обновлениями в работе", fn=lambda: len(ordered_dispatch._queues))
@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Optional
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+from config import settings
+from services.metrics import registry
+from services import tracing
+
+logger = logging.getLogger(__name__)
+
+fanout_messages = registry.counter("fanout_messages_total", "Сообщения рассылки по итогу", ("result",))
+
+
+class TokenBucket:
+    """Глобальный лимит исходящих сообщений (Telegram ~30 msg/s на бота)."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        # после RetryAfter Telegram не примет ничего от бота — останавливаем всех
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class Job:
+    bot: Any
+    chat_id: int
+    text: str
+    kwargs: dict = field(default_factory=dict)
+    attempt: int = 0
+    # (группа, chat_id) для сообщений, где важна только последняя версия
+    key: Optional[tuple] = None
+    # время, занятое под это сообщение в очереди чата (monotonic), если его пришлось отложить
+    slot: float = 0.0
+
+
+class FanOut:
+    """
+    Рассылка сообщений пулом воркеров с глобальным и поштучным по чатам лимитом.
+    Вызывающий код только ставит сообщения в очередь и сразу продолжает работу.
+    """
+
+    def __init__(self, workers: int, rate: float, chat_interval: float,
+                 max_retries: int, max_pending: int):
+        self.workers = workers
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._tasks: list[asyncio.Task] = []
+        self._chat_next: dict[int, float] = {}
+        self._delayed = 0
+        # key -> ещё не отправленное задание, key -> message_id последнего отправленного
+        self._latest: dict[tuple, Job] = {}
+        self._last_message: dict[Any, dict[int, int]] = {}
+        # после close новые и отложенные сообщения не принимаются
+        self._closed = False
+
+    def send(self, bot, chat_id: int, text: str, **kwargs) -> bool:
+        return self._put(Job(bot, chat_id, text, kwargs))
+
+    def broadcast(self, bot, chat_ids: Iterable[int], text: str, **kwargs) -> int:
+        """Поставить одно сообщение в очередь для многих чатов. Возвращает число поставленных."""
+        return sum(self.send(bot, chat_id, text, **kwargs) for chat_id in chat_ids)
+
+    def send_latest(self, bot, group, chat_id: int, text: str) -> bool:
+        """
+        Сообщение, у которого важна только последняя версия (например, текущая цена лота).
+        Не отправленное ещё сообщение той же группы для чата заменяется новым текстом,
+        а уже отправленное по возможности редактируется вместо отправки нового.
+        """
+        key = (group, chat_id)
+        job = self._latest.get(key)
+        if job:
+            job.text = text
+            return True
+        job = Job(bot, chat_id, text, key=key)
+        if not self._put(job):
+            return False
+        self._latest[key] = job
+        return True
+
+    def broadcast_latest(self, bot, group, chat_ids: Iterable[int], text: str) -> int:
+        return sum(self.send_latest(bot, group, chat_id, text) for chat_id in chat_ids)
+
+    def forget(self, group):
+        """Забыть отправленные и ещё не отправленные сообщения группы (например, когда аукцион завершён)."""
+        self._last_message.pop(group, None)
+        for key in [key for key in self._latest if key[0] == group]:
+            del self._latest[key]
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() + self._delayed
+
+    async def join(self):
+        """Дождаться отправки всего, что уже в очереди."""
+        while self.pending:
+            await self._queue.join()
+            if self._delayed:
+                await asyncio.sleep(self.chat_interval)
+
+    async def close(self, timeout: Optional[float] = None):
+        """Дослать очередь, но не дольше timeout секунд; что не успело уйти — отбрасывается."""
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            left = self.pending
+            fanout_messages.inc(left, result="dropped_on_shutdown")
+            logger.warning("FanOut: %s messages not sent within %s s of shutdown, dropping", left, timeout)
+        self._closed = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            self._queue.task_done()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _put(self, job: Job) -> bool:
+        if self._closed:
+            return False
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            fanout_messages.inc(result="queue_full")
+            logger.warning("FanOut: queue is full, dropping message to %s", job.chat_id)
+            return False
+        return True
+
+    def _put_later(self, job: Job, delay: float):
+        # не держим воркер на sleep — возвращаем задание в очередь по таймеру
+        self._delayed += 1
+
+        def requeue():
+            self._delayed -= 1
+            # задание потеряно — следующая версия сообщения должна встать в очередь заново
+            if not self._put(job) and job.key and self._latest.get(job.key) is job:
+                del self._latest[job.key]
+
+        asyncio.get_running_loop().call_later(delay, requeue)
+
+    def _ensure_workers(self):
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(tracing.background(self._worker()))
+
+    def _chat_delay(self, job: Job) -> float:
+        now = time.monotonic()
+        if job.slot:
+            # время уже занято раньше — сообщения одного чата уходят в порядке постановки
+            if job.slot > now:
+                return job.slot - now
+            job.slot = 0.0
+            return 0.0
+        slot = max(now, self._chat_next.get(job.chat_id, 0.0))
+        self._chat_next[job.chat_id] = slot + self.chat_interval
+        if slot > now:
+            job.slot = slot
+            return slot - now
+        if len(self._chat_next) > 10000:
+            self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+        return 0.0
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                delay = self._chat_delay(job)
+                if delay:
+                    self._put_later(job, delay)
+                    continue
+                await self.bucket.acquire()
+                await self._deliver(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("FanOut: unexpected error while sending to %s", job.chat_id)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, job: Job):
+        if job.key:
+            # с этого момента новая цена пойдёт отдельным заданием
+            if self._latest.get(job.key) is job:
+                del self._latest[job.key]
+            try:
+                await self._deliver_latest(job)
+                fanout_messages.inc(result="sent")
+            except TelegramRetryAfter as e:
+                self.bucket.pause(e.retry_after)
+                self._retry_latest(job, e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                fanout_messages.inc(result="dropped")
+                logger.debug("FanOut: dropping message to %s: %s", job.chat_id, e)
+            except Exception as e:
+                self._retry_latest(job, 2 ** job.attempt, error=e)
+            return
+
+        try:
+            await job.bot.send_message(job.chat_id, job.text, **job.kwargs)
+            fanout_messages.inc(result="sent")
+        except TelegramRetryAfter as e:
+            self.bucket.pause(e.retry_after)
+            self._retry(job, e.retry_after)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # пользователь заблокировал бота или чат недоступен — повторять бессмысленно
+            fanout_messages.inc(result="dropped")
+            logger.debug("FanOut: dropping message to %s: %s", job.chat_id, e)
+        except Exception as e:
+            self._retry(job, 2 ** job.attempt, error=e)
+
+    async def _deliver_latest(self, job: Job):
+        group, chat_id = job.key
+        sent = self._last_message.get(group, {})
+        message_id = sent.get(chat_id)
+        if message_id:
+            try:
+                await job.bot.edit_message_text(job.text, chat_id=chat_id, message_id=message_id, **job.kwargs)
+                return
+            except TelegramBadRequest as e:
+                if "not modified" in str(e):
+                    return
+                # сообщение удалено или слишком старое — отправим новое
+                logger.debug("FanOut: edit failed for %s, sending new message: %s", chat_id, e)
+        message = await job.bot.send_message(chat_id, job.text, **job.kwargs)
+        message_id = getattr(message, "message_id", None)
+        if message_id:
+            self._last_message.setdefault(group, {})[chat_id] = message_id
+
+    def _retry_latest(self, job: Job, delay: float, error: Optional[Exception] = None):
+        # за время ожидания могла прийти более свежая версия — тогда старая не нужна
+        if job.key in self._latest:
+            return
+        self._latest[job.key] = job
+        self._retry(job, delay, error)
+        if job.attempt > self.max_retries:
+            del self._latest[job.key]
+
+    def _retry(self, job: Job, delay: float, error: Optional[Exception] = None):
+        job.attempt += 1
+        if job.attempt > self.max_retries:
+            fanout_messages.inc(result="gave_up")
+            logger.warning("FanOut: giving up on message to %s: %s", job.chat_id, error)
+            return
+        fanout_messages.inc(result="retried")
+        self._put_later(job, delay)
+
+
+fanout = FanOut(
+    workers=settings.fanout_workers,
+    rate=settings.fanout_rate_per_second,
+    chat_interval=settings.fanout_chat_interval,
+    max_retries=settings.fanout_max_retries,
+    max_pending=settings.fanout_max_pending,
+)
+
+registry.gauge("fanout_pending", "Сообщения в очереди рассылки, включая отложенные", fn=lambda: fanout.pending)
@@ -0,0 +1,350 @@
+import asyncio
+import json
+import logging
+import math
+import time
+from abc import abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Mapping, Optional
+from urllib.parse import urlparse
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Record:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    touched: float = field(default_factory=time.time)
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class CoalescingStorage(BaseStorage):
+    """
+    Хранилище FSM с кэшем в памяти и отложенной записью: изменения копятся
+    и раз в flush_interval уходят в бэкенд одной пачкой. Записи, которые не трогали
+    дольше ttl (брошенные мастера), удаляются и из памяти, и из бэкенда.
+    Бэкенд реализует _load/_save/_purge.
+    """
+
+    def __init__(self, ttl: float, flush_interval: float, max_cached: int):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.max_cached = max_cached
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache: OrderedDict[str, Record] = OrderedDict()
+        self._dirty: set[str] = set()
+        # записи, ещё не подтверждённые бэкендом (идёт запись или она не удалась);
+        # храним сами записи: ключ мог уйти из кэша, и без них повтор удалил бы его из бэкенда
+        self._unsaved: Dict[str, Optional[Record]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Data must be a dict, got {type(data).__name__}")
+        record = await self._record(key)
+        record.data = data.copy()
+        self._touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._record(key)).data.copy()
+
+    async def close(self) -> None:
+        if self._flush_task:
+            # не отменяем: задача может быть посреди записи
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._dirty and not self._unsaved:
+            return
+        for k in self._dirty:
+            self._unsaved[k] = self._cache.get(k)
+        self._dirty.clear()
+        batch = dict(self._unsaved)
+        try:
+            await self._save({k: (r if r and not r.empty else None) for k, r in batch.items()})
+        except Exception:
+            # не теряем изменения — записи остаются в _unsaved до следующей попытки
+            logger.exception("%s: failed to flush %s records", type(self).__name__, len(batch))
+        else:
+            for k, r in batch.items():
+                if self._unsaved.get(k) is r:
+                    del self._unsaved[k]
+
+        now = time.time()
+        if now - self._last_purge > min(self.ttl, 3600):
+            self._last_purge = now
+            try:
+                await self._purge(now - self.ttl)
+            except Exception:
+                logger.exception("%s: failed to purge expired records", type(self).__name__)
+
+    async def _record(self, key: StorageKey) -> Record:
+        k = self.key_builder.build(key)
+        record = self._cache.get(k)
+        if record is None:
+            if k in self._unsaved:
+                # в бэкенде старая версия: берём ту, что ещё не записана
+                record = self._unsaved[k] or Record()
+            else:
+                record = await self._load(k) or Record()
+            self._cache[k] = record
+            self._evict()
+        if time.time() - record.touched > self.ttl:
+            record = Record()
+            self._cache[k] = record
+        self._cache.move_to_end(k)
+        return record
+
+    def _touch(self, key: StorageKey, record: Record):
+        k = self.key_builder.build(key)
+        record.touched = time.time()
+        self._dirty.add(k)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def _evict(self):
+        # из памяти уходят только записи без новых изменений; недописанные ещё лежат в _unsaved
+        for k in list(self._cache):
+            if len(self._cache) <= self.max_cached:
+                break
+            if k not in self._dirty:
+                del self._cache[k]
+
+    async def _flush_later(self):
+        while self._dirty or self._unsaved:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    @abstractmethod
+    async def _load(self, k: str) -> Optional[Record]:
+        ...
+
+    @abstractmethod
+    async def _save(self, batch: Dict[str, Optional[Record]]):
+        ...
+
+    async def _purge(self, older_than: float):
+        pass
+
+
+class SQLiteStorage(CoalescingStorage):
+    """FSM в отдельном SQLite-файле: мастер продавца переживает рестарт бота."""
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._db = None
+        # первые обращения приходят одновременно — соединение должно открыться одно
+        self._connect_lock = asyncio.Lock()
+
+    async def _conn(self):
+        if self._db is not None:
+            return self._db
+        async with self._connect_lock:
+            if self._db is None:
+                import aiosqlite
+
+                db = await aiosqlite.connect(self.path)
+                try:
+                    await db.execute("PRAGMA journal_mode=WAL")
+                    await db.execute(
+                        "CREATE TABLE IF NOT EXISTS fsm ("
+                        "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, touched REAL NOT NULL)"
+                    )
+                    await db.commit()
+                except BaseException:
+                    await db.close()
+                    raise
+                self._db = db
+        return self._db
+
+    async def _load(self, k: str) -> Optional[Record]:
+        db = await self._conn()
+        async with db.execute("SELECT state, data, touched FROM fsm WHERE key = ?", (k,)) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            return None
+        return Record(state=row[0], data=json.loads(row[1]), touched=row[2])
+
+    async def _save(self, batch: Dict[str, Optional[Record]]):
+        db = await self._conn()
+        await db.executemany(
+            "INSERT OR REPLACE INTO fsm (key, state, data, touched) VALUES (?, ?, ?, ?)",
+            [(k, r.state, json.dumps(r.data), r.touched) for k, r in batch.items() if r]
+        )
+        await db.executemany("DELETE FROM fsm WHERE key = ?", [(k,) for k, r in batch.items() if not r])
+        await db.commit()
+
+    async def _purge(self, older_than: float):
+        db = await self._conn()
+        await db.execute("DELETE FROM fsm WHERE touched < ?", (older_than,))
+        await db.commit()
+        for k in [k for k, r in self._cache.items() if r.touched < older_than and k not in self._dirty]:
+            del self._cache[k]
+
+    async def close(self) -> None:
+        await super().close()
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+class RespError(RuntimeError):
+    """Ошибка, которую вернул сервер (-ERR ...)."""
+
+
+class RespClient:
+    """
+    Минимальный клиент протокола Redis (RESP2): хватает для GET/SET/DEL с конвейером.
+    Ответы конвейера читаются все, даже если среди них есть ошибка; при любом другом
+    сбое посреди обмена соединение закрывается — иначе следующий запрос прочитал бы
+    чужой ответ.
+    """
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def execute(self, *commands: tuple) -> list:
+        """Отправить команды одним пакетом и прочитать ответы по порядку."""
+        async with self._lock:
+            try:
+                if self._writer is None or self._writer.is_closing():
+                    await self._connect()
+                replies = await self._roundtrip(commands)
+            except BaseException:
+                # в том числе отмена посреди чтения: в потоке могли остаться ответы
+                await self.close()
+                raise
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._reader = None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            for reply in await self._roundtrip(setup):
+                if isinstance(reply, RespError):
+                    raise reply
+
+    async def _roundtrip(self, commands) -> list:
+        payload = bytearray()
+        for command in commands:
+            payload += b"*%d\r\n" % len(command)
+            for arg in command:
+                arg = arg if isinstance(arg, bytes) else str(arg).encode()
+                payload += b"$%d\r\n%s\r\n" % (len(arg), arg)
+        self._writer.write(bytes(payload))
+        await self._writer.drain()
+        return [await self._read_reply() for _ in commands]
+
+    async def _read_reply(self):
+        # ошибка возвращается, а не бросается: остальные ответы пакета ещё надо дочитать
+        line = await self._reader.readuntil(b"\r\n")
+        prefix, body = line[:1], line[1:-2]
+        if prefix == b"+":
+            return body.decode()
+        if prefix == b"-":
+            return RespError(body.decode())
+        if prefix == b":":
+            return int(body)
+        if prefix == b"$":
+            size = int(body)
+            if size == -1:
+                return None
+            return (await self._reader.readexactly(size + 2))[:-2]
+        if prefix == b"*":
+            size = int(body)
+            if size == -1:
+                return None
+            return [await self._read_reply() for _ in range(size)]
+        raise RuntimeError(f"Unexpected RESP reply: {line!r}")
+
+
+class RespStorage(CoalescingStorage):
+    """FSM в Redis (или любом сервере с протоколом Redis); TTL выставляется на ключ."""
+
+    def __init__(self, url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.client = RespClient(url)
+
+    async def _load(self, k: str) -> Optional[Record]:
+        (raw,) = await self.client.execute(("GET", k))
+        if raw is None:
+            return None
+        value = json.loads(raw)
+        return Record(state=value["state"], data=value["data"], touched=value["touched"])
+
+    async def _save(self, batch: Dict[str, Optional[Record]]):
+        commands = []
+        for k, r in batch.items():
+            if r:
+                value = json.dumps({"state": r.state, "data": r.data, "touched": r.touched})
+                commands.append(("SET", k, value, "EX", max(1, math.ceil(self.ttl))))
+            else:
+                commands.append(("DEL", k))
+        await self.client.execute(*commands)
+
+    async def _purge(self, older_than: float):
+        # в Redis записи истекают сами по EX, чистим только память
+        for k in [k for k, r in self._cache.items() if r.touched < older_than and k not in self._dirty]:
+            del self._cache[k]
+
+    async def close(self) -> None:
+        await super().close()
+        await self.client.close()
+
+
+def create_storage() -> BaseStorage:
+    options = dict(
+        ttl=settings.fsm_ttl_seconds,
+        flush_interval=settings.fsm_flush_interval,
+        max_cached=settings.fsm_max_cached,
+    )
+    if settings.fsm_storage == "sqlite":
+        return SQLiteStorage(settings.fsm_sqlite_path, **options)
+    if settings.fsm_storage == "redis":
+        return RespStorage(settings.fsm_redis_url, **options)
+    if settings.fsm_storage == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown fsm_storage {settings.fsm_storage!r}: expected memory, sqlite or redis")
@@ -0,0 +1,23 @@
+"""
+Хэширование картинок для пула процессов. Модуль импортирует только PIL и numpy:
+процессы пула не тянут за собой настройки, БД и aiogram.
+"""
+import io
+
+import numpy as np
+from PIL import Image
+
+HASH_BITS = 64
+
+
+def dhash(data: bytes) -> int:
+    """
+    Разностный хэш (dHash): картинка сжимается до 9×8 в оттенках серого, бит — ярче ли
+    пиксель соседа справа. Пересжатие, смена размера и лёгкая цветокоррекция меняют
+    лишь несколько бит. Выполняется в процессе пула.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("L", (64, 64))  # JPEG декодируется сразу в уменьшенном виде
+        pixels = np.asarray(image.convert("L").resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    bits = np.packbits(pixels[:, 1:] > pixels[:, :-1])
+    return int.from_bytes(bits.tobytes(), "big")
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, TypeVar
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InputMediaPhoto
+
+from config import settings
+from services.fanout import fanout
+from services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# upload — альбом отправлен по file_id, copy — скопирован из чата модерации
+media_albums = registry.counter("media_albums_total", "Отправленные альбомы лотов", ("via",))
+media_retries = registry.counter("media_retries_total", "Повторы запросов с медиа", ("reason",))
+
+# больше 10 фото в альбоме Telegram не принимает
+ALBUM_LIMIT = 10
+
+
+class MediaDelivery:
+    """
+    Альбомы фото лотов. Альбом в чате модерации запоминается (lot_id -> message_id),
+    и при одобрении канал получает его копию через copy_messages одним запросом,
+    без повторной отправки десяти file_id. После рестарта или если сообщения в чате
+    модерации удалены — альбом отправляется заново по file_id.
+    Запросы идут через общий лимит рассылки и повторяются только после RetryAfter:
+    после сетевой ошибки или 5xx неизвестно, дошло ли сообщение, и повтор мог бы
+    отправить альбом дважды.
+    """
+
+    def __init__(self, max_cached: int, max_retries: int):
+        self.max_cached = max_cached
+        self.max_retries = max_retries
+        # lot_id -> (chat_id, message_id альбома)
+        self._albums: OrderedDict[int, tuple[int, list[int]]] = OrderedDict()
+
+    async def send_album(self, bot, chat_id: int, lot_id: int, file_ids: list[str]) -> list[int]:
+        """Отправить альбом и запомнить его сообщения для publish_album. Возвращает message_id."""
+        message_ids = await self._upload(bot, chat_id, file_ids)
+        if message_ids:
+            self._remember(lot_id, chat_id, message_ids)
+        return message_ids
+
+    async def publish_album(self, bot, chat_id: int, lot_id: int, file_ids: list[str]) -> list[int]:
+        """Альбом лота в другой чат: копией запомненного альбома, если он есть, иначе заново."""
+        album = self._albums.pop(lot_id, None)
+        if album:
+            from_chat_id, message_ids = album
+            try:
+                copied = await self.call(lambda: bot.copy_messages(
+                    chat_id=chat_id, from_chat_id=from_chat_id, message_ids=message_ids
+                ))
+                media_albums.inc(via="copy")
+                return [message.message_id for message in copied]
+            except TelegramBadRequest as e:
+                # альбом в чате модерации удалили — отправим по file_id
+                logger.info("MediaDelivery: copy failed for lot %s: %s", lot_id, e)
+        return await self._upload(bot, chat_id, file_ids)
+
+    def forget(self, lot_id: int):
+        self._albums.pop(lot_id, None)
+
+    async def _upload(self, bot, chat_id: int, file_ids: list[str]) -> list[int]:
+        if not file_ids:
+            return []
+        media = [InputMediaPhoto(media=file_id) for file_id in file_ids[:ALBUM_LIMIT]]
+        messages = await self.call(lambda: bot.send_media_group(chat_id=chat_id, media=media))
+        media_albums.inc(via="upload")
+        return [message.message_id for message in messages]
+
+    async def call(self, request: Callable[[], Awaitable[T]]) -> T:
+        """Запрос к Bot API через общий лимит, с повторами после RetryAfter. request создаёт новый запрос на каждую попытку."""
+        for attempt in range(self.max_retries + 1):
+            await fanout.bucket.acquire()
+            try:
+                return await request()
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                media_retries.inc(reason="retry_after")
+                fanout.bucket.pause(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+
+    def _remember(self, lot_id: int, chat_id: int, message_ids: list[int]):
+        self._albums[lot_id] = (chat_id, message_ids)
+        self._albums.move_to_end(lot_id)
+        while len(self._albums) > self.max_cached:
+            self._albums.popitem(last=False)
+
+
+media = MediaDelivery(settings.media_album_cache_size, settings.fanout_max_retries)
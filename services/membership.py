@@ -0,0 +1,73 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from aiogram.exceptions import TelegramAPIError
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+NOT_MEMBER_STATUSES = ("left", "kicked")
+
+
+class MembershipCache:
+    """
+    TTL + LRU кэш «подписан ли пользователь на канал».
+    Отрицательный ответ живёт меньше: человек мог только что подписаться.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float, max_size: int):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        # user_id -> (подписан, когда истекает)
+        self._items: OrderedDict[int, tuple[bool, float]] = OrderedDict()
+
+    def get(self, user_id: int, allow_stale: bool = False) -> Optional[bool]:
+        item = self._items.get(user_id)
+        if item is None:
+            return None
+        is_member, expires = item
+        if not allow_stale and expires < time.monotonic():
+            return None
+        self._items.move_to_end(user_id)
+        return is_member
+
+    def set(self, user_id: int, is_member: bool):
+        ttl = self.ttl if is_member else self.negative_ttl
+        self._items[user_id] = (is_member, time.monotonic() + ttl)
+        self._items.move_to_end(user_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self._items.pop(user_id, None)
+
+
+membership_cache = MembershipCache(
+    ttl=settings.membership_ttl_seconds,
+    negative_ttl=settings.membership_negative_ttl_seconds,
+    max_size=settings.membership_cache_size,
+)
+
+
+async def is_channel_member(bot, chat_id: int, user_id: int) -> Optional[bool]:
+    """
+    Подписан ли пользователь на канал. Обычно отвечает из кэша без запроса к Telegram.
+    При ошибке API возвращает последнее известное значение, а если его нет — None.
+    """
+    cached = membership_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    try:
+        member = await bot.get_chat_member(chat_id, user_id)
+    except TelegramAPIError as e:
+        logger.warning("is_channel_member: get_chat_member failed for %s: %s", user_id, e)
+        return membership_cache.get(user_id, allow_stale=True)
+
+    is_member = member.status not in NOT_MEMBER_STATUSES
+    membership_cache.set(user_id, is_member)
+    return is_member
@@ -0,0 +1,262 @@
+import bisect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import TelegramObject
+from sqlalchemy import event
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# секунды: от быстрых ответов из кэша до медленных рассылок
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(name, "") for name in self.labels), 0)
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_labels(self.labels, key)} {value}"
+
+
+class Gauge(Counter):
+    """Значение на момент чтения. С fn значение считается при каждом запросе метрик."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def set(self, value: float, **labels):
+        self._values[tuple(labels.get(name, "") for name in self.labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> Iterable[str]:
+        if self.fn is not None:
+            try:
+                yield f"{self.name} {self.fn()}"
+            except Exception:
+                logger.exception("Gauge %s: collector failed", self.name)
+            return
+        yield from super().samples()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счётчики по корзинам (+Inf последней), сумма, количество]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def time(self, **labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def snapshot(self) -> Dict[tuple, tuple[int, float, Optional[float]]]:
+        """labels -> (количество, сумма, верхняя граница корзины, куда попали 95% наблюдений)."""
+        result = {}
+        for key, (counts, total, count) in self._values.items():
+            p95, seen = None, 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                seen += bucket
+                if seen >= count * 0.95:
+                    p95 = bound
+                    break
+            result[key] = (count, total, p95)
+        return result
+
+    def samples(self) -> Iterable[str]:
+        names = self.labels + ("le",)
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{_labels(names, key + (le,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {total}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {count}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        # повторный импорт модуля не должен плодить метрики с тем же именем
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = (), fn: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, help, labels, fn))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+updates_total = registry.counter("bot_updates_total", "Обработанные обновления", ("type",))
+update_errors = registry.counter("bot_update_errors_total", "Обновления, обработчик которых упал", ("type",))
+update_seconds = registry.histogram("bot_update_seconds", "Время обработки обновления", ("type",))
+telegram_requests = registry.histogram("telegram_request_seconds", "Запросы к Bot API", ("method",))
+telegram_errors = registry.counter("telegram_errors_total", "Ошибки Bot API", ("method", "error"))
+db_queries = registry.histogram("db_query_seconds", "Запросы к БД", ("engine",))
+db_connections = registry.gauge("db_connections_in_use", "Соединения, выданные из пула", ("engine",))
+
+
+class UpdateMetrics(BaseMiddleware):
+    """Внешний middleware на dp.update: сколько обновлений, каких и как долго обрабатывались."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        kind = getattr(event, "event_type", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            update_errors.inc(type=kind)
+            raise
+        finally:
+            updates_total.inc(type=kind)
+            update_seconds.observe(time.perf_counter() - started, type=kind)
+
+
+class RequestMetrics(BaseRequestMiddleware):
+    """Middleware сессии бота: время и ошибки каждого вызова Bot API, в том числе проглоченные обработчиками."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramAPIError as e:
+            telegram_errors.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            telegram_requests.observe(time.perf_counter() - started, method=name)
+
+
+def instrument_engine(engine, name: str):
+    """Время каждого запроса и занятые соединения пула."""
+    sync_engine = engine.sync_engine
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("query_started", None)
+        if started is not None:
+            db_queries.observe(time.perf_counter() - started, engine=name)
+
+    event.listen(sync_engine, "before_cursor_execute", before)
+    event.listen(sync_engine, "after_cursor_execute", after)
+    event.listen(sync_engine.pool, "checkout", lambda *_: db_connections.inc(engine=name))
+    event.listen(sync_engine.pool, "checkin", lambda *_: db_connections.dec(engine=name))
+
+
+class MetricsServer:
+    """GET /metrics в текстовом формате Prometheus."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self):
+        if not self.port:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.host, self.port).start()
+        except OSError as e:
+            # занятый порт не повод не запускать бота — работаем без метрик
+            logger.error("Metrics: cannot listen on %s:%s: %s", self.host, self.port, e)
+            await self.stop()
+            return
+        logger.info("Metrics: listening on %s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+metrics_server = MetricsServer(settings.metrics_host, settings.metrics_port)
@@ -0,0 +1,234 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import select, update
+
+from config import settings
+from database import async_session, read_session
+from models import Lot, LotImage
+from services.metrics import registry
+from services import tracing
+from services import image_hash
+from services.image_hash import HASH_BITS, dhash
+
+logger = logging.getLogger(__name__)
+
+photo_hash_seconds = registry.histogram("photo_hash_seconds", "Скачивание и хэширование фото продавца")
+photo_duplicates = registry.counter("photo_duplicates_total", "Отклонённые повторные фото", ("source",))
+registry.gauge("photo_index_size", "Фото в индексе хэшей", fn=lambda: len(photo_index))
+
+def to_signed(value: int) -> int:
+    # в БД хэш лежит в знаковом 64-битном INTEGER
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+class PhotoIndex:
+    """
+    Хэши всех фото лотов для поиска похожих (расстояние Хэмминга до max_distance).
+    Multi-index hashing: 64 бита режутся на max_distance + 1 кусков, и у похожего хэша
+    хотя бы один кусок совпадает точно. По каждому куску строки отсортированы, кандидаты —
+    срезы, найденные searchsorted, расстояние до них считается одним векторным popcount.
+    Новые фото попадают в хвост, который просматривается целиком, пока в нём меньше
+    rebuild_every строк; потом таблицы перестраиваются. При миллионе фото поиск —
+    доли миллисекунды.
+    """
+
+    def __init__(self, max_distance: int, rebuild_every: int = 16384):
+        self.max_distance = max_distance
+        self.rebuild_every = rebuild_every
+        chunks = max_distance + 1
+        widths = [HASH_BITS // chunks + (1 if i < HASH_BITS % chunks else 0) for i in range(chunks)]
+        # (сдвиг, маска) каждого куска
+        self._chunks = []
+        shift = HASH_BITS
+        for width in widths:
+            shift -= width
+            self._chunks.append((shift, (1 << width) - 1))
+        self._key_type = np.uint32 if max(widths) <= 32 else np.uint64
+        self._hashes = np.zeros(1024, dtype=np.uint64)
+        self._sellers = np.zeros(1024, dtype=np.int64)
+        self._lots = np.zeros(1024, dtype=np.int64)
+        self._size = 0
+        # строки [0, _indexed) разложены по таблицам: (отсортированные куски, номера строк)
+        self._indexed = 0
+        self._tables = [(np.zeros(0, dtype=self._key_type), np.zeros(0, dtype=np.int32)) for _ in self._chunks]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, phash: int, lot_id: int, seller_id: int):
+        self.extend([phash], [lot_id], [seller_id])
+
+    def extend(self, hashes, lot_ids, seller_ids):
+        count = len(hashes)
+        end = self._size + count
+        if end > len(self._hashes):
+            capacity = max(end, len(self._hashes) * 2)
+            self._hashes = np.resize(self._hashes, capacity)
+            self._sellers = np.resize(self._sellers, capacity)
+            self._lots = np.resize(self._lots, capacity)
+        self._hashes[self._size:end] = np.asarray(hashes, dtype=np.uint64)
+        self._sellers[self._size:end] = seller_ids
+        self._lots[self._size:end] = lot_ids
+        self._size = end
+        if self._size - self._indexed >= self.rebuild_every:
+            self.rebuild()
+
+    def find(self, phash: int, exclude_seller: Optional[int] = None) -> Optional[tuple[int, int]]:
+        """Ближайшее похожее фото: (lot_id, расстояние) или None. Фото exclude_seller не учитываются."""
+        parts = []
+        for (shift, mask), (keys, rows) in zip(self._chunks, self._tables):
+            key = self._key_type((phash >> shift) & mask)
+            parts.append(rows[np.searchsorted(keys, key, "left"):np.searchsorted(keys, key, "right")])
+        parts.append(np.arange(self._indexed, self._size))
+        rows = np.concatenate(parts)
+        if not len(rows):
+            return None
+        distances = np.bitwise_count(self._hashes[rows] ^ np.uint64(phash))
+        close = distances <= self.max_distance
+        if exclude_seller is not None:
+            close &= self._sellers[rows] != exclude_seller
+        if not close.any():
+            return None
+        best = np.flatnonzero(close)[distances[close].argmin()]
+        return int(self._lots[rows[best]]), int(distances[best])
+
+    def similar(self, a: int, b: int) -> bool:
+        return (a ^ b).bit_count() <= self.max_distance
+
+    def rebuild(self):
+        """Разложить хвост по таблицам: отсортировать только его и вставить слиянием."""
+        tail = self._hashes[self._indexed:self._size]
+        tail_rows = np.arange(self._indexed, self._size, dtype=np.int32)
+        tables = []
+        for (shift, mask), (keys, rows) in zip(self._chunks, self._tables):
+            tail_keys = ((tail >> np.uint64(shift)) & np.uint64(mask)).astype(self._key_type)
+            order = np.argsort(tail_keys, kind="stable")
+            tail_keys = tail_keys[order]
+            at = np.searchsorted(keys, tail_keys, "right")
+            tables.append((np.insert(keys, at, tail_keys), np.insert(rows, at, tail_rows[order])))
+        self._tables = tables
+        self._indexed = self._size
+
+
+photo_index = PhotoIndex(settings.photo_hash_max_distance)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_backfill_task: Optional[asyncio.Task] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # не fork: копия процесса с уже запущенным циклом событий, потоками aiosqlite
+        # и открытыми сокетами может зависнуть на захваченном в родителе замке
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.photo_hash_workers, mp_context=multiprocessing.get_context(method)
+        )
+    return _pool
+
+
+@contextmanager
+def _light_main():
+    """
+    Процесс пула при запуске импортирует __main__ родителя — bot.py с настройками, БД и aiogram.
+    Процессы запускаются внутри submit, и на это время вместо bot.py подставляется image_hash.
+    """
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = image_hash
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+async def hash_photo(bot, file_id: str) -> int:
+    """Скачать фото один раз и посчитать хэш в пуле процессов — цикл событий не блокируется."""
+    with photo_hash_seconds.time():
+        buffer = await bot.download(file_id, destination=io.BytesIO())
+        loop = asyncio.get_running_loop()
+        with _light_main():
+            future = loop.run_in_executor(_get_pool(), dhash, buffer.getvalue())
+        return await future
+
+
+async def load_index():
+    """Все уже посчитанные хэши — в память, один проход по таблице."""
+    started = time.perf_counter()
+    async with read_session() as session:
+        rows = await session.stream(
+            select(LotImage.phash, LotImage.lot_id, Lot.seller_id)
+            .join(Lot, Lot.id == LotImage.lot_id)
+            .where(LotImage.phash.is_not(None))
+        )
+        hashes, lot_ids, seller_ids = [], [], []
+        async for phash, lot_id, seller_id in rows:
+            hashes.append(to_unsigned(phash))
+            lot_ids.append(lot_id)
+            seller_ids.append(seller_id)
+    photo_index.extend(hashes, lot_ids, seller_ids)
+    photo_index.rebuild()
+    logger.info("Photo index: %s hashes loaded in %.1f s", len(photo_index), time.perf_counter() - started)
+
+
+async def backfill(bot):
+    """Фоном досчитать хэши фото, загруженных до появления индекса."""
+    interval = 1 / settings.photo_hash_backfill_per_second
+    done = 0
+    # фото, которые не удалось скачать, остаются без хэша до следующего запуска
+    last_id = 0
+    while True:
+        async with read_session() as session:
+            rows = (await session.execute(
+                select(LotImage.id, LotImage.file_id, LotImage.lot_id, Lot.seller_id)
+                .join(Lot, Lot.id == LotImage.lot_id)
+                .where(LotImage.phash.is_(None), LotImage.id > last_id)
+                .order_by(LotImage.id)
+                .limit(100)
+            )).all()
+        if not rows:
+            break
+        for image_id, file_id, lot_id, seller_id in rows:
+            last_id = image_id
+            await asyncio.sleep(interval)
+            try:
+                phash = await hash_photo(bot, file_id)
+            except Exception as e:
+                logger.warning("Photo index: failed to hash image %s: %s", image_id, e)
+                continue
+            async with async_session() as session:
+                await session.execute(update(LotImage).where(LotImage.id == image_id).values(phash=to_signed(phash)))
+                await session.commit()
+            photo_index.add(phash, lot_id, seller_id)
+            done += 1
+    if done:
+        logger.info("Photo index: backfilled %s images", done)
+
+
+def start_backfill(bot):
+    global _backfill_task
+    if settings.photo_hash_backfill_per_second > 0:
+        _backfill_task = tracing.background(backfill(bot))
+
+
+def close():
+    global _pool, _backfill_task
+    if _backfill_task is not None:
+        _backfill_task.cancel()
+        _backfill_task = None
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
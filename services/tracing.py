@@ -0,0 +1,273 @@
+import asyncio
+import contextvars
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy import event
+
+from config import settings
+from services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# трассы, в которые сейчас пишутся спаны; пачка ставок пишет сразу в трассы всех своих ставок
+_current: ContextVar[tuple] = ContextVar("traces", default=())
+
+traces_dropped = registry.counter("traces_dropped_total", "Трассы, не записанные из-за переполненной очереди")
+
+
+class JsonlSink:
+    """
+    Трассы в JSONL-файл. Сериализация и запись идут в отдельном потоке — цикл событий
+    не ждёт диска. Если поток не успевает, трассы сверх max_pending отбрасываются.
+    """
+
+    def __init__(self, path: str, max_pending: int = 10000):
+        self.path = path
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+
+    def write(self, record: dict):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="trace-sink", daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            traces_dropped.inc()
+
+    def close(self):
+        """Дописать очередь и закрыть файл."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as file:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    break
+                try:
+                    file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                    if self._queue.empty():
+                        file.flush()
+                except Exception:
+                    logger.exception("Failed to write trace %s", record.get("trace_id"))
+
+
+sink = JsonlSink(settings.trace_path)
+
+
+class Trace:
+    """
+    Спаны одного запроса (обычно одного обновления). Записывается в sink при finish:
+    всегда, если запрос дольше trace_slow_ms, иначе с вероятностью trace_sample_rate.
+    """
+
+    __slots__ = ("trace_id", "name", "attrs", "started", "spans", "detached", "_t0")
+
+    def __init__(self, name: str, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started = time.time()
+        self.spans: list[dict] = []
+        # обработчик отдал трассу дальше (например, в очередь лота) — закроет её тот, кто доделает работу
+        self.detached = False
+        self._t0 = time.perf_counter()
+
+    def add(self, name: str, start: float, end: float, **attrs):
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self._t0) * 1000, 3),
+            "ms": round((end - start) * 1000, 3),
+            **attrs,
+        })
+
+    def finish(self, **attrs):
+        duration = (time.perf_counter() - self._t0) * 1000
+        self.attrs.update(attrs)
+        slow = duration >= settings.trace_slow_ms
+        if not slow and random.random() >= settings.trace_sample_rate:
+            return
+        if slow:
+            logger.warning("Slow %s: %.0f ms, trace %s", self.name, duration, self.trace_id)
+        try:
+            sink.write({
+                "trace_id": self.trace_id,
+                "name": self.name,
+                "ts": self.started,
+                "ms": round(duration, 3),
+                "slow": slow,
+                **self.attrs,
+                "spans": self.spans,
+            })
+        except OSError:
+            logger.exception("Trace: failed to write %s", self.trace_id)
+
+
+def enabled() -> bool:
+    return bool(settings.trace_path)
+
+
+def current() -> Optional[Trace]:
+    traces = _current.get()
+    return traces[0] if traces else None
+
+
+def detach() -> Optional[Trace]:
+    """Забрать текущую трассу из обработчика: middleware её не закроет."""
+    trace = current()
+    if trace:
+        trace.detached = True
+    return trace
+
+
+def background(coro) -> asyncio.Task:
+    """Задача, которая переживёт текущий запрос, не должна писать спаны в его трассы."""
+    context = contextvars.copy_context()
+    context.run(_current.set, ())
+    return context.run(asyncio.create_task, coro)
+
+
+def record(name: str, start: float, **attrs):
+    """Спан от start (perf_counter) до текущего момента — там, где with неудобен."""
+    traces = _current.get()
+    if traces:
+        end = time.perf_counter()
+        for trace in traces:
+            trace.add(name, start, end, **attrs)
+
+
+class use:
+    """Писать спаны внутри блока в эти трассы."""
+
+    __slots__ = ("traces", "_token")
+
+    def __init__(self, traces: Iterable[Optional[Trace]]):
+        self.traces = tuple(t for t in traces if t is not None)
+
+    def __enter__(self):
+        self._token = _current.set(self.traces)
+        return self
+
+    def __exit__(self, *exc):
+        _current.reset(self._token)
+        return False
+
+
+class span:
+    """Замер участка кода; без активной трассы почти ничего не стоит."""
+
+    __slots__ = ("name", "attrs", "traces", "start")
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.traces = _current.get()
+        if self.traces:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.traces:
+            end = time.perf_counter()
+            if exc_type is not None:
+                self.attrs["error"] = exc_type.__name__
+            for trace in self.traces:
+                trace.add(self.name, self.start, end, **self.attrs)
+        return False
+
+
+class trace:
+    """Отдельная трасса для фоновой работы вне обновлений (старт и закрытие торгов)."""
+
+    __slots__ = ("name", "attrs", "_trace", "_use")
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self._trace = Trace(self.name, **self.attrs) if enabled() else None
+        self._use = use([self._trace])
+        self._use.__enter__()
+        return self._trace
+
+    def __exit__(self, exc_type, exc, tb):
+        self._use.__exit__()
+        if self._trace:
+            self._trace.finish(**({"error": exc_type.__name__} if exc_type else {}))
+        return False
+
+
+class TraceUpdates(BaseMiddleware):
+    """Внешний middleware на dp.update: одна трасса на обновление."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not enabled():
+            return await handler(event, data)
+        user = data.get("event_from_user")
+        t = Trace(
+            f"update.{getattr(event, 'event_type', 'unknown')}",
+            update_id=getattr(event, "update_id", None),
+            user_id=user.id if user else None,
+        )
+        with use([t]):
+            try:
+                return await handler(event, data)
+            except Exception as e:
+                t.attrs["error"] = type(e).__name__
+                raise
+            finally:
+                if not t.detached:
+                    t.finish()
+
+
+class TraceRequests(BaseRequestMiddleware):
+    """Middleware сессии бота: спан на каждый вызов Bot API."""
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"api.{type(method).__name__}"):
+            return await make_request(bot, method)
+
+
+def trace_engine(engine, name: str):
+    """Спан на каждый запрос к БД: первые слова запроса и время."""
+    sync_engine = engine.sync_engine
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if _current.get():
+            conn.info["trace_started"] = time.perf_counter()
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("trace_started", None)
+        traces = _current.get()
+        if started is None or not traces:
+            return
+        end = time.perf_counter()
+        sql = " ".join(statement.split()[:6])
+        for t in traces:
+            t.add(f"db.{name}", started, end, sql=sql)
+
+    event.listen(sync_engine, "before_cursor_execute", before)
+    event.listen(sync_engine, "after_cursor_execute", after)
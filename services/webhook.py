@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import signal
+from typing import Any, Dict
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Обновления обрабатываются в фоне, Telegram сразу получает ответ. Одновременно
+    в работе не больше max_pending обновлений: когда все места заняты,
+    ответ на HTTP-запрос задерживается, и Telegram сам притормаживает доставку.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_pending: int, **kwargs: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self._slots = asyncio.Semaphore(max_pending)
+        self._accepting = True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self._accepting:
+            # бот останавливается — Telegram повторит доставку после запуска
+            return web.Response(status=503)
+        return await super().handle(request)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        await self._slots.acquire()
+        if not self._accepting:
+            self._slots.release()
+            return web.Response(status=503)
+        try:
+            return await super()._handle_request_background(bot, request)
+        except BaseException:
+            # задача обработки не создана — место освобождаем сами
+            self._slots.release()
+            raise
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        try:
+            await super()._background_feed_update(bot, update)
+        finally:
+            self._slots.release()
+
+    async def drain(self, timeout: float):
+        """Перестать принимать обновления и дождаться уже принятых."""
+        self._accepting = False
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+        logger.info("Webhook: waiting for %s updates in progress", len(tasks))
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logger.warning("Webhook: %s updates still running after %s s, cancelling", len(pending), timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def make_webhook_app(dp: Dispatcher, bot: Bot) -> tuple[web.Application, BoundedRequestHandler]:
+    handler = BoundedRequestHandler(
+        dp, bot,
+        max_pending=settings.dispatch_max_pending,
+        secret_token=settings.webhook_secret or None,
+    )
+    app = web.Application()
+    app.router.add_route("POST", settings.webhook_path, handler.handle)
+    return app, handler
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """
+    Принимать обновления через webhook до SIGINT/SIGTERM.
+    Без webhook_base_url set_webhook не вызывается — так сервер можно проверить локально,
+    отправляя POST с сохранённым JSON обновления на webhook_path.
+    """
+    app, handler = make_webhook_app(dp, bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.webhook_host, settings.webhook_port)
+    await site.start()
+    logger.info("Webhook: listening on %s:%s%s", settings.webhook_host, settings.webhook_port, settings.webhook_path)
+
+    if settings.webhook_base_url:
+        await bot.set_webhook(
+            url=settings.webhook_base_url.rstrip("/") + settings.webhook_path,
+            secret_token=settings.webhook_secret or None,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=settings.drop_pending_updates,
+        )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: остаётся KeyboardInterrupt
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        await handler.drain(settings.webhook_drain_timeout)
+        await runner.cleanup()
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+# настройки читаются при импорте config — окружение нужно до импорта модулей бота
+_tmp = tempfile.mkdtemp(prefix="auction-tests-")
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("AUCTION_CHANNEL_ID", "-100")
+os.environ.setdefault("MODERATOR_CHAT_ID", "-200")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_tmp}/auction.db"
+os.environ["FSM_SQLITE_PATH"] = f"{_tmp}/fsm.db"
+os.environ["TRACE_PATH"] = ""
+os.environ["METRICS_PORT"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+
+
+def run(coro):
+    """Корутина в новом цикле; соединения с БД закрываются вместе с ним."""
+    async def main():
+        from database import engine, read_engine
+        try:
+            return await coro
+        finally:
+            await engine.dispose()
+            if read_engine is not engine:
+                await read_engine.dispose()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def db():
+    """Пустая схема на каждый тест."""
+    from database import Base, engine
+    from db_init import upgrade_schema
+
+    async def reset():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(upgrade_schema)
+
+    run(reset())
+
+
+
+class RecordingSession(BaseSession):
+    """Сессия Bot API без сети: запоминает запросы, отвечает responder(method)."""
+
+    def __init__(self, responder=None):
+        super().__init__()
+        self.responder = responder
+        self.requests = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        return self.responder(method) if self.responder else True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def make_bot(responder=None) -> Bot:
+    return Bot("123456:test", session=RecordingSession(responder))
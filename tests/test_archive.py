@@ -0,0 +1,88 @@
+import asyncio
+
+from sqlalchemy import func, select
+
+from conftest import make_bot, run
+
+
+def test_close_lots_one_after_another(db, monkeypatch):
+    from database import async_session, read_session
+    from models import Bid, BidArchive, Lot, LotResult
+    import auctions.logic as logic
+
+    sent = []
+    monkeypatch.setattr(logic.fanout, "send", lambda bot, chat_id, text, **kwargs: sent.append(chat_id))
+    monkeypatch.setattr(logic.channel_posts, "finish", lambda bot, lot_id, text: None)
+
+    async def open_lot(bids):
+        async with async_session() as session:
+            lot = Lot(title="Phone", description="d", start_price=1000, seller_id=1,
+                      auction_started=True, auction_ended=False)
+            session.add(lot)
+            await session.flush()
+            session.add_all(Bid(lot_id=lot.id, user_id=user_id, amount=amount) for user_id, amount in bids)
+            await session.commit()
+        return lot.id
+
+    async def scenario():
+        bot = make_bot()
+        # ставки первого лота удаляются при закрытии, и SQLite выдаёт их id ставкам второго
+        first = await open_lot([(10, 1100), (11, 1200)])
+        await logic.close_auction(first, bot)
+        second = await open_lot([(12, 1500), (13, 1400)])
+        await logic.close_auction(second, bot)
+
+        async with read_session() as session:
+            lots = {lot.id: lot.auction_ended for lot in await session.scalars(select(Lot))}
+            results = {r.lot_id: (r.winner_id, r.final_amount, r.bid_count) for r in await session.scalars(select(LotResult))}
+            archived = await session.scalar(select(func.count()).select_from(BidArchive))
+            left = await session.scalar(select(func.count()).select_from(Bid))
+        return first, second, lots, results, archived, left
+
+    first, second, lots, results, archived, left = run(scenario())
+
+    assert lots == {first: True, second: True}
+    assert results == {first: (11, 1200, 2), second: (12, 1500, 2)}
+    assert archived == 4
+    assert left == 0
+    assert sent == [1, 11, 1, 12]
+
+
+def test_concurrent_close_archives_and_notifies_once(db, monkeypatch):
+    from database import async_session, read_session
+    from models import Bid, BidArchive, Lot, LotResult
+    import auctions.logic as logic
+
+    sent = []
+    monkeypatch.setattr(logic.fanout, "send", lambda bot, chat_id, text, **kwargs: sent.append(chat_id))
+    monkeypatch.setattr(logic.fanout, "broadcast", lambda bot, chat_ids, text, **kwargs: sent.append(tuple(chat_ids)))
+    monkeypatch.setattr(logic.channel_posts, "touch", lambda bot, lot_id: None)
+    monkeypatch.setattr(logic.channel_posts, "finish", lambda bot, lot_id, text: None)
+
+    async def scenario():
+        bot = make_bot()
+        async with async_session() as session:
+            lot = Lot(title="Phone", description="d", start_price=1000, seller_id=1,
+                      auction_started=False, auction_ended=False)
+            session.add(lot)
+            await session.commit()
+
+        # таймеры двух процессов срабатывают одновременно
+        await asyncio.gather(logic.open_auction(lot.id, bot), logic.open_auction(lot.id, bot))
+        opened = list(sent)
+        async with async_session() as session:
+            session.add(Bid(lot_id=lot.id, user_id=10, amount=1100))
+            await session.commit()
+        await asyncio.gather(logic.close_auction(lot.id, bot), logic.close_auction(lot.id, bot))
+
+        async with read_session() as session:
+            results = await session.scalar(select(func.count()).select_from(LotResult))
+            archived = await session.scalar(select(func.count()).select_from(BidArchive))
+        return opened, results, archived
+
+    opened, results, archived = run(scenario())
+
+    assert opened == [()]
+    assert results == 1
+    assert archived == 1
+    assert sent == [(), 1, 10]
@@ -0,0 +1,68 @@
+from datetime import datetime, timezone
+
+from aiogram.methods import AnswerCallbackQuery, SendMessage
+from aiogram.types import CallbackQuery
+
+from conftest import make_bot, run
+
+
+def make_callback(bot, user_id: int, lot_id: int, query_id: str) -> CallbackQuery:
+    return CallbackQuery.model_validate(
+        {
+            "id": query_id,
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "chat_instance": "c",
+            "data": f"bid_{lot_id}_100",
+            "message": {
+                "message_id": 1,
+                "date": datetime.now(timezone.utc),
+                "chat": {"id": user_id, "type": "private"},
+            },
+        },
+        context={"bot": bot},
+    )
+
+
+def test_resolve_bid_batch_answers_every_bid(db, monkeypatch):
+    from database import async_session
+    from models import Lot
+    from auctions.order_book import order_books
+    import handlers.bids as bids
+
+    notified = []
+
+    async def notify_watchers(bot, book, user_id, new_price):
+        notified.append((user_id, new_price))
+
+    monkeypatch.setattr(bids.channel_posts, "touch", lambda bot, lot_id: None)
+    monkeypatch.setattr(bids, "notify_watchers", notify_watchers)
+
+    async def scenario():
+        async with async_session() as session:
+            lot = Lot(title="Phone", description="d", start_price=1000, seller_id=1,
+                      auction_started=True, auction_ended=False)
+            session.add(lot)
+            await session.commit()
+
+        bot = make_bot()
+        batch = [
+            (make_callback(bot, 10, lot.id, "a"), 100),
+            (make_callback(bot, 11, lot.id, "b"), 200),
+            (make_callback(bot, 1, lot.id, "c"), 100),  # продавец на свой лот
+        ]
+        try:
+            await bids.resolve_bid_batch(lot.id, batch)
+        finally:
+            order_books.pop(lot.id, None)
+        return bot.session.requests
+
+    requests = run(scenario())
+
+    answers = {r.callback_query_id: r.text for r in requests if isinstance(r, AnswerCallbackQuery)}
+    assert answers == {
+        "a": "✅ Ставка 1100тг принята.",
+        "b": "✅ Ставка 1300тг принята.",
+        "c": bids.BID_REJECT_MESSAGES["own_lot"],
+    }
+    assert sorted(r.chat_id for r in requests if isinstance(r, SendMessage)) == [10, 11]
+    assert notified == [(11, 1300)]
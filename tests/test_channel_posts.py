@@ -0,0 +1,102 @@
+import asyncio
+import itertools
+
+from conftest import run
+
+
+class SlowBot:
+    """Правки поста доходят через delay секунд; отменённая правка не доходит."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.edits = []
+
+    async def edit_message_text(self, text, chat_id, message_id, reply_markup=None):
+        if reply_markup is not None:
+            await asyncio.sleep(self.delay)
+        self.edits.append((text, reply_markup is not None))
+        return True
+
+
+def make_posts(monkeypatch, tick_interval: float = 60, per_minute: float = 60000, prices=None):
+    import auctions.channel_posts as module
+    from services.fanout import TokenBucket
+
+    async def get_lot_card(lot_id, mode):
+        price = f" — {next(prices)} тг" if prices else ""
+        return (f"Лот #{lot_id}{price}",)
+
+    monkeypatch.setattr(module, "get_lot_card", get_lot_card)
+    monkeypatch.setattr(module.fanout, "bucket", TokenBucket(1000))
+    posts = module.ChannelPosts(chat_id=-100, interval=0, tick_interval=tick_interval, per_minute=per_minute)
+    posts._message_ids[1] = 77
+    return posts
+
+
+def test_finish_waits_for_edit_in_flight(monkeypatch):
+    posts = make_posts(monkeypatch)
+    bot = SlowBot(delay=0.05)
+
+    async def scenario():
+        posts.touch(bot, 1)
+        await asyncio.sleep(0.01)  # правка с кнопкой уже отправлена
+        posts.finish(bot, 1, "🏁 Итог")
+        posts.touch(bot, 1)  # поздняя ставка из уже решённой пачки
+        await asyncio.sleep(0.1)
+        await posts.close()
+
+    run(scenario())
+    assert bot.edits[-1] == ("Лот #1\n🏁 Итог", False)
+    assert all(not with_button for _, with_button in bot.edits)
+    assert 1 not in posts._message_ids
+    assert not posts._pending
+
+
+def test_quiet_lot_is_refreshed_by_tick(monkeypatch):
+    posts = make_posts(monkeypatch, tick_interval=0.02, prices=itertools.count(1000, 100))
+    bot = SlowBot(delay=0)
+
+    async def scenario():
+        posts.touch(bot, 1)
+        await asyncio.sleep(0.11)
+        edits = len(bot.edits)
+        posts.finish(bot, 1, "🏁 Итог")
+        await asyncio.sleep(0.05)
+        await posts.close()
+        return edits
+
+    assert run(scenario()) >= 4
+    assert bot.edits[-1][1] is False
+    assert bot.edits[-1][0].endswith("\n🏁 Итог")
+
+
+def test_unchanged_post_is_not_edited_again(monkeypatch):
+    posts = make_posts(monkeypatch, tick_interval=0.02)
+    bot = SlowBot(delay=0)
+
+    async def scenario():
+        posts.touch(bot, 1)
+        await asyncio.sleep(0.11)
+        await posts.close()
+
+    run(scenario())
+    assert bot.edits == [("Лот #1", True)]
+
+
+def test_channel_bucket_limits_edits_across_lots(monkeypatch):
+    # 600 в минуту — одна правка в 0.1 с, сколько бы лотов ни менялось
+    posts = make_posts(monkeypatch, per_minute=600, prices=itertools.count(1000, 100))
+    posts._message_ids.update({2: 78, 3: 79})
+    bot = SlowBot(delay=0)
+
+    async def scenario():
+        for lot_id in (1, 2, 3):
+            posts.touch(bot, lot_id)
+        await asyncio.sleep(0.15)
+        edits = len(bot.edits)
+        await asyncio.sleep(0.15)
+        await posts.close()
+        return edits
+
+    assert run(scenario()) == 2
+    assert len(bot.edits) == 3
@@ -0,0 +1,73 @@
+import pytest
+from sqlalchemy import Boolean, Column, Integer, MetaData, String, Table, create_engine, select, text
+
+
+def test_add_column_keeps_default_and_not_null():
+    from db_init import add_column_sql
+
+    table = Table(
+        "items", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("hidden", Boolean, default=False, nullable=False),
+        Column("note", String, nullable=True),
+        Column("title", String, nullable=False),
+    )
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY)"))
+        conn.execute(text("INSERT INTO items (id) VALUES (1)"))
+        conn.execute(text(add_column_sql(conn, table, table.c.hidden)))
+        conn.execute(text(add_column_sql(conn, table, table.c.note)))
+        assert conn.execute(text("SELECT hidden, note FROM items")).one() == (0, None)
+        # NOT NULL без значения по умолчанию в заполненную таблицу не добавить
+        with pytest.raises(RuntimeError):
+            add_column_sql(conn, table, table.c.title)
+
+
+def test_telegram_ids_are_bigint_on_postgres():
+    from sqlalchemy.dialects import postgresql
+    from sqlalchemy.schema import CreateTable
+    from models import Bid, BidArchive, Lot, LotResult, Watcher
+
+    dialect = postgresql.dialect()
+    columns = (
+        (Lot.__table__, "seller_id BIGINT NOT NULL"), (Bid.__table__, "user_id BIGINT NOT NULL"),
+        (Watcher.__table__, "user_id BIGINT NOT NULL"), (BidArchive.__table__, "user_id BIGINT NOT NULL"),
+        (LotResult.__table__, "winner_id BIGINT"),
+    )
+    for table, column in columns:
+        assert column in str(CreateTable(table).compile(dialect=dialect)), table.name
+
+
+def test_upgrade_widens_integer_ids_on_postgres_only():
+    from sqlalchemy.dialects import postgresql, sqlite
+    from db_init import widen_column_sql
+    from models import Bid
+
+    table = Bid.__table__
+    assert widen_column_sql(postgresql.dialect(), table, table.c.user_id, postgresql.INTEGER()) == (
+        "ALTER TABLE bids ALTER COLUMN user_id TYPE BIGINT"
+    )
+    assert widen_column_sql(postgresql.dialect(), table, table.c.user_id, postgresql.BIGINT()) is None
+    assert widen_column_sql(postgresql.dialect(), table, table.c.amount, postgresql.INTEGER()) is None
+    assert widen_column_sql(sqlite.dialect(), table, table.c.user_id, Integer()) is None
+
+
+def test_large_telegram_id_round_trips(db):
+    from conftest import run
+    from database import async_session, read_session
+    from models import Bid, Lot
+
+    big = 2 ** 33 + 7
+
+    async def scenario():
+        async with async_session() as session:
+            lot = Lot(title="Phone", description="d", start_price=1000, seller_id=big)
+            session.add(lot)
+            await session.flush()
+            session.add(Bid(lot_id=lot.id, user_id=big, amount=1100))
+            await session.commit()
+        async with read_session() as session:
+            return (await session.get(Lot, lot.id)).seller_id, await session.scalar(select(Bid.user_id))
+
+    assert run(scenario()) == (big, big)
@@ -0,0 +1,96 @@
+import asyncio
+from datetime import datetime, timezone
+
+from aiogram import Dispatcher, F, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Update
+
+from conftest import make_bot, run
+
+
+def message_update(update_id: int, user_id: int, text: str) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": datetime.now(timezone.utc),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "text": text,
+        },
+    })
+
+
+def poll_update(update_id: int) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "poll": {
+            "id": str(update_id), "question": "?", "options": [], "total_voter_count": 0,
+            "is_closed": False, "is_anonymous": True, "type": "regular",
+            "allows_multiple_answers": False,
+        },
+    })
+
+
+def make_dispatcher(ordered) -> Dispatcher:
+    # как в bot.py: FSM после очереди
+    dp = Dispatcher(disable_fsm=True)
+    dp.update.outer_middleware(ordered)
+    dp.update.outer_middleware(dp.fsm)
+    return dp
+
+
+def test_state_is_read_after_previous_update_of_user():
+    from services.dispatch import OrderedDispatch
+
+    seen = []
+    router = Router()
+
+    @router.message(F.text == "start")
+    async def start(message, state: FSMContext):
+        await asyncio.sleep(0.05)
+        await state.set_state("Sell:title")
+
+    @router.message()
+    async def other(message, raw_state):
+        seen.append(raw_state)
+
+    dp = make_dispatcher(OrderedDispatch(concurrency=4))
+    dp.include_router(router)
+
+    async def scenario():
+        bot = make_bot()
+        await asyncio.gather(
+            dp.feed_update(bot, message_update(1, 10, "start")),
+            dp.feed_update(bot, message_update(2, 10, "Phone")),
+        )
+
+    run(scenario())
+    assert seen == ["Sell:title"]
+
+
+def test_updates_without_chat_and_user_are_not_serialized():
+    from services.dispatch import OrderedDispatch
+
+    running = []
+    peak = []
+    router = Router()
+
+    @router.poll()
+    async def on_poll(poll):
+        running.append(poll.id)
+        peak.append(len(running))
+        await asyncio.sleep(0.02)
+        running.remove(poll.id)
+
+    ordered = OrderedDispatch(concurrency=4)
+    dp = make_dispatcher(ordered)
+    dp.include_router(router)
+
+    async def scenario():
+        bot = make_bot()
+        await asyncio.gather(*(dp.feed_update(bot, poll_update(i)) for i in range(3)))
+
+    run(scenario())
+    assert max(peak) == 3
+    assert ordered.stats()["active_keys"] == 0
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from conftest import make_bot, run
+
+
+def _setup(monkeypatch):
+    import auctions.logic as logic
+    from auctions.scheduler import AuctionScheduler
+
+    monkeypatch.setattr(logic, "scheduler", AuctionScheduler())
+    monkeypatch.setattr(logic, "_extensions_task", None)
+    monkeypatch.setattr(logic.settings, "soft_close_seconds", 60)
+    monkeypatch.setattr(logic.settings, "soft_close_extension_seconds", 120)
+    return logic
+
+
+async def _add_lot(ends_at):
+    from database import async_session
+    from models import AuctionSchedule, Lot
+
+    async with async_session() as session:
+        lot = Lot(title="Phone", description="d", start_price=1000, seller_id=1,
+                  auction_started=True, auction_ended=False)
+        session.add(lot)
+        await session.flush()
+        session.add(AuctionSchedule(lot_id=lot.id, starts_at=ends_at - timedelta(minutes=30),
+                                    ends_at=ends_at, started=True))
+        await session.commit()
+    return lot.id
+
+
+def test_late_bid_extends_and_persists(db, monkeypatch):
+    from database import read_session
+    from models import AuctionSchedule
+    from auctions.scheduler import END, as_utc
+
+    logic = _setup(monkeypatch)
+
+    async def scenario():
+        ends_at = datetime.now(timezone.utc) + timedelta(seconds=10)
+        lot_id = await _add_lot(ends_at)
+        logic.scheduler.add(END, lot_id, ends_at)
+
+        new_end = logic.extend_on_bid(lot_id)
+        # вторая ставка в ту же секунду конец уже не двигает
+        again = logic.extend_on_bid(lot_id)
+        await logic._extensions_task
+
+        async with read_session() as session:
+            stored = await session.scalar(select(AuctionSchedule.ends_at).where(AuctionSchedule.lot_id == lot_id))
+        return ends_at, new_end, again, logic.scheduler.due_at(END, lot_id), as_utc(stored)
+
+    ends_at, new_end, again, due, stored = run(scenario())
+
+    assert new_end - ends_at > timedelta(seconds=100)
+    assert again is None
+    assert due == new_end
+    assert abs(stored - new_end) < timedelta(milliseconds=1)
+    assert logic.pending_extensions == {}
+
+
+def test_early_bid_does_not_extend(db, monkeypatch):
+    from auctions.scheduler import END
+
+    logic = _setup(monkeypatch)
+    ends_at = datetime.now(timezone.utc) + timedelta(minutes=10)
+    logic.scheduler.add(END, 7, ends_at)
+
+    assert logic.extend_on_bid(7) is None
+    assert logic.scheduler.due_at(END, 7) == ends_at
+    assert logic.pending_extensions == {}
+
+
+def test_close_reschedules_when_another_process_extended(db, monkeypatch):
+    from database import read_session
+    from models import Lot
+    from auctions.scheduler import END
+
+    logic = _setup(monkeypatch)
+    monkeypatch.setattr(logic.channel_posts, "finish", lambda bot, lot_id, text: None)
+
+    async def scenario():
+        # в БД уже лежит продление, записанное другим процессом
+        ends_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+        lot_id = await _add_lot(ends_at)
+        await logic.close_auction(lot_id, make_bot())
+        async with read_session() as session:
+            ended = await session.scalar(select(Lot.auction_ended).where(Lot.id == lot_id))
+        return ends_at, ended, logic.scheduler.due_at(END, lot_id)
+
+    ends_at, ended, due = run(scenario())
+
+    assert ended is False
+    assert abs(due - ends_at) < timedelta(milliseconds=1)
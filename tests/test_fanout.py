@@ -0,0 +1,194 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from conftest import run
+
+
+class FakeBot:
+    """Запоминает (chat_id, текст, время); в slow_chats отправка занимает slow секунд."""
+
+    def __init__(self, slow_chats=(), slow: float = 0):
+        self.slow_chats = set(slow_chats)
+        self.slow = slow
+        self.sent = []
+        self._ids = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.slow_chats:
+            await asyncio.sleep(self.slow)
+        self.sent.append((chat_id, text, asyncio.get_running_loop().time()))
+        self._ids += 1
+        return SimpleNamespace(message_id=self._ids)
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.sent.append((chat_id, text, asyncio.get_running_loop().time()))
+        return True
+
+
+def test_latest_message_is_not_stuck_after_failed_requeue():
+    from services.fanout import FanOut
+
+    async def scenario():
+        fanout = FanOut(workers=1, rate=1000, chat_interval=0.05, max_retries=1, max_pending=1)
+        bot = FakeBot(slow_chats={20}, slow=0.15)
+        fanout.send(bot, 10, "hello")
+        await asyncio.sleep(0.01)
+        # чат 10 только что получил сообщение — цена ждёт интервал вне очереди
+        fanout.send_latest(bot, "lot", 10, "price 1")
+        await asyncio.sleep(0.01)
+        fanout.send(bot, 20, "slow")
+        await asyncio.sleep(0.01)
+        fanout.send(bot, 30, "fills the queue")
+        # интервал прошёл, очередь полна — задание с ценой теряется
+        await asyncio.sleep(0.25)
+        stuck = ("lot", 10) in fanout._latest
+        fanout.send_latest(bot, "lot", 10, "price 2")
+        await fanout.join()
+        await fanout.close()
+        return stuck, [(chat_id, text) for chat_id, text, _ in bot.sent]
+
+    stuck, sent = run(scenario())
+    assert not stuck
+    assert sent == [(10, "hello"), (20, "slow"), (30, "fills the queue"), (10, "price 2")]
+
+
+def test_forget_drops_unsent_latest_messages():
+    from services.fanout import FanOut
+
+    async def scenario():
+        fanout = FanOut(workers=1, rate=1000, chat_interval=1, max_retries=1, max_pending=10)
+        bot = FakeBot()
+        fanout.send(bot, 10, "hello")
+        await asyncio.sleep(0.01)
+        fanout.send_latest(bot, "lot", 10, "price 1")
+        fanout.send_latest(bot, "other", 10, "price 1")
+        await asyncio.sleep(0.01)
+        fanout.forget("lot")
+        keys = set(fanout._latest)
+        for task in fanout._tasks:
+            task.cancel()
+        await asyncio.gather(*fanout._tasks, return_exceptions=True)
+        return keys
+
+    assert run(scenario()) == {("other", 10)}
+
+
+class FloodBot(FakeBot):
+    """Первая отправка в flood_chat получает RetryAfter."""
+
+    def __init__(self, flood_chat: int, retry_after: int):
+        super().__init__()
+        self.flood_chat = flood_chat
+        self.retry_after = retry_after
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == self.flood_chat and self.retry_after:
+            retry_after, self.retry_after = self.retry_after, 0
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "flood", retry_after=retry_after)
+        return await super().send_message(chat_id, text, **kwargs)
+
+
+def test_token_bucket_spaces_requests():
+    from services.fanout import TokenBucket
+
+    async def scenario():
+        bucket = TokenBucket(rate=50, capacity=1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for _ in range(6):
+            await bucket.acquire()
+        return loop.time() - started
+
+    # первый запрос сразу, дальше по одному раз в 1/50 с
+    assert run(scenario()) >= 5 / 50 - 0.01
+
+
+def test_token_bucket_pause_stops_everyone():
+    from services.fanout import TokenBucket
+
+    async def scenario():
+        bucket = TokenBucket(rate=1000)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        bucket.pause(0.1)
+        await asyncio.gather(bucket.acquire(), bucket.acquire())
+        return loop.time() - started
+
+    assert run(scenario()) >= 0.1 - 0.01
+
+
+def test_fanout_spaces_messages_per_chat():
+    from services.fanout import FanOut
+
+    async def scenario():
+        fanout = FanOut(workers=4, rate=1000, chat_interval=0.05, max_retries=1, max_pending=100)
+        bot = FakeBot()
+        started = asyncio.get_running_loop().time()
+        for i in range(3):
+            fanout.send(bot, 10, f"to 10 #{i}")
+        fanout.send(bot, 20, "to 20")
+        await fanout.join()
+        await fanout.close()
+        return [(chat_id, text, at - started) for chat_id, text, at in bot.sent]
+
+    sent = run(scenario())
+    to_10 = [at for chat_id, _, at in sent if chat_id == 10]
+    assert [text for chat_id, text, _ in sent if chat_id == 10] == ["to 10 #0", "to 10 #1", "to 10 #2"]
+    assert all(b - a >= 0.05 - 0.01 for a, b in zip(to_10, to_10[1:]))
+    # другой чат не ждёт интервала чата 10
+    assert [at for chat_id, _, at in sent if chat_id == 20][0] < to_10[1]
+
+
+def test_fanout_retry_after_pauses_all_chats():
+    from services.fanout import FanOut
+
+    async def scenario():
+        fanout = FanOut(workers=1, rate=1000, chat_interval=0, max_retries=2, max_pending=100)
+        bot = FloodBot(flood_chat=10, retry_after=1)
+        started = asyncio.get_running_loop().time()
+        fanout.send(bot, 10, "to 10")
+        fanout.send(bot, 20, "to 20")
+        await fanout.join()
+        await fanout.close()
+        return {chat_id: at - started for chat_id, _, at in bot.sent}
+
+    sent = run(scenario())
+    assert set(sent) == {10, 20}
+    # после RetryAfter молчат все чаты, а не только тот, где пришла ошибка
+    assert min(sent.values()) >= 1 - 0.01
+
+
+def test_close_gives_up_after_timeout():
+    from services.fanout import FanOut, fanout_messages
+
+    dropped_before = fanout_messages.value(result="dropped_on_shutdown")
+
+    async def scenario():
+        fanout = FanOut(workers=1, rate=1000, chat_interval=0.05, max_retries=1, max_pending=100)
+        bot = FakeBot(slow_chats={10}, slow=0.1)
+        for i in range(10):
+            fanout.send(bot, 10, f"msg {i}")
+        # второе сообщение чата 20 ждёт интервал вне очереди
+        fanout.send(bot, 20, "first")
+        fanout.send(bot, 20, "second")
+        started = asyncio.get_running_loop().time()
+        await fanout.close(timeout=0.25)
+        took = asyncio.get_running_loop().time() - started
+        sent_at_close = len(bot.sent)
+        # отложенное сообщение после close в очередь уже не встаёт
+        await asyncio.sleep(0.1)
+        return took, sent_at_close, len(bot.sent), fanout.pending, fanout.send(bot, 30, "late")
+
+    took, sent_at_close, sent, pending, accepted = run(scenario())
+
+    assert took < 0.4
+    assert sent_at_close < 12
+    assert sent == sent_at_close
+    assert pending == 0
+    assert not accepted
+    # сообщение, которое воркер отправлял в момент отмены, в очереди уже не числится
+    dropped = fanout_messages.value(result="dropped_on_shutdown") - dropped_before
+    assert 12 - sent_at_close - 1 <= dropped <= 12 - sent_at_close
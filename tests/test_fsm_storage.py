@@ -0,0 +1,254 @@
+import asyncio
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+from conftest import run
+
+
+class FakeRedis:
+    """Сервер с протоколом Redis в памяти: GET/SET/DEL, на остальное — -ERR."""
+
+    def __init__(self):
+        self.values = {}
+        self.connections = 0
+        self.server = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"redis://{host}:{port}/0"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                count = int((await reader.readuntil(b"\r\n"))[1:-2])
+                args = []
+                for _ in range(count):
+                    size = int((await reader.readuntil(b"\r\n"))[1:-2])
+                    args.append((await reader.readexactly(size + 2))[:-2])
+                writer.write(self._reply(args))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _reply(self, args) -> bytes:
+        command = args[0].upper()
+        if command == b"GET":
+            value = self.values.get(args[1])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if command == b"SET":
+            self.values[args[1]] = args[2]
+            return b"+OK\r\n"
+        if command == b"DEL":
+            return b":%d\r\n" % (self.values.pop(args[1], None) is not None)
+        return b"-ERR unknown command '%s'\r\n" % args[0]
+
+
+def test_pipeline_error_does_not_desync_replies():
+    from services.fsm_storage import RespClient, RespError
+
+    async def scenario():
+        server = FakeRedis()
+        client = RespClient(await server.start())
+        try:
+            await client.execute(("SET", "a", "1"), ("SET", "b", "2"))
+            with pytest.raises(RespError):
+                await client.execute(("GET", "a"), ("BOGUS",), ("GET", "b"))
+            # ответы ошибочного пакета дочитаны: следующий запрос получает свой ответ
+            assert await client.execute(("GET", "b")) == [b"2"]
+            assert await client.execute(("GET", "a"), ("DEL", "a"), ("GET", "a")) == [b"1", 1, None]
+            return server.connections
+        finally:
+            await client.close()
+            await server.stop()
+
+    assert run(scenario()) == 1
+
+
+def test_cancelled_request_drops_connection():
+    from services.fsm_storage import RespClient
+
+    async def scenario():
+        server = FakeRedis()
+        client = RespClient(await server.start())
+        try:
+            await client.execute(("SET", "a", "1"))
+            original = client._read_reply
+
+            async def slow_reply():
+                await asyncio.sleep(1)
+                return await original()
+
+            client._read_reply = slow_reply
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.execute(("GET", "a")), 0.05)
+            client._read_reply = original
+            # непрочитанный ответ остался в старом соединении, запрос идёт по новому
+            assert await client.execute(("SET", "b", "2"), ("GET", "a")) == ["OK", b"1"]
+            return server.connections
+        finally:
+            await client.close()
+            await server.stop()
+
+    assert run(scenario()) == 2
+
+
+def test_resp_storage_round_trip():
+    from services.fsm_storage import RespStorage
+
+    key = StorageKey(bot_id=1, chat_id=2, user_id=3)
+
+    async def scenario():
+        server = FakeRedis()
+        url = await server.start()
+        storage = RespStorage(url, ttl=3600, flush_interval=0.01, max_cached=10)
+        try:
+            await storage.set_state(key, "Sell:title")
+            await storage.set_data(key, {"title": "Phone"})
+            await storage.flush()
+            fresh = RespStorage(url, ttl=3600, flush_interval=0.01, max_cached=10)
+            try:
+                return await fresh.get_state(key), await fresh.get_data(key)
+            finally:
+                await fresh.close()
+        finally:
+            await storage.close()
+            await server.stop()
+
+    assert run(scenario()) == ("Sell:title", {"title": "Phone"})
+
+
+def test_sqlite_storage_connects_once(tmp_path, monkeypatch):
+    import aiosqlite
+    from services.fsm_storage import SQLiteStorage
+
+    connects = []
+    original = aiosqlite.connect
+
+    def connect(*args, **kwargs):
+        connects.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(aiosqlite, "connect", connect)
+    storage = SQLiteStorage(str(tmp_path / "fsm.db"), ttl=3600, flush_interval=0.01, max_cached=10)
+    keys = [StorageKey(bot_id=1, chat_id=i, user_id=i) for i in range(20)]
+
+    async def scenario():
+        try:
+            return await asyncio.gather(*(storage.get_state(key) for key in keys))
+        finally:
+            await storage.close()
+
+    assert run(scenario()) == [None] * 20
+    assert len(connects) == 1
+
+
+def test_storage_backend_must_implement_load_and_save():
+    from services.fsm_storage import CoalescingStorage
+
+    with pytest.raises(TypeError):
+        CoalescingStorage(ttl=1, flush_interval=1, max_cached=1)
+
+
+def _dict_storage(**kwargs):
+    from services.fsm_storage import CoalescingStorage
+
+    class DictStorage(CoalescingStorage):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.backend = {}
+            self.fail = False
+
+        async def _load(self, k):
+            return self.backend.get(k)
+
+        async def _save(self, batch):
+            if self.fail:
+                raise ConnectionError("backend is down")
+            for k, r in batch.items():
+                if r:
+                    self.backend[k] = r
+                else:
+                    self.backend.pop(k, None)
+
+        async def _purge(self, older_than):
+            raise ConnectionError("backend is down")
+
+    return DictStorage(**kwargs)
+
+
+def test_failed_flush_keeps_records_of_evicted_keys():
+    storage = _dict_storage(ttl=3600, flush_interval=60, max_cached=1)
+    first = StorageKey(bot_id=1, chat_id=1, user_id=1)
+    other = StorageKey(bot_id=1, chat_id=2, user_id=2)
+
+    async def scenario():
+        await storage.set_state(first, "Sell:title")
+        storage.fail = True
+        await storage.flush()
+        # пока бэкенд лежит, первый ключ вытесняется из кэша
+        await storage.get_state(other)
+        evicted = storage.key_builder.build(first) not in storage._cache
+        state = await storage.get_state(first)
+        storage.fail = False
+        await storage.flush()
+        return evicted, state
+
+    evicted, state = run(scenario())
+
+    assert evicted
+    assert state == "Sell:title"
+    assert [r.state for r in storage.backend.values()] == ["Sell:title"]
+    assert not storage._unsaved
+
+
+def test_flush_survives_purge_error():
+    storage = _dict_storage(ttl=3600, flush_interval=60, max_cached=10)
+    key = StorageKey(bot_id=1, chat_id=1, user_id=1)
+
+    async def scenario():
+        await storage.set_data(key, {"title": "Phone"})
+        await storage.flush()
+
+    run(scenario())
+    assert [r.data for r in storage.backend.values()] == [{"title": "Phone"}]
+
+
+def test_resp_ttl_rounds_up_to_a_second():
+    from services.fsm_storage import RespStorage
+
+    storage = RespStorage("redis://localhost:1/0", ttl=0.5, flush_interval=60, max_cached=10)
+    sent = []
+
+    async def execute(*commands):
+        sent.extend(commands)
+        return [None if command[0] == "GET" else "OK" for command in commands]
+
+    storage.client.execute = execute
+    key = StorageKey(bot_id=1, chat_id=1, user_id=1)
+
+    async def scenario():
+        await storage.set_state(key, "Sell:title")
+        await storage.flush()
+
+    run(scenario())
+    # int(0.5) дал бы EX 0, и Redis отклонил бы весь пакет
+    assert sent[-1][0] == "SET"
+    assert sent[-1][3:] == ("EX", 1)
+
+
+def test_unknown_fsm_storage_is_rejected(monkeypatch):
+    from config import settings
+    from services.fsm_storage import create_storage
+
+    monkeypatch.setattr(settings, "fsm_storage", "mongo")
+    with pytest.raises(ValueError):
+        create_storage()
@@ -0,0 +1,108 @@
+import pytest
+from pydantic import ValidationError
+
+from conftest import run
+
+
+def test_listing_escapes_seller_text(db):
+    from database import async_session
+    from models import Lot, LotStatus
+    from auctions.listing import get_page, page_cache
+
+    async def scenario():
+        async with async_session() as session:
+            session.add(Lot(title="iPhone <Pro> & Max", description="d", start_price=1000, seller_id=1,
+                            condition="<b>new", status=LotStatus.approved))
+            await session.commit()
+        page_cache.clear()
+        try:
+            return await get_page()
+        finally:
+            page_cache.clear()
+
+    text, _ = run(scenario())
+    assert "<b>iPhone &lt;Pro&gt; &amp; Max</b>" in text
+    assert "&lt;b&gt;new" in text
+
+
+def test_field_limit_stays_positive(monkeypatch):
+    from auctions import listing
+
+    monkeypatch.setattr(listing.settings, "listing_page_size", 10)
+    assert listing._field_limit() >= listing.MIN_FIELD_LIMIT
+
+
+def test_listing_page_size_is_validated():
+    from config import Settings
+
+    with pytest.raises(ValidationError):
+        Settings(listing_page_size=20)
+    with pytest.raises(ValidationError):
+        Settings(listing_page_size=0)
+
+
+def test_page_cache_expires_and_caps_pages(monkeypatch):
+    from auctions import listing
+
+    now = [100.0]
+    monkeypatch.setattr(listing.time, "monotonic", lambda: now[0])
+    cache = listing.PageCache(ttl=10, max_pages=3)
+
+    cache.put(("next", 1), "a", None, [1, 2])
+    now[0] += 20
+    # истёкшая страница удаляется при чтении вместе со ссылками лотов
+    assert cache.get(("next", 1)) is None
+    assert len(cache) == 0 and cache._lot_pages == {}
+
+    for cursor in range(5):
+        cache.put(("next", cursor), str(cursor), None, [cursor])
+    assert len(cache) == 3
+    assert [cache.get(("next", cursor)) for cursor in range(5)] == [None, None, ("2", None), ("3", None), ("4", None)]
+    assert set(cache._lot_pages) == {2, 3, 4}
+
+    now[0] += 20
+    cache.put(("prev", 9), "9", None, [9])
+    # при переполнении первыми уходят истёкшие страницы
+    assert len(cache) == 1
+    assert set(cache._lot_pages) == {9}
+
+
+def test_bad_page_callback_is_answered(monkeypatch):
+    from datetime import datetime, timezone
+
+    from aiogram.methods import AnswerCallbackQuery
+    from aiogram.types import CallbackQuery
+    from conftest import make_bot
+    import handlers.bids as bids
+
+    pages = []
+
+    async def get_page(**kwargs):
+        pages.append(kwargs)
+        return None, None
+
+    monkeypatch.setattr(bids, "get_page", get_page)
+    bot = make_bot()
+
+    async def scenario():
+        for data in ("lots_next", "lots_next_x", "lots_up_5", "lots_prev_-1", "lots_next_5_6", "lots_prev_7"):
+            callback = CallbackQuery.model_validate(
+                {
+                    "id": data,
+                    "from": {"id": 1, "is_bot": False, "first_name": "u"},
+                    "chat_instance": "c",
+                    "data": data,
+                    "message": {"message_id": 1, "date": datetime.now(timezone.utc), "chat": {"id": 1, "type": "private"}},
+                },
+                context={"bot": bot},
+            )
+            await bids.handle_lots_page(callback)
+
+    run(scenario())
+
+    answers = [r for r in bot.session.requests if isinstance(r, AnswerCallbackQuery)]
+    assert [a.callback_query_id for a in answers] == [
+        "lots_next", "lots_next_x", "lots_up_5", "lots_prev_-1", "lots_next_5_6", "lots_prev_7"
+    ]
+    assert {a.text for a in answers[:5]} == {"❌ Некорректные данные."}
+    assert pages == [{"before_id": 7}]
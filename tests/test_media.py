@@ -0,0 +1,44 @@
+import pytest
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from conftest import run
+
+
+def failing(errors):
+    calls = []
+
+    async def request():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return "sent"
+
+    return request, calls
+
+
+@pytest.fixture
+def media(monkeypatch):
+    from services import media as module
+    from services.fanout import TokenBucket
+
+    monkeypatch.setattr(module.fanout, "bucket", TokenBucket(1000))
+    return module.MediaDelivery(max_cached=10, max_retries=3)
+
+
+def test_call_retries_after_retry_after(media):
+    method = SendMessage(chat_id=1, text="x")
+    request, calls = failing([TelegramRetryAfter(method, "flood", retry_after=0)])
+
+    assert run(media.call(request)) == "sent"
+    assert len(calls) == 2
+
+
+def test_call_does_not_resend_after_network_error(media):
+    # запрос мог дойти до Telegram — повтор отправил бы альбом второй раз
+    method = SendMessage(chat_id=1, text="x")
+    request, calls = failing([TelegramNetworkError(method, "timeout")])
+
+    with pytest.raises(TelegramNetworkError):
+        run(media.call(request))
+    assert len(calls) == 1
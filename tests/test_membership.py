@@ -0,0 +1,70 @@
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.methods import GetChatMember
+from aiogram.types import ChatMemberLeft, ChatMemberMember, User
+
+from conftest import make_bot, run
+
+USER = User(id=42, is_bot=False, first_name="u")
+
+
+def _setup(monkeypatch, statuses):
+    """statuses — ответы get_chat_member по очереди: member, left или исключение."""
+    import services.membership as membership
+
+    now = [1000.0]
+    monkeypatch.setattr(membership.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(membership, "membership_cache", membership.MembershipCache(ttl=600, negative_ttl=30, max_size=10))
+    replies = iter(statuses)
+
+    def responder(method):
+        assert isinstance(method, GetChatMember)
+        reply = next(replies)
+        if isinstance(reply, Exception):
+            raise reply
+        return ChatMemberMember(user=USER) if reply == "member" else ChatMemberLeft(user=USER)
+
+    return membership, now, make_bot(responder)
+
+
+def test_member_is_cached_until_ttl(monkeypatch):
+    membership, now, bot = _setup(monkeypatch, ["member", "left"])
+
+    async def scenario():
+        first = await membership.is_channel_member(bot, -100, USER.id)
+        now[0] += 599
+        cached = await membership.is_channel_member(bot, -100, USER.id)
+        requests = len(bot.session.requests)
+        now[0] += 2
+        expired = await membership.is_channel_member(bot, -100, USER.id)
+        return first, cached, requests, expired
+
+    assert run(scenario()) == (True, True, 1, False)
+    assert len(bot.session.requests) == 2
+
+
+def test_non_member_is_rechecked_sooner(monkeypatch):
+    membership, now, bot = _setup(monkeypatch, ["left", "member"])
+
+    async def scenario():
+        first = await membership.is_channel_member(bot, -100, USER.id)
+        now[0] += 31
+        # только что подписался — отрицательный ответ уже истёк
+        return first, await membership.is_channel_member(bot, -100, USER.id)
+
+    assert run(scenario()) == (False, True)
+
+
+def test_api_error_falls_back_to_last_known(monkeypatch):
+    error = TelegramNetworkError(method=GetChatMember(chat_id=-100, user_id=USER.id), message="timeout")
+    membership, now, bot = _setup(monkeypatch, [error, "member", error])
+
+    async def scenario():
+        # значения ещё нет — «неизвестно», и ошибка не кэшируется
+        unknown = await membership.is_channel_member(bot, -100, USER.id)
+        known = await membership.is_channel_member(bot, -100, USER.id)
+        now[0] += 601
+        stale = await membership.is_channel_member(bot, -100, USER.id)
+        return unknown, known, stale
+
+    assert run(scenario()) == (None, True, True)
+    assert len(bot.session.requests) == 3
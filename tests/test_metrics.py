@@ -0,0 +1,78 @@
+import socket
+
+import aiohttp
+
+from conftest import run
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_render_counters_gauges_and_histograms():
+    from services.metrics import Registry
+
+    registry = Registry()
+    requests = registry.counter("requests_total", "Запросы", ("method",))
+    registry.gauge("queue_size", "Очередь", fn=lambda: 3)
+    latency = registry.histogram("latency_seconds", "Время", ("method",), buckets=(0.1, 1))
+    requests.inc(method="send")
+    requests.inc(2, method='say "hi"')
+    latency.observe(0.05, method="send")
+    latency.observe(0.5, method="send")
+    latency.observe(5, method="send")
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{method="send"} 1' in lines
+    # кавычка в значении метки сломала бы формат
+    assert "requests_total{method=\"say 'hi'\"} 2" in lines
+    assert "queue_size 3" in lines
+    assert "# TYPE latency_seconds histogram" in lines
+    assert lines[lines.index('latency_seconds_bucket{method="send",le="0.1"} 1'):][:5] == [
+        'latency_seconds_bucket{method="send",le="0.1"} 1',
+        'latency_seconds_bucket{method="send",le="1"} 2',
+        'latency_seconds_bucket{method="send",le="+Inf"} 3',
+        'latency_seconds_sum{method="send"} 5.55',
+        'latency_seconds_count{method="send"} 3',
+    ]
+
+
+def test_server_serves_registry():
+    from services.metrics import MetricsServer, registry
+
+    registry.counter("test_scrapes_total", "Проверка /metrics").inc()
+
+    async def scenario():
+        server = MetricsServer("127.0.0.1", _free_port())
+        await server.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{server.port}/metrics") as response:
+                    return response.status, response.content_type, await response.text()
+        finally:
+            await server.stop()
+
+    status, content_type, body = run(scenario())
+
+    assert status == 200
+    assert content_type == "text/plain"
+    assert "test_scrapes_total 1" in body.splitlines()
+    assert "# TYPE bot_update_seconds histogram" in body
+
+
+def test_busy_port_does_not_stop_startup():
+    from services.metrics import MetricsServer
+
+    async def scenario():
+        with socket.socket() as busy:
+            busy.bind(("127.0.0.1", 0))
+            busy.listen()
+            server = MetricsServer("127.0.0.1", busy.getsockname()[1])
+            await server.start()
+            return server._runner
+
+    assert run(scenario()) is None
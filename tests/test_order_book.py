@@ -0,0 +1,51 @@
+from conftest import run
+
+
+def test_cas_conflict_keeps_reject_reasons(monkeypatch):
+    import auctions.order_book as order_book
+
+    async def get_book(lot_id):
+        return order_book.LotBook(lot_id=lot_id, seller_id=1, title="Phone", current_price=1000, started=True)
+
+    async def commit_bids(book, accepted):
+        return False  # цену каждый раз успевает поменять другой процесс
+
+    monkeypatch.setattr(order_book, "get_book", get_book)
+    monkeypatch.setattr(order_book, "_commit_bids", commit_bids)
+
+    results = run(order_book.place_bids(7, [(10, 100), (1, 100), (11, 0), (12, 50)]))
+
+    assert [status for status, _ in results] == ["conflict", "own_lot", "too_low", "conflict"]
+
+
+def test_parse_event_formats():
+    from auctions.order_book import parse_event
+
+    assert parse_event("price:7:1500:42") == ("price", 7, 1500, 42)
+    assert parse_event("end:7:1500:") == ("end", 7, 1500, None)
+    # процессы прошлой версии шлют только цену
+    assert parse_event("7:1200:") == ("price", 7, 1200, None)
+    for bad in ("bid:7:1:", "7:x:", "start:7"):
+        try:
+            parse_event(bad)
+        except ValueError:
+            continue
+        raise AssertionError(bad)
+
+
+def test_remote_start_and_end_update_local_book(monkeypatch):
+    import auctions.logic as logic
+    import auctions.order_book as order_book
+
+    book = order_book.LotBook(lot_id=7, seller_id=1, title="Phone", current_price=0, started=False)
+    monkeypatch.setitem(order_book.order_books, 7, book)
+    dropped = []
+    monkeypatch.setattr(logic.channel_posts, "drop", dropped.append)
+
+    logic.apply_remote_event("start", 7, 1000)
+    assert book.started and book.current_price == 1000
+
+    logic.apply_remote_event("end", 7, 1500)
+    assert book.ended
+    assert 7 not in order_book.order_books
+    assert dropped == [7]
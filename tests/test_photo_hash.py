@@ -0,0 +1,87 @@
+import io
+
+from PIL import Image
+
+from conftest import run
+
+
+class FileBot:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def download(self, file_id, destination):
+        destination.write(self.data)
+        return destination
+
+
+def jpeg(size=(320, 240)) -> bytes:
+    buffer = io.BytesIO()
+    Image.linear_gradient("L").resize(size).convert("RGB").save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def test_hash_photo_in_process_pool():
+    from services import photo_hash
+
+    data = jpeg()
+
+    async def scenario():
+        try:
+            return await photo_hash.hash_photo(FileBot(data), "file"), photo_hash._pool._mp_context.get_start_method()
+        finally:
+            photo_hash.close()
+
+    phash, method = run(scenario())
+    assert phash == photo_hash.dhash(data)
+    assert method in ("forkserver", "spawn")
+
+
+def test_index_finds_near_duplicate_of_other_seller():
+    from services.photo_hash import PhotoIndex
+
+    index = PhotoIndex(max_distance=5, rebuild_every=4)
+    index.extend([0xF0F0F0F0F0F0F0F0, 0x0123456789ABCDEF], [1, 2], [100, 200])
+    index.rebuild()
+    index.add(0xFFFF0000FFFF0000, 3, 300)
+
+    assert index.find(0x0123456789ABCDEF ^ 0b10110) == (2, 3)
+    assert index.find(0x0123456789ABCDEF, exclude_seller=200) is None
+    assert index.find(0xFFFF0000FFFF0001) == (3, 1)
+    assert index.find(0x5555555555555555) is None
+
+
+def test_pool_workers_do_not_import_the_bot(tmp_path):
+    import os
+    import subprocess
+    import sys
+
+    # как bot.py: __main__ с настройками, БД и aiogram
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = tmp_path / "main.py"
+    script.write_text(
+        "import asyncio, sys\n"
+        f"sys.path.insert(0, {root!r})\n"
+        "import database\n"
+        "from services import photo_hash\n"
+        "class FileBot:\n"
+        "    def __init__(self, data):\n"
+        "        self.data = data\n"
+        "    async def download(self, file_id, destination):\n"
+        "        destination.write(self.data)\n"
+        "        return destination\n"
+        "async def main():\n"
+        f"    await photo_hash.hash_photo(FileBot({jpeg()!r}), 'file')\n"
+        "    modules = await asyncio.get_running_loop().run_in_executor(\n"
+        "        photo_hash._pool, eval, \"sorted(__import__('sys').modules)\")\n"
+        "    photo_hash.close()\n"
+        "    print(' '.join(modules))\n"
+        "if __name__ == '__main__':\n"
+        "    asyncio.run(main())\n"
+    )
+    env = dict(os.environ, PHOTO_HASH_WORKERS="1")
+    result = subprocess.run([sys.executable, str(script)], env=env, capture_output=True, text=True, timeout=60)
+
+    assert result.returncode == 0, result.stderr
+    modules = set(result.stdout.split())
+    assert "services.image_hash" in modules
+    assert not modules & {"config", "database", "models", "aiogram", "sqlalchemy", "services.photo_hash"}
@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from conftest import run
+
+
+def test_events_fire_in_time_order_and_cancel_skips():
+    from auctions.scheduler import AuctionScheduler, START, END
+
+    fired = []
+
+    async def scenario():
+        scheduler = AuctionScheduler()
+        scheduler.on(START, lambda lot_id: _record(fired, START, lot_id))
+        scheduler.on(END, lambda lot_id: _record(fired, END, lot_id))
+        now = datetime.now(timezone.utc)
+        scheduler.add(END, 1, now + timedelta(seconds=0.15))
+        scheduler.add(START, 1, now + timedelta(seconds=0.05))
+        scheduler.add(START, 2, now + timedelta(seconds=0.1))
+        scheduler.add(END, 2, now + timedelta(seconds=0.12))
+        scheduler.cancel(END, 2)
+        # перенос: срабатывает только новое время, старая запись в куче пропускается
+        scheduler.add(START, 3, now + timedelta(seconds=0.02))
+        scheduler.add(START, 3, now + timedelta(seconds=0.2))
+        assert scheduler.due_at(END, 2) is None
+        assert len(scheduler) == 4
+
+        scheduler.start()
+        await asyncio.sleep(0.4)
+        await scheduler.stop()
+        return len(scheduler)
+
+    left = run(scenario())
+
+    assert fired == [(START, 1), (START, 2), (END, 1), (START, 3)]
+    assert left == 0
+
+
+def test_events_of_one_lot_run_one_after_another():
+    from auctions.scheduler import AuctionScheduler, START, END
+
+    fired = []
+
+    async def slow_open(lot_id):
+        await asyncio.sleep(0.1)
+        fired.append((START, lot_id))
+
+    async def scenario():
+        scheduler = AuctionScheduler()
+        scheduler.on(START, slow_open)
+        scheduler.on(END, lambda lot_id: _record(fired, END, lot_id))
+        now = datetime.now(timezone.utc)
+        scheduler.add(START, 1, now)
+        scheduler.add(END, 1, now + timedelta(seconds=0.01))
+        scheduler.start()
+        await asyncio.sleep(0.2)
+        await scheduler.stop()
+
+    run(scenario())
+
+    assert fired == [(START, 1), (END, 1)]
+
+
+async def _record(fired, kind, lot_id):
+    fired.append((kind, lot_id))
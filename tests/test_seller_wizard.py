@@ -0,0 +1,98 @@
+import itertools
+
+from aiogram import Dispatcher
+from aiogram.methods import SendMediaGroup, SendMessage
+from aiogram.types import Update
+
+from conftest import make_bot, run
+
+USER = 42
+_ids = itertools.count(1)
+
+
+def message(text: str) -> dict:
+    return {
+        "update_id": next(_ids),
+        "message": {
+            "message_id": next(_ids),
+            "date": 1760000000,
+            "chat": {"id": USER, "type": "private"},
+            "from": {"id": USER, "is_bot": False, "first_name": "Seller"},
+            "text": text,
+        },
+    }
+
+
+def callback(data: str) -> dict:
+    return {
+        "update_id": next(_ids),
+        "callback_query": {
+            "id": str(next(_ids)),
+            "chat_instance": "1",
+            "from": {"id": USER, "is_bot": False, "first_name": "Seller"},
+            "message": {
+                "message_id": next(_ids),
+                "date": 1760000000,
+                "chat": {"id": USER, "type": "private"},
+                "text": "preview",
+            },
+            "data": data,
+        },
+    }
+
+
+def test_wizard_run_and_edit_round_trip():
+    from handlers import seller
+    from states import SellerStates
+
+    bot = make_bot()
+    dp = Dispatcher()
+    dp.include_router(seller.router)
+    answers = ["128 GB", "2022", "Всё работает", "91", "Нет", "+77001234567", "Нет"]
+
+    async def scenario():
+        context = dp.fsm.get_context(bot, chat_id=USER, user_id=USER)
+        await context.set_data({"title": "iPhone 13", "start_price": 90000, "images": [f"photo{i}" for i in range(5)]})
+        await context.set_state(seller.WIZARD_STEPS[seller.WIZARD_ORDER[0]].state)
+
+        prompts = []
+        for text in answers:
+            await dp.feed_update(bot, Update.model_validate(message(text), context={"bot": bot}))
+            prompts.append(bot.session.requests[-1])
+        after_run = (await context.get_state(), await context.get_data())
+
+        await dp.feed_update(bot, Update.model_validate(callback("edit_year"), context={"bot": bot}))
+        edit_prompt = bot.session.requests[-1]
+        editing = (await context.get_state(), (await context.get_data())["edit_mode"])
+        await dp.feed_update(bot, Update.model_validate(message("2021"), context={"bot": bot}))
+        after_edit = (await context.get_state(), await context.get_data())
+        return prompts, after_run, edit_prompt, editing, after_edit
+
+    try:
+        prompts, after_run, edit_prompt, editing, after_edit = run(scenario())
+    finally:
+        seller.router._parent_router = None
+
+    # каждый ответ, кроме последнего, получает вопрос следующего шага
+    expected = [seller.WIZARD_STEPS[field].prompt for field in seller.WIZARD_ORDER[1:]]
+    assert [request.text for request in prompts[:-1]] == expected
+    # после последнего шага — фото и предпросмотр с кнопками
+    preview = prompts[-1]
+    assert isinstance(preview, SendMessage)
+    assert "Предпросмотр лота" in preview.text
+    assert any(isinstance(request, SendMediaGroup) for request in bot.session.requests)
+
+    state, data = after_run
+    assert state == SellerStates.start_price.state
+    assert {field: data[field] for field in seller.WIZARD_ORDER} == dict(zip(seller.WIZARD_ORDER, answers))
+    assert data["edit_mode"] is False
+
+    assert edit_prompt.text == seller.WIZARD_STEPS["year"].edit_prompt
+    assert editing == (SellerStates.year.state, True)
+
+    state, data = after_edit
+    assert state == SellerStates.start_price.state
+    assert data["year"] == "2021"
+    assert data["memory"] == "128 GB"
+    assert data["edit_mode"] is False
+    assert "2021" in bot.session.requests[-1].text
@@ -0,0 +1,21 @@
+import json
+
+
+def test_sink_writes_in_background_and_flushes_on_close(tmp_path):
+    from services.tracing import JsonlSink
+
+    path = tmp_path / "traces.jsonl"
+    sink = JsonlSink(str(path))
+    for i in range(3):
+        sink.write({"trace_id": str(i), "name": "update"})
+    sink.close()
+    sink.write({"trace_id": "3", "name": "update"})
+    sink.close()
+
+    assert [json.loads(line)["trace_id"] for line in path.read_text().splitlines()] == ["0", "1", "2", "3"]
+
+
+def test_tracing_is_off_by_default():
+    from config import Settings
+
+    assert Settings.model_fields["trace_path"].default == ""
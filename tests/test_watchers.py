@@ -0,0 +1,50 @@
+from sqlalchemy import select, update
+
+from conftest import run
+
+
+def test_registry_keeps_only_open_lots(db):
+    from database import async_session, read_session
+    from models import Lot, LotStatus, Watcher
+    from auctions.watchers import WatcherRegistry
+
+    async def add_lot(**fields):
+        async with async_session() as session:
+            lot = Lot(title="Phone", description="d", start_price=1000, seller_id=1, **fields)
+            session.add(lot)
+            await session.commit()
+        return lot.id
+
+    async def scenario():
+        registry = WatcherRegistry(flush_interval=0.01)
+        running = await add_lot(status=LotStatus.approved, auction_started=True)
+        ended = await add_lot(status=LotStatus.approved, auction_ended=True)
+        pending = await add_lot(status=LotStatus.pending)
+        try:
+            statuses = [
+                await registry.subscribe(running, 10),
+                await registry.subscribe(running, 10),
+                await registry.subscribe(ended, 10),
+                await registry.subscribe(pending, 10),
+                await registry.subscribe(424242, 10),
+            ]
+            cached = set(registry._lots)
+            await registry.flush()
+
+            async with async_session() as session:
+                await session.execute(update(Lot).where(Lot.id == running).values(auction_ended=True))
+                await registry.prune(session, running)
+                await session.commit()
+            after_close = (set(registry._lots), await registry.subscribe(running, 11), await registry.get(running))
+            async with read_session() as session:
+                rows = (await session.execute(select(Watcher.lot_id, Watcher.user_id))).all()
+        finally:
+            await registry.close()
+        return statuses, cached, after_close, rows
+
+    statuses, cached, after_close, rows = run(scenario())
+
+    assert statuses == ["subscribed", "already", "closed", "closed", "closed"]
+    assert len(cached) == 1
+    assert after_close == (set(), "closed", set())
+    assert rows == []
@@ -0,0 +1,66 @@
+from aiogram import Dispatcher, Router
+from aiogram.types import Message
+from aiohttp.test_utils import TestClient, TestServer
+
+from conftest import make_bot, run
+
+# обновление в том виде, в каком его присылает Telegram
+UPDATE = {
+    "update_id": 100500,
+    "message": {
+        "message_id": 12,
+        "date": 1760000000,
+        "chat": {"id": 42, "type": "private", "first_name": "Test"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+        "text": "/start",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    },
+}
+
+
+def test_posted_update_reaches_handler(monkeypatch):
+    from services.webhook import make_webhook_app
+    from config import settings
+
+    monkeypatch.setattr(settings, "webhook_secret", "s3cret")
+    seen = []
+    router = Router()
+
+    @router.message()
+    async def on_message(message: Message):
+        seen.append((message.chat.id, message.text))
+
+    dp = Dispatcher()
+    dp.include_router(router)
+
+    async def scenario():
+        app, handler = make_webhook_app(dp, make_bot())
+        async with TestClient(TestServer(app)) as client:
+            forged = await client.post(settings.webhook_path, json=UPDATE)
+            response = await client.post(
+                settings.webhook_path, json=UPDATE,
+                headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"},
+            )
+            await handler.drain(timeout=5)
+            stopped = await client.post(
+                settings.webhook_path, json=UPDATE,
+                headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"},
+            )
+        return forged.status, response.status, stopped.status
+
+    forged, status, stopped = run(scenario())
+
+    assert forged == 401
+    assert status == 200
+    assert seen == [(42, "/start")]
+    # после drain Telegram получает 503 и повторит доставку позже
+    assert stopped == 503
+
+
+def test_unknown_bot_mode_is_rejected():
+    import pytest
+    from pydantic import ValidationError
+    from config import Settings
+
+    with pytest.raises(ValidationError):
+        Settings(bot_mode="webhok")